@@ -0,0 +1,174 @@
+'''
+This module keeps parsed and indexed quality criteria of many projects.
+It serves as a support module for automation/qualitycriteria.
+'''
+import os
+import sys
+import time
+import threading
+from itertools import islice
+from collections import OrderedDict
+
+CT_DEFAULT_CACHE_REVALIDATE = 2.0
+CT_DEFAULT_CACHE_BUDGET_MB = 64
+# Elements measured per container when estimating memory usage
+CT_SIZE_SAMPLE = 32
+
+
+class CriteriaCache:
+    '''
+    LRU cache of loaded criteria keyed by project name.
+    Entries are revalidated by file mtime and size, at most once every
+    revalidate seconds, so repeated project switches do not touch disk.
+    Least recently used projects are evicted above the memory budget.
+    Catalog connections of evicted or reloaded projects are closed; a
+    session still using one reopens it on its next query.
+    '''
+    def __init__(
+            self,
+            revalidate=CT_DEFAULT_CACHE_REVALIDATE,
+            budget_mb=CT_DEFAULT_CACHE_BUDGET_MB
+    ):
+        '''
+        Args:
+        - revalidate (float): seconds an entry is trusted without stat.
+        - budget_mb (float): memory budget for all cached projects.
+        '''
+        self.revalidate = revalidate
+        self.budget = budget_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        # project -> {'path', 'stat', 'checked_at', 'data', 'nbytes'}
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, project, locate, load):
+        '''
+        Returns cached data of a project, loading it if missing or stale.
+        Args:
+        - project (str): project name.
+        - locate (callable): project -> file path, raises
+          FileNotFoundError if the project has no file.
+        - load (callable): file path -> loaded data.
+        Returns:
+        - data: value returned by load.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(project)
+            if entry is not None:
+                self._entries.move_to_end(project)
+                if now - entry['checked_at'] < self.revalidate:
+                    self.hits += 1
+                    return entry['data']
+
+        # Cheap revalidation: file unchanged since it was loaded
+        if entry is not None and self._stat(entry['path']) == entry['stat']:
+            with self._lock:
+                entry['checked_at'] = now
+                self.hits += 1
+            return entry['data']
+
+        path = locate(project)
+        stat = self._stat(path)
+        data = load(path)
+        self._store(project, path, stat, data, now)
+        return data
+
+    def invalidate(self, project=None):
+        '''
+        Drop one project, or every project if none is given.
+        Args:
+        - project (str, optional): project name.
+        '''
+        dropped = []
+        with self._lock:
+            projects = [project] if project else list(self._entries)
+            for name in projects:
+                entry = self._entries.pop(name, None)
+                if entry is not None:
+                    self._nbytes -= entry['nbytes']
+                    dropped.append(entry)
+        for entry in dropped:
+            self._close_entry(entry)
+
+    def status(self):
+        '''
+        Returns cache status.
+        Returns:
+        - status (dict): cached projects, memory usage and hit counters.
+        '''
+        with self._lock:
+            return {
+                'projects': list(self._entries),
+                'nbytes': self._nbytes,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def _store(self, project, path, stat, data, now):
+        ''' Store a loaded project and evict LRU entries over budget. '''
+        nbytes = self._estimate_size(data)
+        dropped = []
+        with self._lock:
+            self.misses += 1
+            old = self._entries.pop(project, None)
+            if old is not None:
+                self._nbytes -= old['nbytes']
+                dropped.append(old)
+            self._entries[project] = {
+                'path': path,
+                'stat': stat,
+                'checked_at': now,
+                'data': data,
+                'nbytes': nbytes
+            }
+            self._nbytes += nbytes
+            # Keep at least the project just loaded
+            while self._nbytes > self.budget and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted['nbytes']
+                dropped.append(evicted)
+        for entry in dropped:
+            if entry['data'] is not data:
+                self._close_entry(entry)
+
+    def _close_entry(self, entry):
+        '''
+        Close the catalog connection of a dropped entry, if any.
+        '''
+        data = entry['data']
+        if isinstance(data, dict) and data.get('catalog') is not None:
+            data['catalog'].close()
+
+    def _stat(self, path):
+        '''
+        Returns (mtime, size) of a file, None if it does not exist.
+        '''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _estimate_size(self, data):
+        '''
+        Rough deep size of nested containers of strings, in bytes.
+        Large containers are extrapolated from a sample of their elements.
+        '''
+        size = sys.getsizeof(data)
+        if isinstance(data, dict):
+            sample = list(islice(data.items(), CT_SIZE_SAMPLE))
+        elif isinstance(data, (list, tuple)):
+            step = max(1, len(data) // CT_SIZE_SAMPLE)
+            sample = data[::step][:CT_SIZE_SAMPLE]
+        elif isinstance(data, (set, frozenset)):
+            sample = list(islice(data, CT_SIZE_SAMPLE))
+        else:
+            return size
+        if sample:
+            sample_size = sum(self._estimate_size(item) for item in sample)
+            size += sample_size * len(data) // len(sample)
+        return size
@@ -0,0 +1,351 @@
+'''
+    criteriacatalog.py module
+
+    Compile project criteria CSV files into indexed SQLite catalogs and
+    query them without loading every row in memory.
+
+    Catalog layout:
+    - criteria: (defect, quality, finish) normalized key -> criteria,
+      clustered primary key, so lookups never touch a second b-tree.
+      Prefix ranges of the key and a (quality, finish) index answer the
+      dependent selection options.
+    - options: precomputed sorted values of each selection column.
+    - meta: source CSV mtime and size, used to detect stale catalogs.
+
+    # Usage:
+    pipenv run python -m handheld.automation.criteriacatalog \
+        --config handheld/config/config.yaml [csv_file ...]
+'''
+import argparse
+import csv
+import glob
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import closing
+
+CT_CATALOG_EXTENSION = '.sqlite'
+CT_CATALOG_VERSION = '2'
+CT_INSERT_BATCH = 1000
+
+# Catalog path -> lock, one compile per catalog at a time
+_compile_locks = {}
+_compile_locks_lock = threading.Lock()
+
+
+def get_catalog_path(csv_path, catalog_dir=None):
+    '''
+    Returns the catalog path of a CSV file.
+    Args:
+    - csv_path (str): project CSV file.
+    - catalog_dir (str, optional): catalogs directory, CSV directory if
+      not given.
+    '''
+    base_name = os.path.splitext(os.path.basename(csv_path))[0]
+    catalog_dir = catalog_dir or os.path.dirname(csv_path)
+    return os.path.join(catalog_dir, f'{base_name}{CT_CATALOG_EXTENSION}')
+
+
+def _source_stamp(csv_path):
+    ''' Returns source CSV stamp stored in catalog meta. '''
+    stat = os.stat(csv_path)
+    return f'{CT_CATALOG_VERSION}:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def is_catalog_fresh(csv_path, catalog_path):
+    '''
+    Check that a catalog exists and was compiled from the current CSV.
+    '''
+    if not os.path.exists(catalog_path):
+        return False
+    try:
+        db = sqlite3.connect(f'file:{catalog_path}?mode=ro', uri=True)
+        with closing(db):
+            row = db.execute(
+                "SELECT value FROM meta WHERE key = 'source'"
+            ).fetchone()
+    except sqlite3.Error:
+        return False
+    return row is not None and row[0] == _source_stamp(csv_path)
+
+
+def update_catalog(csv_path, catalog_path, csv_config):
+    '''
+    Compile a catalog unless it is fresh. Concurrent calls for the same
+    catalog wait for a single compile.
+    Args:
+    - csv_path (str): project CSV file.
+    - catalog_path (str): catalog file.
+    - csv_config (dict): 'csv' section of the app config (keywords).
+    Returns:
+    - compiled (bool): True if the catalog was compiled.
+    '''
+    if is_catalog_fresh(csv_path, catalog_path):
+        return False
+    key = os.path.abspath(catalog_path)
+    with _compile_locks_lock:
+        lock = _compile_locks.setdefault(key, threading.Lock())
+    with lock:
+        # Compiled by another thread while waiting
+        if is_catalog_fresh(csv_path, catalog_path):
+            return False
+        compile_catalog(csv_path, catalog_path, csv_config)
+    return True
+
+
+def compile_catalog(csv_path, catalog_path, csv_config):
+    '''
+    Compile a criteria CSV file into a SQLite catalog.
+    Rows are streamed, the catalog is written to a unique temporary file
+    in the catalog directory and atomically renamed. Use update_catalog()
+    to compile on demand.
+    Args:
+    - csv_path (str): project CSV file.
+    - catalog_path (str): output catalog file.
+    - csv_config (dict): 'csv' section of the app config (keywords).
+    Returns:
+    - n_rows (int): number of criteria rows read.
+    '''
+    stamp = _source_stamp(csv_path)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(catalog_path) or '.',
+        prefix=f'{os.path.basename(catalog_path)}.',
+        suffix='.tmp'
+    )
+    os.close(fd)
+    try:
+        n_rows = _write_catalog(tmp_path, csv_path, csv_config, stamp)
+        os.replace(tmp_path, catalog_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return n_rows
+
+
+def _write_catalog(tmp_path, csv_path, csv_config, stamp):
+    '''
+    Write the catalog tables of a CSV file to tmp_path.
+    Returns:
+    - n_rows (int): number of criteria rows read.
+    '''
+    db = sqlite3.connect(tmp_path)
+    n_rows = 0
+    try:
+        db.executescript(
+            '''
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE criteria (
+                defect TEXT, quality TEXT, finish TEXT, criteria TEXT,
+                PRIMARY KEY (defect, quality, finish)
+            ) WITHOUT ROWID;
+            CREATE INDEX criteria_quality ON criteria (quality, finish);
+            CREATE TABLE options (
+                col TEXT, position INTEGER, value TEXT,
+                PRIMARY KEY (col, position)
+            ) WITHOUT ROWID;
+            '''
+        )
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            headers = next(reader, None)
+            if headers is None:
+                raise ValueError(f'CSV file is empty: {csv_path}')
+
+            indexes = [
+                headers.index(csv_config[keyword])
+                if csv_config[keyword] in headers else None
+                for keyword in (
+                    'defect_keyword',
+                    'quality_keyword',
+                    'finish_keyword',
+                    'criteria_keyword'
+                )
+            ]
+            values = {'defect': set(), 'quality': set(), 'finish': set()}
+            batch = []
+            for row in reader:
+                n_rows += 1
+                for col, index in zip(values, indexes):
+                    if index is not None and len(row) > index:
+                        values[col].add(row[index].strip().upper())
+                if None in indexes or len(row) <= max(indexes):
+                    continue
+                batch.append(
+                    tuple(row[index].strip().lower() for index in indexes[:3])
+                    + (row[indexes[3]],)
+                )
+                if len(batch) >= CT_INSERT_BATCH:
+                    # First matching row wins, as in the CSV lookup
+                    db.executemany(
+                        'INSERT OR IGNORE INTO criteria VALUES (?, ?, ?, ?)',
+                        batch
+                    )
+                    batch = []
+            db.executemany(
+                'INSERT OR IGNORE INTO criteria VALUES (?, ?, ?, ?)',
+                batch
+            )
+
+        db.executemany(
+            'INSERT INTO options VALUES (?, ?, ?)',
+            [
+                (col, position, value)
+                for col, col_values in values.items()
+                for position, value in enumerate(sorted(col_values))
+            ]
+        )
+        db.execute("INSERT INTO meta VALUES ('source', ?)", (stamp,))
+        db.commit()
+    finally:
+        db.close()
+    return n_rows
+
+
+class CriteriaCatalog:
+    '''
+    Read-only access to a compiled criteria catalog.
+    The database is opened lazily on first query; selection options are
+    read once, criteria are looked up by primary key on demand.
+    '''
+    def __init__(self, catalog_path):
+        '''
+        Args:
+        - catalog_path (str): compiled catalog file.
+        '''
+        self.catalog_path = catalog_path
+        self._db = None
+        self._options = None
+        self._lock = threading.Lock()
+
+    def get_values(self, column):
+        '''
+        Returns sorted option values of a selection column.
+        Args:
+        - column (str): 'defect', 'quality' or 'finish'.
+        '''
+        with self._lock:
+            if self._options is None:
+                self._options = {'defect': [], 'quality': [], 'finish': []}
+                rows = self._connect().execute(
+                    'SELECT col, value FROM options ORDER BY col, position'
+                )
+                for col, value in rows:
+                    self._options[col].append(value)
+            return self._options.get(column, [])
+
+    def get_criteria(self, defect, quality, finish):
+        '''
+        Returns criteria for given selection, None if not found.
+        '''
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT criteria FROM criteria '
+                'WHERE defect = ? AND quality = ? AND finish = ?',
+                tuple(
+                    value.strip().lower()
+                    for value in (defect, quality, finish)
+                )
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_options(self, defect, quality):
+        '''
+        Returns valid surface quality and finish options for a partial
+        selection. See QualityCriteria.get_options().
+        Args:
+        - defect, quality (str): normalized selection, may be empty.
+        '''
+        if defect:
+            qualities = self._distinct(
+                'SELECT DISTINCT quality FROM criteria WHERE defect = ?',
+                (defect,)
+            )
+        else:
+            qualities = self.get_values('quality')
+
+        if defect and quality:
+            finishes = self._distinct(
+                'SELECT finish FROM criteria '
+                'WHERE defect = ? AND quality = ?',
+                (defect, quality)
+            )
+        elif defect:
+            finishes = self._distinct(
+                'SELECT DISTINCT finish FROM criteria WHERE defect = ?',
+                (defect,)
+            )
+        elif quality:
+            finishes = self._distinct(
+                'SELECT DISTINCT finish FROM criteria WHERE quality = ?',
+                (quality,)
+            )
+        else:
+            finishes = self.get_values('finish')
+
+        return {'surface-quality': qualities, 'finish': finishes}
+
+    def get_items(self):
+        '''
+        Returns every (defect, quality, finish, criteria) normalized row.
+        '''
+        with self._lock:
+            return self._connect().execute(
+                'SELECT defect, quality, finish, criteria FROM criteria'
+            ).fetchall()
+
+    def _distinct(self, query, params):
+        ''' Returns sorted uppercase values of a single column query. '''
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        return sorted({row[0].upper() for row in rows})
+
+    def close(self):
+        ''' Close database connection. '''
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _connect(self):
+        ''' Lazily open read-only connection. '''
+        if self._db is None:
+            self._db = sqlite3.connect(
+                f'file:{self.catalog_path}?mode=ro',
+                uri=True,
+                check_same_thread=False
+            )
+        return self._db
+
+
+def main():
+    from ais.infrastructure.readconfig import read_yaml_file
+
+    parser = argparse.ArgumentParser(
+        description='Compile project criteria CSV files into catalogs.'
+    )
+    parser.add_argument('--config', default='handheld/config/config.yaml')
+    parser.add_argument(
+        'csv_files',
+        nargs='*',
+        help='CSV files to compile, every project CSV if not given.'
+    )
+    args = parser.parse_args()
+
+    csv_config = read_yaml_file(args.config)['csv']
+    csv_files = args.csv_files or sorted(
+        glob.glob(os.path.join(csv_config['path'], '*_*.csv'))
+    )
+    for csv_path in csv_files:
+        catalog_path = get_catalog_path(
+            csv_path,
+            csv_config.get('catalog_path')
+        )
+        n_rows = compile_catalog(csv_path, catalog_path, csv_config)
+        print(f'{csv_path} -> {catalog_path} ({n_rows} rows)')
+
+
+if __name__ == '__main__':
+    main()
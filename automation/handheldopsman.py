@@ -1,10 +1,8 @@
-import cv2
 import time
 
-from handheld.camera.camera import VideoCam
 from handheld.automation.qualitycriteria import QualityCriteria
 from handheld.automation.guidelines import GuidelineSelector
-from handheld.io.localoutput import LocalOutput
+from handheld.automation.handheldresources import HandheldResources
 from handheld.utils.timestamp import generate_timestamp, get_current_date
 from handheld.utils.filenamebuilder import (
     generate_defect_name,
@@ -19,29 +17,55 @@ class HandheldOpsManager:
     capturing context and detailed photos,
     detecting defects, and generating reports.
     '''
-    def __init__(self, config):
+    def __init__(self, config, resources=None):
         '''
         Initializes the HandheldOpsManager instance.
+        Args:
+        - config (dict): app config.
+        - resources (HandheldResources, optional): camera, caches and
+          storage shared between sessions. Created and owned by this
+          instance if not given.
         '''
         self.config = config
-        self._vc = VideoCam(config)
-        self.qc = QualityCriteria(config)
+        self._owns_resources = resources is None
+        if resources is None:
+            resources = HandheldResources(config)
+        self.resources = resources
+        self.cameras = resources.cameras
+        self._vc = resources.video_cam
+        self.encoder = resources.encoder
+        self.qc = QualityCriteria(
+            config,
+            cache=resources.criteria_cache,
+            registry=resources.registry
+        )
         self.gs = GuidelineSelector()
-        self.lo = LocalOutput(config)
+        self.lo = resources.local_output
+        self.images = resources.images
+        self.reports = resources.reports
         self.last_frame = None
+        self.last_frame_seq = None
+        self.last_frame_cam = None
+        self.last_jpeg = None
         self.current_defect_data = {
             'defect_type': '',
             'surface_quality': '',
             'finish': '',
-            'criteria': ''
+            'criteria': '',
+            'defect_name': ''
         }
         self.n_inspection = 1
         self.current_date = ''
-
-        self._available_projects = self.qc.discover_available_projects()
+        self.report_job = None
 
         self._cached_data = {}
+        # Images are kept in the image store, these map report slots
+        # (i.e. 'image-partid') to image digests
         self._cached_images = {}
+        # Report pages kept on confirmation, page number -> page
+        self._report_pages = {}
+        # Images shown in report slots of the current page
+        self._page_images = {}
 
     def get_available_projects(self):
         '''
@@ -49,7 +73,7 @@ class HandheldOpsManager:
         Returns:
         - list: Available project names
         '''
-        return self._available_projects
+        return self.qc.discover_available_projects()
 
     def inspector_state(self, inspector):
         '''
@@ -119,7 +143,11 @@ class HandheldOpsManager:
         next_state = 'selection_state'
 
         # Store invariant images to inspection
-        self._cached_images['image-partid'] = self.video_capture_image()
+        self._set_image(
+            self._cached_images,
+            'image-partid',
+            self.video_capture_image()
+        )
 
         return next_state, self.n_inspection
 
@@ -127,7 +155,8 @@ class HandheldOpsManager:
             self,
             defect_type,
             surface_quality,
-            finish
+            finish,
+            defect_name=''
     ):
         '''
         Process defect selection criteria.
@@ -136,6 +165,7 @@ class HandheldOpsManager:
         - defect_type (str): User's selected defect type.
         - surface_quality (str): User's selected surface quality.
         - finish (str): User's selected finish.
+        - defect_name (str, optional): Defect title shown in the report.
         Returns:
         - next_state (str): Next state to transition to.
         - criteria_data (dict): Criteria data for the selected parameters.
@@ -145,6 +175,7 @@ class HandheldOpsManager:
         self.current_defect_data['defect_type'] = defect_type
         self.current_defect_data['surface_quality'] = surface_quality
         self.current_defect_data['finish'] = finish
+        self.current_defect_data['defect_name'] = defect_name or ''
         self.current_defect_data['criteria'] = self.qc.get_criteria(
             self.current_defect_data['defect_type'],
             self.current_defect_data['surface_quality'],
@@ -156,6 +187,27 @@ class HandheldOpsManager:
             self.n_inspection
         )
 
+    def criteria_matrix(self):
+        '''
+        Returns the criteria matrix of the current project.
+        Returns:
+        - (version, json_bytes, gzip_bytes) tuple, or None if no project
+          is set.
+        '''
+        return self.qc.get_matrix()
+
+    def selection_options(self, defect_type, surface_quality):
+        '''
+        Returns valid options for a partial defect selection.
+        Args:
+        - defect_type (str): User's selected defect type, may be empty.
+        - surface_quality (str): User's selected surface quality, may be
+          empty.
+        Returns:
+        - options (dict): 'surface-quality' and 'finish' option lists.
+        '''
+        return self.qc.get_options(defect_type, surface_quality)
+
     def criteria_state(self, front_action):
         '''
         Process criteria evaluation for the selected defect.
@@ -235,8 +287,14 @@ class HandheldOpsManager:
 
         elif front_action == 'drop':
             action = 'drop'
+            self._release_page(self._report_pages.pop(self.n_inspection, None))
+            self.images.release(self._page_images.values())
+            self._page_images = {}
             self.n_inspection -= 1
 
+        else:
+            self._keep_report_page()
+
         return next_state, n_inspection, action, cached_data, cached_images
 
     def end_state(self, front_action, raw_defect_type):
@@ -270,12 +328,18 @@ class HandheldOpsManager:
             # Generate file name
             image_file_name = generate_image_file_name(
                 timestamp,
-                image_defect_type
+                image_defect_type,
+                self.lo.get_extension()
             )
             # Generate local path
             image_local_path = self.lo.generate_local_path(image_file_name)
-            # Save image
-            self.lo.imwrite(self.last_frame, image_local_path)
+            # Save image in background, response does not wait for disk.
+            # Captured JPEG bytes are reused, no re-encode if possible.
+            self.lo.imwrite_async(
+                self.last_frame,
+                image_local_path,
+                jpeg_bytes=self.last_jpeg
+            )
 
         if front_action == 'more':
             # More inspections on same part
@@ -291,6 +355,7 @@ class HandheldOpsManager:
         elif front_action == 'print':
             next_state = 'end_state'
             action = 'print'
+            self.report_job = self.print_report()
 
         elif front_action == 'new':
             # New part - go to standby to select new project and part
@@ -301,7 +366,11 @@ class HandheldOpsManager:
             cached_data = {
                 'technician': self._cached_data.get('technician', ''),
             }
+            self.images.release(self._cached_images.values())
             self._cached_images = {}
+            for page in self._report_pages.values():
+                self._release_page(page)
+            self._report_pages = {}
 
         return (
             next_state,
@@ -328,33 +397,219 @@ class HandheldOpsManager:
 
         self.n_inspection -= 1
 
+        # Renumber following pages, as the frontend does
+        pages = sorted(self._report_pages.items())
+        self._report_pages = {}
+        for number, page in pages:
+            if number == int(n_page):
+                self._release_page(page)
+                continue
+            if number > int(n_page):
+                number -= 1
+                page['text']['page-number'] = number
+                page['text']['defect-number'] = number
+            self._report_pages[number] = page
+
         return next_state
 
-    def video_capture_image(self):
+    def record_report_image(self, slot, image_bytes):
+        '''
+        Keep an image shown in a report slot of the current page.
+        Args:
+        - slot (str): report fill class (i.e. 'image-context').
+        - image_bytes (bytes): encoded image.
+        Returns:
+        - digest (str): image key in the image store.
+        '''
+        if slot in self._cached_images:
+            images = self._cached_images
+        else:
+            images = self._page_images
+        return self._set_image(images, slot, image_bytes)
+
+    def print_report(self):
+        '''
+        Queue the PDF report of the kept pages of the current part.
+        Returns:
+        - job_id (str): report job id, see ReportJobs.
+        '''
+        pages = [
+            {'text': dict(page['text']), 'images': dict(page['images'])}
+            for _, page in sorted(self._report_pages.items())
+        ]
+        # Job owns a reference to its images until it finishes
+        for page in pages:
+            self.images.incref(page['images'].values())
+        title = '_'.join(
+            str(self._cached_data.get(key, ''))
+            for key in ('project', 'inspected-part', 'serial-number', 'date')
+        )
+        return self.reports.submit(
+            pages,
+            title='Inspection_Report',
+            file_name=f'Inspection_Report_{title}'
+        )
+
+    def _keep_report_page(self):
+        '''
+        Store the current page with its data and images, for server side
+        report generation.
+        '''
+        # Page owns the current page images and shares the invariant ones
+        self.images.incref(self._cached_images.values())
+        self._release_page(self._report_pages.get(self.n_inspection))
+        self._report_pages[self.n_inspection] = {
+            'text': {
+                **self._cached_data,
+                'defect-name': self.current_defect_data['defect_name'],
+                'criteria': self.current_defect_data['criteria'],
+                'defect-number': self.n_inspection,
+                'page-number': self.n_inspection
+            },
+            'images': {**self._cached_images, **self._page_images}
+        }
+        self._page_images = {}
+
+    def _set_image(self, images, slot, image_bytes):
+        '''
+        Store the image of a slot, releasing the one it replaces.
+        Args:
+        - images (dict): slot -> digest mapping to update.
+        - slot (str): report fill class.
+        - image_bytes (bytes): encoded image, may be None.
+        Returns:
+        - digest (str)
+        '''
+        digest = self.images.put(
+            image_bytes,
+            self.config['stream']['capture_encode']
+        )
+        self.images.release([images.get(slot)])
+        images[slot] = digest
+        return digest
+
+    def _release_page(self, page):
+        ''' Release images of a report page, if any. '''
+        if page is not None:
+            self.images.release(page['images'].values())
+
+    def video_capture_image(self, cam=None):
         '''
         Captures a frame through the VideoCam module and encodes
         the image to JPEG.
+        Args:
+        - cam (str, optional): camera id, default camera if not given.
         Returns:
         - data (bytes): if not None, encoded frame.
+        Raises:
+        - KeyError: unknown camera.
         '''
-        self.last_frame = self._vc.capture_image()
         data = None
-
-        if self.last_frame is not None:
-            enc_success, buffer = cv2.imencode(
-                self.config['stream']['capture_encode'],
-                self.last_frame
-            )
-            if enc_success:
-                data = buffer.tobytes()
+        encode_format = self.config['stream']['capture_encode']
+        if cam is None:
+            cam = self.cameras.default_id
+        video_cam = self.cameras.get(cam)
+
+        # Passthrough: camera JPEG bytes are served as is, frame is
+        # decoded only if needed later
+        if video_cam.passthrough and encode_format == '.jpg':
+            self.last_frame_seq, self.last_frame = None, None
+            self.last_frame_cam, self.last_jpeg = cam, None
+            packet = video_cam.capture_jpeg()
+            if packet is not None:
+                self.last_frame_seq, _, self.last_jpeg = packet
+                data = self.last_jpeg
+            return data
+
+        # Repeated requests for the same frame (i.e. screen and report
+        # images) reuse the last copy, encoder returns the cached bytes
+        seq, frame = self.last_frame_seq, self.last_frame
+        if frame is None or cam != self.last_frame_cam or \
+                seq != video_cam.frame_seq():
+            seq, frame = None, None
+            packet = video_cam.capture_frame()
+            if packet is not None:
+                seq, _, frame = packet
+            self.last_frame_seq, self.last_frame = seq, frame
+            self.last_frame_cam, self.last_jpeg = cam, None
+
+        if frame is not None:
+            # Sequence numbers are per camera
+            data = self.encoder.encode((cam, seq), frame, encode_format)
+            # Keep JPEG bytes, storage can reuse them
+            if encode_format == '.jpg':
+                self.last_jpeg = data
 
         return data
 
-    def video_encode_stream(self):
+    def video_encode_stream(self, cam=None):
         '''
         Gets an encoded video stream from the VideoCam module.
+        Args:
+        - cam (str, optional): camera id, default camera if not given.
         Returns:
         - streamer: Frame generator for video streaming.
+        Raises:
+        - KeyError: unknown camera.
         '''
-        streamer = self._vc.encoded_streamer()
+        streamer = self.cameras.get(cam).encoded_streamer()
         return streamer
+
+    def cached_image(self, slot):
+        '''
+        Returns the image digest of an invariant report slot, None if not
+        captured.
+        Args:
+        - slot (str): report fill class (i.e. 'image-partid').
+        '''
+        return self._cached_images.get(slot)
+
+    def has_report_pages(self):
+        '''
+        Returns True if the inspection holds report pages not printed yet.
+        '''
+        return bool(self._report_pages)
+
+    def memory_usage(self):
+        '''
+        Rough memory held by this inspection: last capture and report
+        images it references.
+        Returns:
+        - nbytes (int)
+        '''
+        nbytes = len(self.last_jpeg or b'')
+        if self.last_frame is not None:
+            nbytes += self.last_frame.nbytes
+        digests = set(self._cached_images.values())
+        digests.update(self._page_images.values())
+        for page in list(self._report_pages.values()):
+            digests.update(page['images'].values())
+        return nbytes + self.images.size(digests)
+
+    def release(self):
+        '''
+        Release report images of this inspection. Owned resources are
+        released too: pending image writes are flushed and the camera
+        closed.
+        '''
+        self.images.release(self._cached_images.values())
+        self.images.release(self._page_images.values())
+        for page in self._report_pages.values():
+            self._release_page(page)
+        self._cached_images, self._page_images = {}, {}
+        self._report_pages = {}
+        self.last_frame, self.last_jpeg = None, None
+        if self._owns_resources:
+            self.resources.release()
+
+    def video_stream_stats(self, cam=None):
+        '''
+        Gets streaming pacing statistics from the VideoCam module.
+        Args:
+        - cam (str, optional): camera id, default camera if not given.
+        Returns:
+        - stats (dict): achieved versus target fps, None if not streaming.
+        Raises:
+        - KeyError: unknown camera.
+        '''
+        return self.cameras.get(cam).stream_stats()
@@ -0,0 +1,73 @@
+'''
+This module creates the resources shared by every inspection session:
+cameras, encoder, criteria caches, storage, image store and report jobs.
+It serves as a support module for automation/handheldopsman.
+'''
+from handheld.camera.cameramanager import CameraManager
+from handheld.camera.imageencoder import (
+    ImageEncoder,
+    CT_DEFAULT_ENCODER_WORKERS,
+    CT_DEFAULT_ENCODER_CACHE
+)
+from handheld.automation.criteriacache import (
+    CriteriaCache,
+    CT_DEFAULT_CACHE_REVALIDATE,
+    CT_DEFAULT_CACHE_BUDGET_MB
+)
+from handheld.automation.projectregistry import (
+    ProjectRegistry,
+    CT_DEFAULT_POLL_INTERVAL
+)
+from handheld.automation.imagestore import ImageStore
+from handheld.automation.reportjobs import ReportJobs
+from handheld.io.localoutput import LocalOutput
+
+
+class HandheldResources:
+    '''
+    Process wide resources, created once and injected in every
+    HandheldOpsManager.
+    '''
+    def __init__(self, config):
+        '''
+        Args:
+        - config (dict): app config.
+        '''
+        self.config = config
+        self.cameras = CameraManager(config)
+        # Default camera
+        self.video_cam = self.cameras.get()
+        self.encoder = ImageEncoder(
+            workers=config['stream'].get(
+                'encoder_workers', CT_DEFAULT_ENCODER_WORKERS
+            ),
+            cache_size=config['stream'].get(
+                'encoder_cache', CT_DEFAULT_ENCODER_CACHE
+            )
+        )
+        self.criteria_cache = CriteriaCache(
+            revalidate=config['csv'].get(
+                'cache_revalidate', CT_DEFAULT_CACHE_REVALIDATE
+            ),
+            budget_mb=config['csv'].get(
+                'cache_budget_mb', CT_DEFAULT_CACHE_BUDGET_MB
+            )
+        )
+        self.registry = ProjectRegistry(
+            config['csv']['path'],
+            poll_interval=config['csv'].get(
+                'poll_interval', CT_DEFAULT_POLL_INTERVAL
+            )
+        )
+        self.local_output = LocalOutput(config)
+        self.images = ImageStore()
+        self.reports = ReportJobs(config, images=self.images)
+
+    def release(self):
+        '''
+        Flush pending image writes and reports, release the cameras.
+        '''
+        self.local_output.close()
+        self.reports.close()
+        self.encoder.shutdown()
+        self.cameras.release()
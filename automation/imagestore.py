@@ -0,0 +1,117 @@
+'''
+This module keeps captured images by content, shared by report pages.
+It serves as a support module for automation/handheldopsman.
+'''
+import hashlib
+import mimetypes
+import threading
+
+CT_DEFAULT_IMAGE_MIMETYPE = 'image/jpeg'
+
+
+class ImageStore:
+    '''
+    Content-addressed image store: sha256 digest -> image bytes.
+    Identical images are stored once whatever the number of pages, slots
+    and jobs referencing them. Every holder of a digest owns a reference
+    (put() or incref()) and gives it back with release(); images are
+    dropped when their last reference is released.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        # digest -> [bytes, mimetype, refs]
+        self._images = {}
+        self._nbytes = 0
+
+    def put(self, data, extension=None):
+        '''
+        Store an image and take a reference to it.
+        Args:
+        - data (bytes): encoded image.
+        - extension (str, optional): image extension (i.e. '.jpg').
+        Returns:
+        - digest (str): image key, None if data is empty.
+        '''
+        if not data:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            entry = self._images.get(digest)
+            if entry is None:
+                mimetype = None
+                if extension:
+                    mimetype = mimetypes.guess_type(f'image{extension}')[0]
+                self._images[digest] = [
+                    bytes(data),
+                    mimetype or CT_DEFAULT_IMAGE_MIMETYPE,
+                    1
+                ]
+                self._nbytes += len(data)
+            else:
+                entry[2] += 1
+        return digest
+
+    def get(self, digest):
+        '''
+        Returns (bytes, mimetype) of an image, None if not stored.
+        '''
+        with self._lock:
+            entry = self._images.get(digest)
+            if entry is None:
+                return None
+            return entry[0], entry[1]
+
+    def incref(self, digests):
+        '''
+        Take one more reference to each stored image.
+        Args:
+        - digests (iterable): image keys, None values are ignored.
+        '''
+        with self._lock:
+            for digest in digests:
+                entry = self._images.get(digest)
+                if entry is not None:
+                    entry[2] += 1
+
+    def release(self, digests):
+        '''
+        Give back one reference to each image, unreferenced images are
+        dropped.
+        Args:
+        - digests (iterable): image keys, None values are ignored.
+        '''
+        with self._lock:
+            for digest in digests:
+                entry = self._images.get(digest)
+                if entry is None:
+                    continue
+                entry[2] -= 1
+                if entry[2] <= 0:
+                    del self._images[digest]
+                    self._nbytes -= len(entry[0])
+
+    def size(self, digests):
+        '''
+        Returns total bytes of the given stored images.
+        Args:
+        - digests (iterable): image keys, unknown ones are ignored.
+        '''
+        with self._lock:
+            return sum(
+                len(self._images[digest][0])
+                for digest in digests
+                if digest in self._images
+            )
+
+    def status(self):
+        '''
+        Returns store status.
+        Returns:
+        - status (dict): stored images, their size and references.
+        '''
+        with self._lock:
+            return {
+                'images': len(self._images),
+                'nbytes': self._nbytes,
+                'refs': sum(entry[2] for entry in self._images.values())
+            }
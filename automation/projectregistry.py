@@ -0,0 +1,131 @@
+'''
+This module keeps track of project CSV files available in csv.path.
+It serves as a support module for automation/qualitycriteria.
+'''
+import os
+import time
+import threading
+
+CT_DEFAULT_POLL_INTERVAL = 2.0
+CT_PROJECT_FILE_EXTENSION = '.csv'
+
+
+class ProjectRegistry:
+    '''
+    Incremental registry of project criteria files.
+    Project name is everything before the first '_' of '<project>_*.csv'.
+    The directory mtime is polled at most every poll_interval seconds and
+    only changed files are updated, so new projects show up without
+    restart and without a glob per request.
+    '''
+    def __init__(self, base_path, poll_interval=CT_DEFAULT_POLL_INTERVAL):
+        '''
+        Args:
+        - base_path (str): directory holding project CSV files.
+        - poll_interval (float): min seconds between directory checks.
+        '''
+        self.base_path = base_path
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        # file name -> (project, mtime_ns, size)
+        self._files = {}
+        # project (lowercase) -> sorted CSV paths
+        self._projects = {}
+        self._dir_mtime = None
+        self._checked_at = None
+
+    def get_projects(self):
+        '''
+        Returns available project names.
+        Returns:
+        - list: sorted uppercase project names.
+        '''
+        self.refresh()
+        with self._lock:
+            return sorted(project.upper() for project in self._projects)
+
+    def find_csv(self, project):
+        '''
+        Returns the CSV file of a project.
+        Args:
+        - project (str): project name.
+        Returns:
+        - csv_path (str): first matching CSV file.
+        '''
+        self.refresh()
+        with self._lock:
+            csv_files = self._projects.get(project.lower())
+        if not csv_files:
+            raise FileNotFoundError(
+                f'No CSV file found for project: {project.upper()}'
+            )
+        return csv_files[0]
+
+    def refresh(self, force=False):
+        '''
+        Rescan the directory if its mtime changed.
+        Args:
+        - force (bool): skip poll interval and mtime checks.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            if (
+                not force and self._checked_at is not None and
+                now - self._checked_at < self.poll_interval
+            ):
+                return
+            self._checked_at = now
+
+        try:
+            dir_mtime = os.stat(self.base_path).st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        if not force and dir_mtime == self._dir_mtime:
+            return
+
+        self._scan(dir_mtime)
+
+    def _scan(self, dir_mtime):
+        '''
+        Scan directory and update changed entries only.
+        Args:
+        - dir_mtime (int): directory mtime, None if it does not exist.
+        '''
+        found = {}
+        if dir_mtime is not None:
+            with os.scandir(self.base_path) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if (
+                        not name.endswith(CT_PROJECT_FILE_EXTENSION) or
+                        '_' not in name or
+                        not entry.is_file()
+                    ):
+                        continue
+                    stat = entry.stat()
+                    found[name] = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            changed = set()
+            # Removed files
+            for name in set(self._files) - set(found):
+                changed.add(self._files.pop(name)[0])
+            # New or modified files
+            for name, (mtime, size) in found.items():
+                known = self._files.get(name)
+                if known is None or known[1:] != (mtime, size):
+                    project = name.split('_')[0].lower()
+                    self._files[name] = (project, mtime, size)
+                    changed.add(project)
+            # Rebuild affected projects only
+            for project in changed:
+                csv_files = sorted(
+                    os.path.join(self.base_path, name)
+                    for name, entry in self._files.items()
+                    if entry[0] == project
+                )
+                if csv_files:
+                    self._projects[project] = csv_files
+                else:
+                    self._projects.pop(project, None)
+            self._dir_mtime = dir_mtime
@@ -1,6 +1,23 @@
 import csv
+import gzip
+import hashlib
+import json
 import os
-import glob
+
+from handheld.automation.criteriacache import (
+    CriteriaCache,
+    CT_DEFAULT_CACHE_REVALIDATE,
+    CT_DEFAULT_CACHE_BUDGET_MB
+)
+from handheld.automation.criteriacatalog import (
+    CriteriaCatalog,
+    get_catalog_path,
+    update_catalog
+)
+from handheld.automation.projectregistry import (
+    ProjectRegistry,
+    CT_DEFAULT_POLL_INTERVAL
+)
 
 
 class QualityCriteria():
@@ -10,63 +27,148 @@ class QualityCriteria():
     Now supports project-specific CSV files.
     '''
 
-    def __init__(self, config):
+    def __init__(self, config, cache=None, registry=None):
+        '''
+        Args:
+        - config (dict): app config.
+        - cache (CriteriaCache, optional): project cache, may be shared
+          between instances.
+        - registry (ProjectRegistry, optional): project files registry,
+          may be shared between instances.
+        '''
         # Config
         self.config = config
         # Attributes
         self.raw = []
         self.headers = []
+        # Precomputed indexes, built on load
+        self._criteria_index = {}
+        self._column_values = {}
+        self._facets = {}
+        # Loaded data dict, shared with the cache
+        self._data = None
+        # Compiled catalog, replaces in-memory data if enabled
+        self.use_catalog = config['csv'].get('catalog', False)
+        self._catalog = None
         self.csv_base_path = config['csv']['path']
         self.current_project = None
         self.csv_path = None
+        # Parsed projects cache
+        if cache is None:
+            cache = CriteriaCache(
+                revalidate=config['csv'].get(
+                    'cache_revalidate', CT_DEFAULT_CACHE_REVALIDATE
+                ),
+                budget_mb=config['csv'].get(
+                    'cache_budget_mb', CT_DEFAULT_CACHE_BUDGET_MB
+                )
+            )
+        self.cache = cache
+        # Available project files
+        if registry is None:
+            registry = ProjectRegistry(
+                self.csv_base_path,
+                poll_interval=config['csv'].get(
+                    'poll_interval', CT_DEFAULT_POLL_INTERVAL
+                )
+            )
+        self.registry = registry
 
     def discover_available_projects(self):
         '''
         Discover available projects based on CSV files in config directory.
+        Served from the project registry, new files are picked up within
+        its poll interval.
         Returns:
         - list: Available project names based on CSV files
         '''
-        projects = []
-
-        if os.path.exists(self.csv_base_path):
-            csv_pattern = os.path.join(self.csv_base_path, '*.csv')
-            csv_files = glob.glob(csv_pattern)
-
-            for csv_file in csv_files:
-                filename = os.path.basename(csv_file)
-                # Get project name: everything before the first '_'
-                if '_' in filename:
-                    project_name = filename.split('_')[0].upper()
-                    if project_name not in projects:
-                        projects.append(project_name)
-
-            projects = sorted(projects)
-
-        return projects
+        return self.registry.get_projects()
 
     def set_project(self, project_name):
         '''
         Set the current project and load its corresponding CSV data.
+        Parsed projects are served from cache while their CSV file is
+        unchanged.
         Args:
         - project_name (str): Name of the project
         '''
         self.current_project = project_name.lower()
+        data = self.cache.get(
+            self.current_project,
+            self._find_csv,
+            self._load_project
+        )
+        self._set_data(data)
 
-        # Find CSV file for this project
-        csv_pattern = os.path.join(
-            self.csv_base_path,
-            f'{self.current_project}_*.csv'
+    def _find_csv(self, project):
+        '''
+        Find CSV file for given project.
+        Args:
+        - project (str): lowercase project name.
+        Returns:
+        - csv_path (str): first matching CSV file.
+        '''
+        return self.registry.find_csv(project)
+
+    def _load_project(self, csv_path):
+        '''
+        Load and index given CSV file.
+        Args:
+        - csv_path (str): path to project CSV.
+        Returns:
+        - data (dict): loaded and indexed data, see _get_data().
+        '''
+        self.csv_path = csv_path
+        if self.use_catalog:
+            return self._load_catalog()
+        self._load_data()
+        return self._get_data()
+
+    def _load_catalog(self):
+        '''
+        Open the compiled catalog of the current CSV path, compiling it
+        first if missing or older than the CSV. Rows stay on disk.
+        Returns:
+        - data (dict): see _get_data().
+        '''
+        catalog_path = get_catalog_path(
+            self.csv_path,
+            self.config['csv'].get('catalog_path')
         )
-        csv_files = glob.glob(csv_pattern)
+        update_catalog(self.csv_path, catalog_path, self.config['csv'])
 
-        if csv_files:
-            # Take the first matching CSV file
-            self.csv_path = csv_files[0]
-            self._load_data()
-        else:
-            raise FileNotFoundError(
-                f'No CSV file found for project: {project_name}'
-            )
+        self.headers, self.raw = [], []
+        self._criteria_index, self._column_values = {}, {}
+        self._facets = {}
+        data = self._get_data()
+        data['catalog'] = CriteriaCatalog(catalog_path)
+        return data
+
+    def _get_data(self):
+        '''
+        Returns loaded data and indexes as a dict, to be cached.
+        '''
+        return {
+            'csv_path': self.csv_path,
+            'headers': self.headers,
+            'raw': self.raw,
+            'criteria_index': self._criteria_index,
+            'column_values': self._column_values,
+            'facets': self._facets
+        }
+
+    def _set_data(self, data):
+        '''
+        Set loaded data and indexes from a dict built by _get_data().
+        '''
+        self.csv_path = data['csv_path']
+        self.headers = data['headers']
+        self.raw = data['raw']
+        self._criteria_index = data['criteria_index']
+        self._column_values = data['column_values']
+        self._facets = data['facets']
+        self._catalog = data.get('catalog')
+        self._data = data
 
     def _load_data(self):
         '''
@@ -89,6 +191,67 @@ class QualityCriteria():
             self.headers = raw_rows[0]
             self.raw = raw_rows[1:]
 
+        self._build_indexes()
+
+    def _build_indexes(self):
+        '''
+        Build normalized lookup structures from raw data:
+        - criteria index: (defect, quality, finish) -> criteria, keys are
+          stripped and lowercased, first matching row wins.
+        - column values: sorted option list per selection column.
+        - facets: valid options for a partial selection.
+        '''
+        defect_idx = self._get_index(self.config['csv']['defect_keyword'])
+        quality_idx = self._get_index(self.config['csv']['quality_keyword'])
+        finish_idx = self._get_index(self.config['csv']['finish_keyword'])
+        criteria_idx = self._get_index(self.config['csv']['criteria_keyword'])
+
+        self._column_values = {
+            'defect': self._build_set(defect_idx),
+            'quality': self._build_set(quality_idx),
+            'finish': self._build_set(finish_idx)
+        }
+
+        self._criteria_index = {}
+        if None not in (defect_idx, quality_idx, finish_idx, criteria_idx):
+            min_len = max(defect_idx, quality_idx, finish_idx, criteria_idx)
+            for row in self.raw:
+                if len(row) > min_len:
+                    key = (
+                        row[defect_idx].strip().lower(),
+                        row[quality_idx].strip().lower(),
+                        row[finish_idx].strip().lower()
+                    )
+                    self._criteria_index.setdefault(key, row[criteria_idx])
+
+        self._build_facets()
+
+    def _build_facets(self):
+        '''
+        Build faceted index (defect -> valid qualities -> valid finishes)
+        from the criteria index. Every partial selection maps to a
+        precomputed sorted option list.
+        '''
+        facets = {
+            'quality_by_defect': {},
+            'finish_by_defect': {},
+            'finish_by_quality': {},
+            'finish_by_pair': {}
+        }
+        for defect, quality, finish in self._criteria_index:
+            for facet, key, value in (
+                ('quality_by_defect', defect, quality),
+                ('finish_by_defect', defect, finish),
+                ('finish_by_quality', quality, finish),
+                ('finish_by_pair', (defect, quality), finish)
+            ):
+                facets[facet].setdefault(key, set()).add(value.upper())
+
+        self._facets = {
+            facet: {key: sorted(values) for key, values in index.items()}
+            for facet, index in facets.items()
+        }
+
     def _get_index(self, keyword):
         '''
         Given a keyword (i.e. defect) it returns corresponding index, avoiding
@@ -114,79 +277,151 @@ class QualityCriteria():
         '''
         if index is None or not self.raw:
             return []
+        # Same normalization as the facets, options and matrix values
         return sorted(
-            set(row[index].upper() for row in self.raw if len(row) > index)
+            set(
+                row[index].strip().upper()
+                for row in self.raw if len(row) > index
+            )
         )
 
     def get_defects(self):
         '''
         Returns a set of defect types according to given quality criteria.
         '''
-        if not self.raw:
-            return []
-        index = self._get_index(self.config['csv']['defect_keyword'])
-        return self._build_set(index)
+        if self._catalog is not None:
+            return self._catalog.get_values('defect')
+        return self._column_values.get('defect', [])
 
     def get_quality(self):
         '''
         Returns a set of quality surface options according to given
         quality criteria.
         '''
-        if not self.raw:
-            return []
-        index = self._get_index(self.config['csv']['quality_keyword'])
-        return self._build_set(index)
+        if self._catalog is not None:
+            return self._catalog.get_values('quality')
+        return self._column_values.get('quality', [])
 
     def get_finish(self):
         '''
         Returns a set of finish types according to given quality criteria.
         '''
-        if not self.raw:
-            return []
-        index = self._get_index(self.config['csv']['finish_keyword'])
-        return self._build_set(index)
+        if self._catalog is not None:
+            return self._catalog.get_values('finish')
+        return self._column_values.get('finish', [])
 
-    def get_criteria(self, defect, quality, finish):
+    def get_options(self, defect='', quality=''):
         '''
-        Given defect, quality and finish, finds the corresponding criteria
-        from raw data.
+        Returns valid surface quality and finish options for a partial
+        selection, so invalid combinations can not be picked.
 
         Args:
-        - defect (str): defect name.
-        - quality (str): surface quality type.
-        - finish (str): finish type.
+        - defect (str, optional): selected defect name.
+        - quality (str, optional): selected surface quality type.
 
         Returns:
-        - founded_criteria (str): corresponding criteria if found, else None.
+        - options (dict): 'surface-quality' and 'finish' option lists.
         '''
-        if not self.raw:
-            return None
+        defect = (defect or '').strip().lower()
+        quality = (quality or '').strip().lower()
 
-        founded_criteria = None
+        if self._catalog is not None:
+            return self._catalog.get_options(defect, quality)
 
-        defect_idx = self._get_index(self.config['csv']['defect_keyword'])
-        quality_idx = self._get_index(self.config['csv']['quality_keyword'])
-        finish_idx = self._get_index(self.config['csv']['finish_keyword'])
-        criteria_idx = self._get_index(self.config['csv']['criteria_keyword'])
+        if defect:
+            qualities = self._facets['quality_by_defect'].get(defect, [])
+        else:
+            qualities = self.get_quality()
 
-        if None not in (defect_idx, quality_idx, finish_idx, criteria_idx):
-            matches = [
-                row[criteria_idx]
-                for row in self.raw
-                if (
-                    len(row) > max(
-                        defect_idx,
-                        quality_idx,
-                        finish_idx,
-                        criteria_idx
-                    )
-                    and row[defect_idx].strip().lower() == defect.lower()
-                    and row[quality_idx].strip().lower() == quality.lower()
-                    and row[finish_idx].strip().lower() == finish.lower()
-                )
+        if defect and quality:
+            finishes = self._facets['finish_by_pair'].get(
+                (defect, quality), []
+            )
+        elif defect:
+            finishes = self._facets['finish_by_defect'].get(defect, [])
+        elif quality:
+            finishes = self._facets['finish_by_quality'].get(quality, [])
+        else:
+            finishes = self.get_finish()
+
+        return {'surface-quality': qualities, 'finish': finishes}
+
+    def get_matrix(self):
+        '''
+        Returns the compact criteria matrix of the current project, so
+        clients can resolve criteria locally.
+        Layout (JSON): normalized 'defects', 'qualities', 'finishes' and
+        unique 'criteria' lists, and flat 'rows' of
+        [defect, quality, finish, criteria] list positions.
+        Built once per loaded project version.
+        Returns:
+        - (version, json_bytes, gzip_bytes) tuple, or None if no project.
+        '''
+        if self._data is None:
+            return None
+        matrix = self._data.get('matrix')
+        if matrix is None:
+            matrix = self._build_matrix()
+            self._data['matrix'] = matrix
+        return matrix
+
+    def _build_matrix(self):
+        '''
+        Build and encode the criteria matrix, see get_matrix().
+        '''
+        if self._catalog is not None:
+            items = self._catalog.get_items()
+        else:
+            items = [
+                (*key, criteria)
+                for key, criteria in self._criteria_index.items()
             ]
+        # Same content, same version, whatever the backend
+        items = sorted(items)
+
+        lists = {'defects': {}, 'qualities': {}, 'finishes': {}}
+        criteria_list = {}
+        rows = []
+        for defect, quality, finish, criteria in items:
+            for values, value in zip(
+                lists.values(),
+                (defect, quality, finish)
+            ):
+                rows.append(values.setdefault(value, len(values)))
+            rows.append(
+                criteria_list.setdefault(criteria, len(criteria_list))
+            )
+
+        matrix = {name: list(values) for name, values in lists.items()}
+        matrix['criteria'] = list(criteria_list)
+        matrix['rows'] = rows
+        version = hashlib.sha256(
+            json.dumps(matrix, separators=(',', ':')).encode('utf-8')
+        ).hexdigest()[:16]
+        matrix['version'] = version
+
+        json_bytes = json.dumps(
+            matrix,
+            separators=(',', ':'),
+            ensure_ascii=False
+        ).encode('utf-8')
+        return version, json_bytes, gzip.compress(json_bytes)
 
-            if len(matches) >= 1:
-                founded_criteria = matches[0]
+    def get_criteria(self, defect, quality, finish):
+        '''
+        Given defect, quality and finish, finds the corresponding criteria
+        from the precomputed index.
+
+        Args:
+        - defect (str): defect name.
+        - quality (str): surface quality type.
+        - finish (str): finish type.
 
-        return founded_criteria
+        Returns:
+        - founded_criteria (str): corresponding criteria if found, else None.
+        '''
+        if self._catalog is not None:
+            return self._catalog.get_criteria(defect, quality, finish)
+        return self._criteria_index.get(
+            tuple(value.strip().lower() for value in (defect, quality, finish))
+        )
@@ -0,0 +1,246 @@
+'''
+This module builds and renders inspection reports in the background.
+It serves as a support module for automation/handheldopsman.
+'''
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from handheld.utils.writehtml import WriteHtml
+from handheld.utils.renderpool import (
+    create_render_pool,
+    CT_DEFAULT_RENDER_WORKERS
+)
+
+# Package directory, relative report paths are resolved against it so
+# they do not depend on the working directory
+CT_PACKAGE_DIR = os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))
+)
+CT_DEFAULT_REPORT_PATH = 'reports/'
+CT_DEFAULT_REPORT_HISTORY = 32
+CT_REPORT_TEMPLATE = 'templates/template.html'
+CT_REPORT_HTML = 'report.html'
+CT_REPORT_PDF = 'report.pdf'
+CT_FILE_NAME_PATTERN = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class ReportJobs:
+    '''
+    Queue of report jobs.
+    Each job gets a snapshot of the report pages, so the inspection can go
+    on while it runs. Jobs build the HTML report with WriteHtml in a job
+    directory and render it to PDF on the render pool. Page images are
+    image store digests, each distinct image is written once and shared
+    by every page showing it.
+    Job states: 'queued', 'building', 'rendering', 'done', 'failed'.
+    '''
+    def __init__(self, config, images, render_pool=None):
+        '''
+        Args:
+        - config (dict): app config ('report', 'frontend' and 'stream').
+        - images (ImageStore): store of page images.
+        - render_pool (RenderPool, optional): created from config if not
+          given.
+        '''
+        self.images = images
+        report_config = config.get('report', {})
+        static_dir = os.path.abspath(config['frontend']['static'])
+        self.output_path = os.path.join(
+            CT_PACKAGE_DIR,
+            report_config.get('output_path', CT_DEFAULT_REPORT_PATH)
+        )
+        self.template_path = os.path.join(static_dir, CT_REPORT_TEMPLATE)
+        # Template links are relative to the frontend reports directory
+        self.base_url = Path(
+            os.path.dirname(static_dir), 'reports'
+        ).as_uri() + '/'
+        self.image_extension = config['stream'].get('capture_encode', '.jpg')
+        self.history = report_config.get(
+            'history',
+            CT_DEFAULT_REPORT_HISTORY
+        )
+
+        self._pool = render_pool or create_render_pool(config)
+        self._pool.warmup()
+        self._executor = ThreadPoolExecutor(
+            max_workers=report_config.get(
+                'render_workers',
+                CT_DEFAULT_RENDER_WORKERS
+            ),
+            thread_name_prefix='ReportJobs'
+        )
+        self._lock = threading.Lock()
+        # job_id -> job dict, oldest first
+        self._jobs = OrderedDict()
+
+    def submit(self, pages, title='Inspection_Report', file_name=None):
+        '''
+        Queue a report job.
+        Args:
+        - pages (list): report pages in order, dicts with 'text' (fill
+          class -> str) and 'images' (fill class -> image digest). The
+          job owns one reference to each page image and releases it when
+          it finishes.
+        - title (str): document title.
+        - file_name (str, optional): PDF download name.
+        Returns:
+        - job_id (str)
+        '''
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'state': 'queued',
+            'pages': len(pages),
+            'file_name': self._clean_file_name(file_name or title),
+            'created': time.time(),
+            'finished': None,
+            'seconds': None,
+            'error': None,
+            'pdf_path': None
+        }
+        evicted = []
+        with self._lock:
+            self._jobs[job_id] = job
+            # Forget oldest finished jobs
+            for old_id in list(self._jobs):
+                if len(self._jobs) <= self.history:
+                    break
+                if self._jobs[old_id]['finished'] is not None:
+                    del self._jobs[old_id]
+                    evicted.append(old_id)
+        # Their files can no longer be downloaded
+        for old_id in evicted:
+            shutil.rmtree(self._job_dir(old_id), ignore_errors=True)
+        self._executor.submit(self._run, job, list(pages), title)
+        return job_id
+
+    def status(self, job_id):
+        '''
+        Returns job status, None if unknown.
+        Returns:
+        - status (dict): id, state, pages, timings and error.
+        '''
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {
+                key: value for key, value in job.items()
+                if key != 'pdf_path'
+            }
+
+    def get_pdf(self, job_id):
+        '''
+        Returns (pdf path, download name) of a finished job, None if the
+        job is unknown or not done.
+        '''
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['state'] != 'done':
+                return None
+            return job['pdf_path'], job['file_name']
+
+    def render_status(self):
+        ''' Returns render pool status. '''
+        return self._pool.status()
+
+    def close(self):
+        ''' Wait for queued jobs and stop renderers. '''
+        self._executor.shutdown(wait=True)
+        self._pool.close()
+
+    def _run(self, job, pages, title):
+        ''' Job worker: build HTML report and render it. '''
+        start = time.perf_counter()
+        try:
+            self._set_state(job, 'building')
+            job_dir = self._job_dir(job['id'])
+            html_path = self._build_html(job_dir, pages, title)
+
+            self._set_state(job, 'rendering')
+            pdf_path = os.path.abspath(os.path.join(job_dir, CT_REPORT_PDF))
+            self._pool.render(html_path, pdf_path)
+        except Exception as e:
+            print(f'Report job {job["id"]} error: {e}')
+            with self._lock:
+                job['state'] = 'failed'
+                job['error'] = str(e)
+        else:
+            with self._lock:
+                job['state'] = 'done'
+                job['pdf_path'] = pdf_path
+        finally:
+            for page in pages:
+                self.images.release(page.get('images', {}).values())
+            with self._lock:
+                job['finished'] = time.time()
+                job['seconds'] = time.perf_counter() - start
+
+    def _build_html(self, job_dir, pages, title):
+        '''
+        Write report HTML and its images in the job directory.
+        Returns:
+        - html_path (str): absolute path of the HTML report.
+        '''
+        os.makedirs(job_dir, exist_ok=True)
+        wh = WriteHtml()
+        wh.new_html(title)
+        wh.set_base_url(self.base_url)
+
+        # digest -> image file URI, each image written once
+        image_uris = {}
+        for page in pages:
+            images = {}
+            for slot, digest in page.get('images', {}).items():
+                if digest not in image_uris:
+                    image = self.images.get(digest)
+                    if image is None:
+                        continue
+                    image_path = os.path.join(
+                        job_dir,
+                        f'{digest}{self.image_extension}'
+                    )
+                    with open(image_path, 'wb') as f:
+                        f.write(image[0])
+                    image_uris[digest] = Path(
+                        os.path.abspath(image_path)
+                    ).as_uri()
+                images[slot] = image_uris[digest]
+
+            template = wh.get_template(self.template_path)
+            wh.set_fill_data(
+                template,
+                text_dict={
+                    key: str(value)
+                    for key, value in page.get('text', {}).items()
+                    if value is not None
+                },
+                img_dict=images
+            )
+            wh.add_page(template)
+
+        html_path = os.path.abspath(os.path.join(job_dir, CT_REPORT_HTML))
+        wh.save_html(html_path)
+        wh.close()
+        return html_path
+
+    def _job_dir(self, job_id):
+        ''' Returns the directory of a job files. '''
+        return os.path.join(self.output_path, job_id)
+
+    def _set_state(self, job, state):
+        ''' Update job state. '''
+        with self._lock:
+            job['state'] = state
+
+    def _clean_file_name(self, name):
+        ''' Returns a safe PDF file name. '''
+        name = CT_FILE_NAME_PATTERN.sub('_', name).strip('_') or 'report'
+        return f'{name}.pdf'
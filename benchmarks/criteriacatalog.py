@@ -0,0 +1,139 @@
+'''
+    criteriacatalog.py
+
+    Benchmark criteria loading: CSV path against compiled SQLite catalog.
+    Reports load time, lookup latency and peak RSS, each backend running
+    in its own process.
+
+    # Usage:
+    pipenv run python -m handheld.benchmarks.criteriacatalog \
+        --rows 50000 --lookups 10000
+'''
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+from handheld.automation.criteriacatalog import (
+    compile_catalog,
+    get_catalog_path
+)
+from handheld.automation.qualitycriteria import QualityCriteria
+
+CT_PROJECT = 'bench'
+CT_CSV_CONFIG = {
+    'defect_keyword': 'Defect',
+    'quality_keyword': 'Surface Quality',
+    'finish_keyword': 'Finish',
+    'criteria_keyword': 'Criteria'
+}
+
+
+def generate_csv(path, n_rows):
+    '''
+    Write a synthetic criteria catalog.
+    Returns:
+    - keys (list): (defect, quality, finish) of every row.
+    '''
+    qualities = ['A', 'B', 'C', 'D']
+    finishes = ['Painted', 'Visual', 'Sanded']
+    per_defect = len(qualities) * len(finishes)
+    keys = []
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            [CT_CSV_CONFIG[k] for k in (
+                'defect_keyword',
+                'quality_keyword',
+                'finish_keyword',
+                'criteria_keyword'
+            )]
+        )
+        for i in range(n_rows):
+            defect = f'DEFECT {i // per_defect}'
+            quality = qualities[(i // len(finishes)) % len(qualities)]
+            finish = finishes[i % len(finishes)]
+            writer.writerow([
+                defect,
+                quality,
+                finish,
+                f'Max size {i % 7} mm, max {i % 5} per 100 cm2, row {i}'
+            ])
+            keys.append((defect, quality, finish))
+    return keys
+
+
+def run_backend(csv_dir, use_catalog, keys, results):
+    '''
+    Load project and run lookups in a fresh process.
+    '''
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    config = {'csv': dict(CT_CSV_CONFIG, path=csv_dir, catalog=use_catalog)}
+
+    start = time.perf_counter()
+    qc = QualityCriteria(config)
+    qc.set_project(CT_PROJECT)
+    qc.get_defects()
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for defect, quality, finish in keys:
+        qc.get_criteria(defect, quality, finish)
+    lookup_us = 1e6 * (time.perf_counter() - start) / len(keys)
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((load_s, lookup_us, (rss_after - rss_before) / 1024))
+
+
+def measure(csv_dir, use_catalog, keys):
+    ''' Run backend in a separate process, returns its measurements. '''
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(
+        target=run_backend,
+        args=(csv_dir, use_catalog, keys, results)
+    )
+    process.start()
+    measurements = results.get()
+    process.join()
+    return measurements
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark CSV criteria against compiled catalog.'
+    )
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    args = parser.parse_args()
+
+    csv_dir = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(csv_dir, f'{CT_PROJECT}_criteria.csv')
+        keys = generate_csv(csv_path, args.rows)
+        lookups = random.Random(0).choices(keys, k=args.lookups)
+
+        start = time.perf_counter()
+        compile_catalog(csv_path, get_catalog_path(csv_path), CT_CSV_CONFIG)
+        compile_s = time.perf_counter() - start
+
+        print(f'Rows: {args.rows}, lookups: {args.lookups}')
+        print(f'Catalog compile: {compile_s * 1000:.1f} ms')
+        print(f'{"backend":<10}{"load ms":>12}{"lookup us":>12}{"RSS MB":>10}')
+        for name, use_catalog in (('csv', False), ('catalog', True)):
+            load_s, lookup_us, rss_mb = measure(csv_dir, use_catalog, lookups)
+            print(
+                f'{name:<10}{load_s * 1000:>12.1f}'
+                f'{lookup_us:>12.2f}{rss_mb:>10.1f}'
+            )
+    finally:
+        shutil.rmtree(csv_dir)
+
+
+if __name__ == '__main__':
+    main()
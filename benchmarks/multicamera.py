@@ -0,0 +1,94 @@
+'''
+    multicamera.py
+
+    Benchmark a multi-camera bench from one process: open time of the
+    configured cameras, then capture rate and preview stream rate of each
+    camera while all of them run at once.
+
+    # Usage:
+    pipenv run python -m handheld.benchmarks.multicamera \
+        --config handheld/config/config.yaml --seconds 10
+'''
+import argparse
+import threading
+import time
+
+from ais.infrastructure.readconfig import read_yaml_file
+from handheld.camera.cameramanager import CameraManager
+
+
+def consume_stream(video_cam, stop, counts, cam_id):
+    '''
+    Read the encoded preview of a camera until stop is set.
+    Args:
+    - video_cam (VideoCam)
+    - stop (threading.Event)
+    - counts (dict): cam_id -> received chunks, updated in place.
+    - cam_id (str)
+    '''
+    for _ in video_cam.encoded_streamer():
+        counts[cam_id] += 1
+        if stop.is_set():
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the cameras of a multi-camera bench.'
+    )
+    parser.add_argument('--config', default='handheld/config/config.yaml')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument(
+        '--no-stream',
+        action='store_true',
+        help='Measure capture only, without preview streams.'
+    )
+    args = parser.parse_args()
+
+    config = read_yaml_file(args.config)
+    start = time.perf_counter()
+    cameras = CameraManager(config)
+    print(f'Open {len(cameras.ids())} cameras: '
+          f'{time.perf_counter() - start:.2f} s')
+    for cam_id, error in cameras.errors.items():
+        print(f'Camera {cam_id} not available: {error}')
+
+    stop = threading.Event()
+    counts = {cam_id: 0 for cam_id in cameras.ids()}
+    threads = []
+    if not args.no_stream:
+        for cam_id in cameras.ids():
+            thread = threading.Thread(
+                target=consume_stream,
+                args=(cameras.get(cam_id), stop, counts, cam_id),
+                daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+
+    first_seqs = {
+        cam_id: cameras.get(cam_id).frame_seq() for cam_id in cameras.ids()
+    }
+    first_counts = dict(counts)
+    start = time.perf_counter()
+    time.sleep(args.seconds)
+    elapsed = time.perf_counter() - start
+    last_seqs = {
+        cam_id: cameras.get(cam_id).frame_seq() for cam_id in cameras.ids()
+    }
+    last_counts = dict(counts)
+
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=1.0)
+    cameras.release()
+
+    print(f'{"camera":<16}{"capture fps":>14}{"stream fps":>14}')
+    for cam_id in first_seqs:
+        capture_fps = (last_seqs[cam_id] - first_seqs[cam_id]) / elapsed
+        stream_fps = (last_counts[cam_id] - first_counts[cam_id]) / elapsed
+        print(f'{cam_id:<16}{capture_fps:>14.1f}{stream_fps:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+'''
+    storageprofiles.py
+
+    Benchmark LocalOutput storage profiles: encode time and file size per
+    saved defect image.
+
+    # Usage:
+    pipenv run python -m handheld.benchmarks.storageprofiles \
+        --image capture.jpg --repeat 5
+'''
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from handheld.io.localoutput import LocalOutput, CT_STORAGE_PROFILES
+
+CT_SYNTHETIC_SHAPE = (1944, 2592, 3)
+
+
+def load_image(image_path=None):
+    '''
+    Load benchmark image and its JPEG bytes.
+    Args:
+    - image_path (str, optional): JPEG capture, synthetic if not given.
+    Returns:
+    - image (numpy.ndarray), jpeg_bytes (bytes)
+    '''
+    if image_path:
+        with open(image_path, 'rb') as f:
+            jpeg_bytes = f.read()
+        image = cv2.imdecode(
+            np.frombuffer(jpeg_bytes, dtype=np.uint8),
+            cv2.IMREAD_COLOR
+        )
+    else:
+        # Smooth gradient plus noise, closer to a photo than pure noise
+        rows, cols, _ = CT_SYNTHETIC_SHAPE
+        gradient = np.add.outer(
+            np.arange(rows) * 255 // rows,
+            np.arange(cols) * 255 // cols
+        ) // 2
+        image = np.dstack([gradient] * 3).astype(np.uint8)
+        noise = np.random.default_rng(0).integers(
+            0, 16, CT_SYNTHETIC_SHAPE, dtype=np.uint8
+        )
+        image = cv2.add(image, noise)
+        _, buffer = cv2.imencode('.jpg', image)
+        jpeg_bytes = buffer.tobytes()
+    return image, jpeg_bytes
+
+
+def benchmark_profile(profile, image, jpeg_bytes, repeat, png_compression):
+    '''
+    Measure encode time and output size of a storage profile.
+    Returns:
+    - (mean_ms, size_bytes)
+    '''
+    if profile == 'jpeg':
+        # Capture bytes are written as is
+        return 0.0, len(jpeg_bytes)
+
+    ext = CT_STORAGE_PROFILES[profile]
+    params = LocalOutput.get_encode_params(
+        profile,
+        png_compression=png_compression
+    )
+    elapsed = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _, buffer = cv2.imencode(ext, image, params)
+        elapsed.append(time.perf_counter() - start)
+        size = buffer.nbytes
+    return 1000 * sum(elapsed) / len(elapsed), size
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark LocalOutput storage profiles.'
+    )
+    parser.add_argument('--image', help='JPEG capture to benchmark.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--png-compression', type=int, default=3)
+    args = parser.parse_args()
+
+    image, jpeg_bytes = load_image(args.image)
+    print(f'Image: {image.shape[1]}x{image.shape[0]}')
+    print(f'{"profile":<16}{"encode ms":>12}{"size KB":>12}')
+    for profile in CT_STORAGE_PROFILES:
+        mean_ms, size = benchmark_profile(
+            profile,
+            image,
+            jpeg_bytes,
+            args.repeat,
+            args.png_compression
+        )
+        print(f'{profile:<16}{mean_ms:>12.1f}{size / 1024:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
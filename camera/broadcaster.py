@@ -0,0 +1,89 @@
+'''
+This module fans the MJPEG preview out to every video feed client.
+It serves as a support module for camera/camera.
+'''
+import threading
+
+CT_SUBSCRIBER_WAIT_TIMEOUT = 1.0
+
+
+class StreamBroadcaster:
+    '''
+    Encode-once MJPEG broadcaster.
+    A single encoder thread resizes and JPEG-encodes each preview frame once
+    and wraps it in the multipart boundary once. Every subscriber receives
+    the same immutable bytes object; slow subscribers skip to the latest
+    chunk instead of queueing.
+    '''
+    def __init__(self, video_cam):
+        '''
+        Args:
+        - video_cam (VideoCam): frame source, provides chunk_streamer().
+        '''
+        self._vc = video_cam
+        self._cond = threading.Condition()
+        # Latest published multipart chunk and its sequence number
+        self._chunk = None
+        self._seq = 0
+        self._subscribers = 0
+        self._thread = None
+
+    @property
+    def subscribers(self):
+        ''' Number of connected subscribers. '''
+        return self._subscribers
+
+    def subscribe(self):
+        '''
+        Generate encoded multipart chunks for one client.
+        The encoder thread is started with the first subscriber and stops
+        when the last one leaves.
+        '''
+        with self._cond:
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._encode_loop,
+                    name='StreamBroadcaster',
+                    daemon=True
+                )
+                self._thread.start()
+        try:
+            seq = 0
+            while self._vc.capture_ok:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: self._seq > seq,
+                        CT_SUBSCRIBER_WAIT_TIMEOUT
+                    )
+                    if self._seq <= seq:
+                        continue
+                    # Skip to latest, intermediate chunks are dropped
+                    seq, chunk = self._seq, self._chunk
+                yield chunk
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+    def _encode_loop(self):
+        '''
+        Encode each preview frame once and publish it to all subscribers.
+        '''
+        streamer = self._vc.chunk_streamer()
+        try:
+            for chunk in streamer:
+                with self._cond:
+                    if chunk:
+                        self._chunk = chunk
+                        self._seq += 1
+                        self._cond.notify_all()
+                    # Stop encoding when nobody is watching
+                    if self._subscribers == 0:
+                        self._thread = None
+                        return
+        finally:
+            streamer.close()
+            with self._cond:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+                self._cond.notify_all()
@@ -1,18 +1,59 @@
 import cv2
 import time
+import threading
+from collections import deque
+import numpy as np
 
 from ais.infrastructure.video import findUSBcameradevice
+from handheld.camera.framebuffer import FrameRingBuffer
+from handheld.camera.broadcaster import StreamBroadcaster
+from handheld.camera.framepacer import FramePacer
+from handheld.camera.previewencoder import (
+    PreviewEncoder,
+    CT_DEFAULT_PREVIEW_WORKERS
+)
+
+CT_DEFAULT_BUFFER_SIZE = 4
+CT_FRAME_WAIT_TIMEOUT = 1.0
+# libjpeg scaled decoding flags, downscale is done on DCT coefficients
+CT_REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
 
 
 class VideoCam:
     '''
     Handles video streaming and frame capturing.
     '''
-    def __init__(self, config: dict):
+    def __init__(
+            self,
+            config: dict,
+            camera_config: dict = None,
+            buffer_factory=None
+    ):
+        '''
+        Args:
+        - config (dict): app config.
+        - camera_config (dict, optional): device settings, same keys as
+          config['camerausb'] plus an optional 'resolution'. Defaults to
+          config['camerausb'].
+        - buffer_factory (callable, optional): creates the frame buffer
+          from (size, shape, passthrough), i.e. a shared memory ring.
+          FrameRingBuffer if not given.
+        '''
         # Load config
         self.config = config
+        self.camera_config = camera_config
+        if self.camera_config is None:
+            self.camera_config = self.config['camerausb']
+        resolution = self.camera_config.get(
+            'resolution', self.config['resolution']
+        )
         # Set capture device
-        self._capture_device = self.config['camerausb']['capture_device']
+        self._capture_device = self.camera_config['capture_device']
         # if not defined, use find_camera_port
         if type(self._capture_device) is str:
             self._capture_device = findUSBcameradevice.find_camera_port(
@@ -24,7 +65,9 @@ class VideoCam:
         )
 
         if not self.capture.isOpened():
-            raise Exception('Error: Could not open video source.')
+            raise Exception(
+                f'Error: Could not open video source {self._capture_device}.'
+            )
 
         # Set MJPG format for highs resolutions
         self.capture.set(
@@ -34,46 +77,301 @@ class VideoCam:
         # Set the capture resolution to the maximum defined resolution
         self.capture.set(
             cv2.CAP_PROP_FRAME_WIDTH,
-            self.config['resolution'][0]
+            resolution[0]
         )
         self.capture.set(
             cv2.CAP_PROP_FRAME_HEIGHT,
-            self.config['resolution'][1]
+            resolution[1]
         )
 
-        # Store last frame
-        self.frame = None
+        # MJPEG passthrough: keep compressed buffers, decode on demand
+        self.passthrough = self.camera_config.get(
+            'mjpeg_passthrough', False
+        )
+        if self.passthrough:
+            self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            self._preview_reduce = self.config['stream'].get(
+                'passthrough_reduce', 1
+            )
+            if self._preview_reduce not in CT_REDUCED_DECODE_FLAGS:
+                raise ValueError(
+                    'passthrough_reduce must be one of '
+                    f'{sorted(CT_REDUCED_DECODE_FLAGS)}'
+                )
 
-        # State variable, controls streamer while loop
+        # Shared ring buffer of full-resolution frames, preallocated with
+        # the resolution actually negotiated with the device. Compressed
+        # frames have variable size and are allocated by the capture.
+        frame_shape = (
+            int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            3
+        )
+        if self.passthrough or not all(frame_shape):
+            frame_shape = None
+        buffer_size = self.camera_config.get(
+            'buffer_size', CT_DEFAULT_BUFFER_SIZE
+        )
+        if buffer_factory is None:
+            self._buffer = FrameRingBuffer(buffer_size, shape=frame_shape)
+        else:
+            self._buffer = buffer_factory(
+                buffer_size,
+                frame_shape,
+                self.passthrough
+            )
+
+        # State variable, controls capture and streamer while loops
         self.capture_ok = True
 
-    def streamer(self):
+        # Pacer of the last started stream, source of stream stats
+        self._pacer = None
+
+        # Optional process pool for preview resize and encode, started
+        # with the first stream. Its slots fit a full-resolution frame.
+        max_nbytes = resolution[0] * resolution[1] * 3
+        if frame_shape is not None:
+            max_nbytes = max(max_nbytes, int(np.prod(frame_shape)))
+        self._init_preview_encoder(max_nbytes)
+
+        # Encode-once fan-out for video feed clients
+        self._broadcaster = StreamBroadcaster(self)
+
+        # Single capture thread, reads at the camera's native rate
+        self._capture_thread = threading.Thread(
+            target=self._capture_loop,
+            name=f'VideoCamCapture-{self._capture_device}',
+            daemon=True
+        )
+        self._capture_thread.start()
+
+    def _capture_loop(self):
         '''
-        Generate frames for video streaming at a lower resolution.
+        Read frames from the device into the ring buffer. It is the only
+        place where self.capture.read() is called.
         '''
         while self.capture_ok:
-            ret, frame = self.capture.read()
+            slot = self._buffer.acquire()
+            if slot is not None:
+                ret, frame = self.capture.read(slot)
+            else:
+                ret, frame = self.capture.read()
             # Update flag based on capture status
             self.capture_ok = ret
             if ret:
-                # Store the full-resolution frame
-                self.frame = frame
-                # Resize frame for streaming
+                self._buffer.commit(frame, time.time())
+        # Wake up consumers waiting for a frame
+        self._buffer.close()
+
+    def _init_preview_encoder(self, max_nbytes):
+        '''
+        Set up the optional preview process pool, used when
+        config['stream']['preview_workers'] is set.
+        Args:
+        - max_nbytes (int): largest frame handed to the pool.
+        '''
+        self._preview_workers = self.config['stream'].get(
+            'preview_workers', CT_DEFAULT_PREVIEW_WORKERS
+        )
+        self._preview_max_nbytes = max_nbytes
+        self._preview_encoder = None
+        # Final status of a stopped pool, kept for stream_stats()
+        self._preview_status = None
+        self._preview_lock = threading.Lock()
+
+    def _get_preview_encoder(self):
+        '''
+        Returns the preview process pool, started on first use, or None
+        if disabled.
+        '''
+        with self._preview_lock:
+            if self._preview_encoder is None and \
+                    self._preview_workers > 0 and self.capture_ok:
+                self._preview_encoder = PreviewEncoder(
+                    self._preview_workers,
+                    self._preview_max_nbytes,
+                    self.config['streaming_resolution']
+                )
+            return self._preview_encoder
+
+    def _stop_preview_encoder(self):
+        '''
+        Stop the preview process pool, if started. Streams started later
+        are encoded in process.
+        '''
+        with self._preview_lock:
+            encoder, self._preview_encoder = self._preview_encoder, None
+            # No restart after release
+            self._preview_workers = 0
+        if encoder is not None:
+            encoder.shutdown()
+            self._preview_status = {**encoder.status(), 'stopped': True}
+
+    def _new_pacer(self):
+        '''
+        Create a frame pacer for a new stream.
+        '''
+        self._pacer = FramePacer(self.config['stream']['max_fps'])
+        return self._pacer
+
+    def _raw_streamer(self, pacer):
+        '''
+        Generate (seq, frame) pairs from the shared ring buffer on the
+        pacer's frame deadlines, skipping to the latest frame. frame is a
+        view on the buffer slot, callers must check
+        self._buffer.is_valid(seq) after using it.
+        Args:
+        - pacer (FramePacer): stream scheduler.
+        '''
+        seq = 0
+        while self.capture_ok:
+            # Control max FPS on streaming
+            pacer.wait()
+            with pacer.stage('wait_frame'):
+                packet = self._buffer.wait_newer(
+                    seq,
+                    timeout=CT_FRAME_WAIT_TIMEOUT,
+                    copy=False
+                )
+            if packet is None:
+                continue
+            seq, _, frame = packet
+            yield seq, frame
+
+    def streamer(self, pacer=None):
+        '''
+        Generate frames for video streaming at a lower resolution.
+        Consumes the shared ring buffer, skipping to the latest frame.
+        Args:
+        - pacer (FramePacer, optional): scheduler shared with a caller
+          that adds more stages (i.e. encoding).
+        '''
+        own_pacer = pacer is None
+        if own_pacer:
+            pacer = self._new_pacer()
+        for seq, frame in self._raw_streamer(pacer):
+            if self.passthrough:
+                with pacer.stage('decode'):
+                    frame = self.decode_jpeg(
+                        frame,
+                        reduce=self._preview_reduce
+                    )
+                if frame is None:
+                    continue
+            # Resize frame for streaming
+            with pacer.stage('resize'):
                 small_frame = cv2.resize(
                     frame,
                     self.config['streaming_resolution']
                 )
-                yield small_frame
-                # Control max FPS on streaming
-                time.sleep(1/self.config['stream']['max_fps'])
+            # Drop frame if its slot was overwritten while resizing
+            if not self._buffer.is_valid(seq):
+                continue
+            if own_pacer:
+                pacer.frame_done()
+            yield small_frame
 
-    def encoded_streamer(self):
-        ''' Encoded frame streaming '''
-        for frame in self.streamer():
-            encoded_frame = self.encode_frame(frame)
+    def chunk_streamer(self):
+        '''
+        Generate multipart chunks for the preview.
+        In passthrough mode with no reduction the camera's own JPEG bytes
+        are served, skipping decode and re-encode. Otherwise frames are
+        resized and encoded by the preview process pool if enabled
+        (config['stream']['preview_workers']), or in this thread.
+        '''
+        pacer = self._new_pacer()
+        if self.passthrough and self._preview_reduce == 1:
+            for seq, frame in self._raw_streamer(pacer):
+                jpeg_bytes = frame.tobytes()
+                if self._buffer.is_valid(seq):
+                    pacer.frame_done()
+                    yield self._multipart(jpeg_bytes)
+            return
+        encoder = self._get_preview_encoder()
+        if encoder is not None:
+            yield from self._pool_chunk_streamer(pacer, encoder)
+            if not self.capture_ok:
+                return
+            # The pool broke, viewers already connected keep their stream
+        for frame in self.streamer(pacer):
+            with pacer.stage('encode'):
+                encoded_frame = self.encode_frame(frame)
             if encoded_frame:
+                pacer.frame_done()
                 yield encoded_frame
 
+    def _pool_chunk_streamer(self, pacer, encoder):
+        '''
+        Generate multipart chunks encoded by the preview process pool.
+        Frames are handed off as they come and chunks yielded in frame
+        order; frames arriving while every pool slot is busy are dropped.
+        If the pool breaks it is stopped and the generator returns, the
+        caller goes on encoding in process.
+        Args:
+        - pacer (FramePacer): stream scheduler.
+        - encoder (PreviewEncoder): preview process pool.
+        '''
+        pending = deque()
+        try:
+            for seq, frame in self._raw_streamer(pacer):
+                try:
+                    with pacer.stage('handoff'):
+                        future = encoder.submit(
+                            frame,
+                            jpeg=self.passthrough,
+                            reduce=self._preview_reduce,
+                            is_valid=lambda: self._buffer.is_valid(seq)
+                        )
+                except Exception:
+                    # Counted by the encoder, broken or stopped on release
+                    self._stop_preview_encoder()
+                    return
+                if future is not None:
+                    pending.append(future)
+                # Emit finished chunks in order, wait for the oldest one
+                # only if the pool is full
+                while pending and (
+                        pending[0].done() or
+                        len(pending) >= encoder.capacity
+                ):
+                    try:
+                        jpeg_bytes = pending.popleft().result()
+                    except Exception:
+                        # Counted by the encoder
+                        continue
+                    if jpeg_bytes:
+                        pacer.frame_done()
+                        yield self._multipart(jpeg_bytes)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def stream_stats(self):
+        '''
+        Returns pacing statistics of the current stream.
+        Returns:
+        - stats (dict): achieved versus target fps, dropped frames and
+          time per stage, or None if no stream was started. With the
+          preview process pool, its status under 'preview_encoder' (also
+          once stopped, i.e. after an error).
+        '''
+        stats = None
+        if self._pacer is not None:
+            stats = self._pacer.stats()
+            encoder = self._preview_encoder
+            if encoder is not None:
+                stats['preview_encoder'] = encoder.status()
+            elif self._preview_status is not None:
+                stats['preview_encoder'] = self._preview_status
+        return stats
+
+    def encoded_streamer(self):
+        '''
+        Encoded frame streaming. Frames are encoded once and shared by all
+        clients through the broadcaster.
+        '''
+        yield from self._broadcaster.subscribe()
+
     def encode_frame(self, frame):
         '''
         Returns binary representation of jpg encoded frame.
@@ -83,26 +381,92 @@ class VideoCam:
         encoded_frame = None
         ret, jpeg = cv2.imencode('.jpg', frame)
         if ret:
-            jpeg_bytes = jpeg.tobytes()
-            encoded_frame = (
-                b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n'
-                + jpeg_bytes +
-                b'\r\n'
-            )
+            encoded_frame = self._multipart(jpeg.tobytes())
         return encoded_frame
 
+    def _multipart(self, jpeg_bytes):
+        '''
+        Wraps JPEG bytes in the multipart boundary.
+        Args:
+        - jpeg_bytes (bytes)
+        '''
+        return (
+            b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n'
+            + jpeg_bytes +
+            b'\r\n'
+        )
+
+    def decode_jpeg(self, jpeg, reduce=1):
+        '''
+        Decode a compressed MJPEG frame.
+        Args:
+        - jpeg (numpy.ndarray or bytes): compressed frame.
+        - reduce (int): 1, 2, 4 or 8, scale down factor applied by libjpeg
+          while decoding.
+        Returns:
+        - frame (numpy.ndarray or None): decoded BGR frame.
+        '''
+        if isinstance(jpeg, bytes):
+            jpeg = np.frombuffer(jpeg, dtype=np.uint8)
+        return cv2.imdecode(jpeg, CT_REDUCED_DECODE_FLAGS[reduce])
+
+    def frame_seq(self):
+        '''
+        Returns the sequence number of the latest frame (0 if none).
+        '''
+        return self._buffer.seq
+
+    def frames_dropped(self):
+        '''
+        Returns the number of captured frames the buffer dropped.
+        '''
+        return self._buffer.dropped
+
+    def capture_frame(self):
+        '''
+        Returns the latest high resolution frame with its metadata.
+        Returns:
+        - (seq, timestamp, frame) tuple, or None if no frame captured yet.
+          frame is a private copy, safe to keep.
+        '''
+        packet = self._buffer.latest(copy=True)
+        if packet is not None and self.passthrough:
+            seq, timestamp, jpeg = packet
+            frame = self.decode_jpeg(jpeg)
+            packet = (seq, timestamp, frame) if frame is not None else None
+        return packet
+
+    def capture_jpeg(self):
+        '''
+        Returns the latest compressed frame as delivered by the camera.
+        Only available in passthrough mode.
+        Returns:
+        - (seq, timestamp, jpeg_bytes) tuple, or None.
+        '''
+        if not self.passthrough:
+            return None
+        packet = self._buffer.latest(copy=True)
+        if packet is not None:
+            seq, timestamp, jpeg = packet
+            packet = (seq, timestamp, jpeg.tobytes())
+        return packet
+
     def capture_image(self):
         '''
         Save the latest frame in high resolution.
         '''
         last_frame = None
-        if self.frame is not None:
-            last_frame = self.frame
+        packet = self.capture_frame()
+        if packet is not None:
+            last_frame = packet[2]
         return last_frame
 
     def release(self):
         '''
-        Release camera.
+        Stop capture thread and release camera.
         '''
+        self.capture_ok = False
+        self._capture_thread.join(timeout=CT_FRAME_WAIT_TIMEOUT)
         self.capture.release()
+        self._stop_preview_encoder()
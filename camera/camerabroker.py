@@ -0,0 +1,121 @@
+'''
+    camerabroker.py
+
+    Camera broker: the only process opening the camera devices. Frames of
+    every configured camera are written to a shared memory ring, web
+    worker processes read them with SharedVideoCam (config broker.enabled).
+    Start it before the web tier, web workers follow broker restarts.
+
+    # Usage:
+    pipenv run python -m handheld.camera.camerabroker \
+        --config handheld/config/config.yaml
+'''
+import argparse
+import signal
+import threading
+
+from handheld.camera.camera import VideoCam
+from handheld.camera.cameramanager import (
+    CameraManager,
+    CT_DEFAULT_BROKER_NAME
+)
+from handheld.camera.sharedframes import SharedFrameRing, get_shared_name
+
+CT_STATUS_INTERVAL = 10.0
+# Bytes per pixel of the slot capacity when the frame size is variable,
+# an MJPEG buffer is far smaller than the decoded frame
+CT_MAX_JPEG_BYTES_PER_PIXEL = 3
+
+
+class CameraBroker:
+    '''
+    Opens the configured cameras with their capture thread writing into
+    a shared frame ring instead of a private buffer.
+    '''
+    def __init__(self, config):
+        '''
+        Args:
+        - config (dict): app config.
+        '''
+        self.config = config
+        self.name = config.get('broker', {}).get(
+            'name',
+            CT_DEFAULT_BROKER_NAME
+        )
+        self._lock = threading.Lock()
+        self._rings = []
+        self.cameras = CameraManager(config, camera_factory=self._open)
+
+    def _open(self, cam_id, camera_config):
+        '''
+        Camera factory, capture into the camera's shared ring.
+        Returns:
+        - video_cam (VideoCam)
+        '''
+        resolution = camera_config.get(
+            'resolution', self.config['resolution']
+        )
+        max_nbytes = (
+            resolution[0] * resolution[1] * CT_MAX_JPEG_BYTES_PER_PIXEL
+        )
+
+        def buffer_factory(size, shape, passthrough):
+            ring = SharedFrameRing.create(
+                get_shared_name(self.name, cam_id),
+                size,
+                shape=shape,
+                max_nbytes=max_nbytes,
+                passthrough=passthrough
+            )
+            with self._lock:
+                self._rings.append(ring)
+            return ring
+
+        return VideoCam(
+            self.config,
+            camera_config,
+            buffer_factory=buffer_factory
+        )
+
+    def status(self):
+        ''' Returns cameras status, see CameraManager.status(). '''
+        return self.cameras.status()
+
+    def release(self):
+        ''' Release the cameras and remove their rings. '''
+        self.cameras.release()
+        with self._lock:
+            rings, self._rings = self._rings, []
+        for ring in rings:
+            ring.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Share the camera frames with the web workers.'
+    )
+    parser.add_argument('--config', default='handheld/config/config.yaml')
+    args = parser.parse_args()
+
+    from ais.infrastructure.readconfig import read_yaml_file
+    config = read_yaml_file(args.config)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    broker = CameraBroker(config)
+    print(f'Camera broker {broker.name}: {", ".join(broker.cameras.ids())}')
+    try:
+        while not stop.wait(CT_STATUS_INTERVAL):
+            for cam_id, status in broker.status()['cameras'].items():
+                print(
+                    f'{cam_id}: frame {status["seq"]}, '
+                    f'{status["dropped"]} dropped'
+                )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.release()
+
+
+if __name__ == '__main__':
+    main()
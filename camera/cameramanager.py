@@ -0,0 +1,130 @@
+'''
+This module opens every configured camera of a station or bench.
+It serves as a support module for automation/handheldresources.
+'''
+from concurrent.futures import ThreadPoolExecutor
+
+from handheld.camera.camera import VideoCam
+from handheld.camera.sharedcam import SharedVideoCam
+from handheld.camera.sharedframes import get_shared_name
+
+CT_DEFAULT_CAMERA_ID = 'main'
+CT_DEFAULT_BROKER_NAME = 'handheld'
+
+
+class CameraManager:
+    '''
+    Camera id -> VideoCam, each camera with its own capture thread and
+    frame buffer. Cameras are listed in config['camerausb']['cameras'] as
+    id -> settings overriding config['camerausb']; with no list the
+    single camerausb device is opened as CT_DEFAULT_CAMERA_ID. The first
+    camera is the default one.
+    Devices are opened in parallel, a camera that fails to open is
+    reported and left out unless no camera could be opened. With
+    config['broker']['enabled'] the cameras are read from the camera
+    broker process instead of opening the devices.
+    '''
+    def __init__(self, config, camera_factory=None):
+        '''
+        Args:
+        - config (dict): app config.
+        - camera_factory (callable, optional): creates a camera from
+          (cam_id, camera settings). VideoCam, or SharedVideoCam in broker
+          mode, if not given.
+        '''
+        if camera_factory is None:
+            camera_factory = self._get_camera_factory(config)
+        camerausb = config['camerausb']
+        cameras = camerausb.get('cameras') or {CT_DEFAULT_CAMERA_ID: {}}
+        camera_configs = {}
+        for cam_id, settings in cameras.items():
+            camera_config = {
+                key: value for key, value in camerausb.items()
+                if key != 'cameras'
+            }
+            camera_config.update(settings or {})
+            camera_configs[str(cam_id)] = camera_config
+
+        # Opening a device blocks for up to seconds, open them all at once
+        with ThreadPoolExecutor(
+                max_workers=len(camera_configs),
+                thread_name_prefix='CameraOpen'
+        ) as executor:
+            futures = {
+                cam_id: executor.submit(camera_factory, cam_id, camera_config)
+                for cam_id, camera_config in camera_configs.items()
+            }
+
+        self._cameras = {}
+        self.errors = {}
+        for cam_id, future in futures.items():
+            try:
+                self._cameras[cam_id] = future.result()
+            except Exception as e:
+                # Reported by status()
+                self.errors[cam_id] = str(e)
+        if not self._cameras:
+            raise Exception(
+                f'Error: Could not open any video source: {self.errors}'
+            )
+        self.default_id = next(iter(self._cameras))
+
+    @staticmethod
+    def _get_camera_factory(config):
+        ''' Returns the default camera factory of config. '''
+        broker_config = config.get('broker', {})
+        if broker_config.get('enabled', False):
+            name = broker_config.get('name', CT_DEFAULT_BROKER_NAME)
+            return lambda cam_id, camera_config: SharedVideoCam(
+                config,
+                get_shared_name(name, cam_id)
+            )
+        return lambda cam_id, camera_config: VideoCam(config, camera_config)
+
+    def get(self, cam_id=None):
+        '''
+        Returns a camera.
+        Args:
+        - cam_id (str, optional): camera id, default camera if not given.
+        Returns:
+        - video_cam (VideoCam)
+        Raises:
+        - KeyError: unknown or unavailable camera.
+        '''
+        if cam_id is None:
+            cam_id = self.default_id
+        return self._cameras[cam_id]
+
+    def ids(self):
+        ''' Returns the ids of the open cameras, default first. '''
+        return list(self._cameras)
+
+    def status(self):
+        '''
+        Returns cameras status.
+        Returns:
+        - status (dict): per camera latest frame sequence number, frames
+          dropped by the buffer and stream stats, cameras that failed to
+          open with their error.
+        '''
+        return {
+            'default': self.default_id,
+            'cameras': {
+                cam_id: {
+                    'seq': video_cam.frame_seq(),
+                    'dropped': video_cam.frames_dropped(),
+                    'stream': video_cam.stream_stats()
+                }
+                for cam_id, video_cam in self._cameras.items()
+            },
+            'errors': dict(self.errors)
+        }
+
+    def release(self):
+        ''' Stop every capture thread and release the devices. '''
+        with ThreadPoolExecutor(
+                max_workers=len(self._cameras),
+                thread_name_prefix='CameraRelease'
+        ) as executor:
+            for video_cam in self._cameras.values():
+                executor.submit(video_cam.release)
@@ -0,0 +1,134 @@
+'''
+This module holds the shared frame buffer used by VideoCam.
+It serves as a support module for camera/camera.
+'''
+import threading
+
+import numpy as np
+
+
+class FrameRingBuffer:
+    '''
+    Fixed-size ring buffer of full-resolution frames.
+    A single writer (the capture thread) fills preallocated slots in place,
+    any number of readers get the latest frame with its sequence number
+    and timestamp.
+    '''
+    def __init__(self, size, shape=None, dtype=np.uint8):
+        '''
+        Args:
+        - size (int): number of slots in the ring.
+        - shape (tuple, optional): frame shape used to preallocate slots.
+        - dtype (numpy.dtype): frame data type.
+        '''
+        if size < 2:
+            raise ValueError('FrameRingBuffer needs at least 2 slots.')
+        self.size = size
+        self._slots = [
+            np.empty(shape, dtype=dtype) if shape else None
+            for _ in range(size)
+        ]
+        # Sequence number stored in each slot, 0 while being written
+        self._slot_seqs = [0] * size
+        self._slot_timestamps = [0.0] * size
+        # Last committed sequence number
+        self._seq = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def seq(self):
+        ''' Last committed sequence number (0 if no frame yet). '''
+        return self._seq
+
+    @property
+    def dropped(self):
+        ''' Frames dropped by commit(), frames of any size fit. '''
+        return 0
+
+    def acquire(self):
+        '''
+        Reserve the next slot for writing. Only the writer thread may call it.
+        Returns:
+        - slot (numpy.ndarray or None): preallocated array to fill in place.
+        '''
+        idx = (self._seq + 1) % self.size
+        with self._cond:
+            # Invalidate slot so readers holding its old seq detect the reuse
+            self._slot_seqs[idx] = 0
+        return self._slots[idx]
+
+    def commit(self, frame, timestamp):
+        '''
+        Publish the slot reserved by acquire().
+        Args:
+        - frame (numpy.ndarray): written frame. If it is not the acquired
+          slot (i.e. shape changed), it replaces the slot.
+        - timestamp (float): capture time, seconds from Epoch.
+        '''
+        seq = self._seq + 1
+        idx = seq % self.size
+        if frame is not self._slots[idx]:
+            self._slots[idx] = frame
+        with self._cond:
+            self._slot_seqs[idx] = seq
+            self._slot_timestamps[idx] = timestamp
+            self._seq = seq
+            self._cond.notify_all()
+
+    def is_valid(self, seq):
+        '''
+        Check that the slot holding seq has not been reused yet.
+        Args:
+        - seq (int): frame sequence number.
+        '''
+        return seq > 0 and self._slot_seqs[seq % self.size] == seq
+
+    def latest(self, copy=True):
+        '''
+        Returns the latest frame.
+        Args:
+        - copy (bool): if False, returns a view on the slot, only valid
+          while is_valid(seq) holds.
+        Returns:
+        - (seq, timestamp, frame) tuple or None if no frame is available.
+        '''
+        while True:
+            with self._cond:
+                seq = self._seq
+                if seq == 0:
+                    return None
+                idx = seq % self.size
+                timestamp = self._slot_timestamps[idx]
+                frame = self._slots[idx]
+            if not copy:
+                return seq, timestamp, frame
+            frame = frame.copy()
+            # Retry if the writer wrapped around while copying
+            if self.is_valid(seq):
+                return seq, timestamp, frame
+
+    def wait_newer(self, seq, timeout=None, copy=True):
+        '''
+        Block until a frame newer than seq is available.
+        Args:
+        - seq (int): last sequence number seen by the caller.
+        - timeout (float, optional): max waiting time in seconds.
+        - copy (bool): see latest().
+        Returns:
+        - (seq, timestamp, frame) tuple or None on timeout or close.
+        '''
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: self._seq > seq or self._closed,
+                timeout
+            )
+            if not ready or self._seq <= seq:
+                return None
+        return self.latest(copy=copy)
+
+    def close(self):
+        ''' Wake up every waiting reader, no more frames will come. '''
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -0,0 +1,101 @@
+'''
+This module paces the video stream against absolute frame deadlines.
+It serves as a support module for camera/camera.
+'''
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+CT_FPS_WINDOW = 60
+CT_STAGE_SMOOTHING = 0.1
+
+
+class FramePacer:
+    '''
+    Deadline based frame scheduler.
+    Targets absolute deadlines (start + n * period) instead of sleeping a
+    fixed time after each frame, so processing time is absorbed by the
+    schedule. When behind, missed deadlines are dropped instead of slept.
+    '''
+    def __init__(self, max_fps):
+        '''
+        Args:
+        - max_fps (float): target frame rate.
+        '''
+        self.target_fps = max_fps
+        self.period = 1 / max_fps
+        self._next_deadline = None
+        self._lock = threading.Lock()
+        # Emit times of last frames, used to measure achieved fps
+        self._emitted = deque(maxlen=CT_FPS_WINDOW)
+        self._stage_ms = {}
+        self.frames = 0
+        self.dropped = 0
+
+    def wait(self):
+        '''
+        Wait for the next frame deadline.
+        Returns:
+        - dropped (int): number of frame deadlines missed since last call.
+        '''
+        now = time.monotonic()
+        if self._next_deadline is None:
+            self._next_deadline = now
+        dropped = 0
+        if now < self._next_deadline:
+            time.sleep(self._next_deadline - now)
+        else:
+            # Behind schedule: skip missed deadlines, do not sleep
+            dropped = int((now - self._next_deadline) / self.period)
+        self._next_deadline += (dropped + 1) * self.period
+        with self._lock:
+            self.dropped += dropped
+        return dropped
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Measure time spent on a pipeline stage.
+        Args:
+        - name (str): stage name (i.e. 'resize', 'encode').
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                avg = self._stage_ms.get(name, elapsed_ms)
+                self._stage_ms[name] = (
+                    avg + CT_STAGE_SMOOTHING * (elapsed_ms - avg)
+                )
+
+    def frame_done(self):
+        ''' Register an emitted frame. '''
+        with self._lock:
+            self.frames += 1
+            self._emitted.append(time.monotonic())
+
+    def stats(self):
+        '''
+        Returns pacing statistics.
+        Returns:
+        - stats (dict): target and achieved fps, frame counters and
+          smoothed time per stage in milliseconds.
+        '''
+        with self._lock:
+            achieved_fps = 0.0
+            if len(self._emitted) > 1:
+                elapsed = self._emitted[-1] - self._emitted[0]
+                if elapsed > 0:
+                    achieved_fps = (len(self._emitted) - 1) / elapsed
+            return {
+                'target_fps': self.target_fps,
+                'achieved_fps': round(achieved_fps, 2),
+                'frames': self.frames,
+                'dropped': self.dropped,
+                'stages_ms': {
+                    name: round(ms, 3) for name, ms in self._stage_ms.items()
+                }
+            }
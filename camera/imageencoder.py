@@ -0,0 +1,104 @@
+'''
+This module encodes full-resolution captures off the request thread.
+It serves as a support module for automation/handheldopsman.
+'''
+import cv2
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+CT_DEFAULT_ENCODER_WORKERS = 2
+CT_DEFAULT_ENCODER_CACHE = 8
+
+
+class ImageEncoder:
+    '''
+    Thread pool backed image encoder.
+    cv2.imencode releases the GIL, so encodes of different frames run in
+    parallel. Concurrent requests for the same frame sequence number are
+    coalesced into one encode and recent results are cached.
+    '''
+    def __init__(
+            self,
+            workers=CT_DEFAULT_ENCODER_WORKERS,
+            cache_size=CT_DEFAULT_ENCODER_CACHE
+    ):
+        '''
+        Args:
+        - workers (int): encoding threads.
+        - cache_size (int): number of encoded frames kept.
+        '''
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='ImageEncoder'
+        )
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        # (seq, ext) -> Future, pending or done, in LRU order
+        self._futures = OrderedDict()
+
+    def submit(self, seq, frame, ext='.jpg'):
+        '''
+        Schedule the encode of a frame, or join the one already scheduled
+        for the same frame.
+        Args:
+        - seq (hashable): frame sequence number, identifies the frame
+          (i.e. (camera id, seq) with several cameras).
+        - frame (numpy.ndarray): frame to encode.
+        - ext (str): image format extension (i.e. '.jpg').
+        Returns:
+        - future (concurrent.futures.Future): resolves to bytes or None.
+        '''
+        key = (seq, ext)
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self._futures.move_to_end(key)
+                return future
+            future = self._executor.submit(self._encode, frame, ext)
+            self._futures[key] = future
+            while len(self._futures) > self._cache_size:
+                self._futures.popitem(last=False)
+        future.add_done_callback(lambda f: self._forget_failed(key, f))
+        return future
+
+    def encode(self, seq, frame, ext='.jpg', timeout=None):
+        '''
+        Encode a frame, blocking until the result is available.
+        Args:
+        - seq, frame, ext: see submit().
+        - timeout (float, optional): max waiting time in seconds.
+        Returns:
+        - data (bytes): if not None, encoded frame.
+        '''
+        return self.submit(seq, frame, ext).result(timeout)
+
+    def shutdown(self):
+        ''' Stop encoding threads. '''
+        self._executor.shutdown(wait=False)
+
+    def _encode(self, frame, ext):
+        '''
+        Encode frame to given format.
+        Returns:
+        - data (bytes): if not None, encoded frame.
+        '''
+        data = None
+        enc_success, buffer = cv2.imencode(ext, frame)
+        if enc_success:
+            data = buffer.tobytes()
+        return data
+
+    def _forget_failed(self, key, future):
+        '''
+        Remove failed encodes from cache so they can be retried.
+        '''
+        if (
+            not future.cancelled() and
+            future.exception() is None and
+            future.result() is not None
+        ):
+            return
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
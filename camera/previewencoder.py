@@ -0,0 +1,219 @@
+'''
+This module resizes and encodes preview frames in a process pool.
+It serves as a support module for camera/camera.
+'''
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import cv2
+import numpy as np
+
+CT_DEFAULT_PREVIEW_WORKERS = 0
+# In-flight frames per worker, one being encoded and one queued
+CT_SLOTS_PER_WORKER = 2
+# OpenCV default, same output as the in-process encoder
+CT_PREVIEW_JPEG_QUALITY = 95
+# libjpeg scaled decoding flags, same as camera.CT_REDUCED_DECODE_FLAGS
+CT_WORKER_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# Worker process state, set by _init_worker
+_worker_shm = None
+_worker_slots = None
+
+
+def _init_worker(name, n_slots, capacity):
+    '''
+    Worker initializer: attach the input slots.
+    '''
+    global _worker_shm, _worker_slots
+    # Ignore parent's OpenCV threads, the pool is the parallelism
+    cv2.setNumThreads(1)
+    # Workers share the parent's resource tracker, the memory is removed
+    # once by the parent
+    _worker_shm = shared_memory.SharedMemory(name=name)
+    _worker_slots = np.ndarray(
+        (n_slots, capacity),
+        dtype=np.uint8,
+        buffer=_worker_shm.buf
+    )
+
+
+def _encode_slot(slot, nbytes, shape, reduce, size, quality):
+    '''
+    Worker task: decode (JPEG input), resize and JPEG-encode a slot.
+    Args:
+    - slot (int): input slot index.
+    - nbytes (int): frame size in the slot.
+    - shape (tuple): frame shape, None for JPEG input.
+    - reduce (int): libjpeg scale down of JPEG input.
+    - size (tuple): preview (width, height).
+    - quality (int): JPEG quality.
+    Returns:
+    - jpeg_bytes (bytes or None)
+    '''
+    data = _worker_slots[slot, :nbytes]
+    if shape is None:
+        frame = cv2.imdecode(data, CT_WORKER_DECODE_FLAGS[reduce])
+        if frame is None:
+            return None
+    else:
+        frame = data.reshape(shape)
+    small_frame = cv2.resize(frame, tuple(size))
+    ret, jpeg = cv2.imencode(
+        '.jpg',
+        small_frame,
+        [cv2.IMWRITE_JPEG_QUALITY, quality]
+    )
+    return jpeg.tobytes() if ret else None
+
+
+class PreviewEncoder:
+    '''
+    Process pool doing the preview resize and JPEG encode off the web
+    process, so it does not compete for the GIL with request handling.
+    Frames are handed off through shared memory slots; when every slot is
+    in flight the pool is saturated and new frames are dropped. Callers
+    consume the returned futures in submission order.
+    '''
+    def __init__(self, workers, max_nbytes, size,
+                 quality=CT_PREVIEW_JPEG_QUALITY):
+        '''
+        Args:
+        - workers (int): worker processes.
+        - max_nbytes (int): largest frame, sets the slot capacity.
+        - size (tuple): preview (width, height).
+        - quality (int): JPEG quality.
+        '''
+        self.workers = workers
+        self.capacity = workers * CT_SLOTS_PER_WORKER
+        self._max_nbytes = int(max_nbytes)
+        self._size = tuple(size)
+        self._quality = quality
+        self._shm = shared_memory.SharedMemory(
+            create=True,
+            size=self.capacity * self._max_nbytes
+        )
+        self._slots = np.ndarray(
+            (self.capacity, self._max_nbytes),
+            dtype=np.uint8,
+            buffer=self._shm.buf
+        )
+        self._lock = threading.Lock()
+        self._free = list(range(self.capacity))
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_error = None
+        # Spawned, forking the threaded web process is unsafe
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self._shm.name, self.capacity, self._max_nbytes)
+        )
+        # Start the workers now instead of on the first preview frame
+        for _ in range(workers):
+            self._executor.submit(int)
+
+    @property
+    def in_flight(self):
+        ''' Number of frames being encoded. '''
+        with self._lock:
+            return self.capacity - len(self._free)
+
+    def submit(self, frame, jpeg=False, reduce=1, is_valid=None):
+        '''
+        Copy a frame to a free slot and queue its encode.
+        Args:
+        - frame (numpy.ndarray): BGR frame, or JPEG buffer if jpeg.
+        - jpeg (bool): frame is a camera JPEG buffer.
+        - reduce (int): libjpeg scale down of JPEG frames.
+        - is_valid (callable, optional): checked after the copy, the
+          frame is dropped if it returns False (i.e. source slot reused).
+        Returns:
+        - future (concurrent.futures.Future or None): resolves to JPEG
+          bytes or None. None if the frame was dropped.
+        Raises:
+        - Exception: the frame could not be queued (i.e. broken or shut
+          down pool), counted as failed.
+        '''
+        nbytes = frame.nbytes
+        if nbytes > self._max_nbytes:
+            with self._lock:
+                self.dropped += 1
+            return None
+        with self._lock:
+            if not self._free:
+                self.dropped += 1
+                return None
+            slot = self._free.pop()
+
+        try:
+            self._slots[slot, :nbytes] = frame.reshape(-1)
+            if is_valid is not None and not is_valid():
+                self._free_slot(slot)
+                return None
+            future = self._executor.submit(
+                _encode_slot,
+                slot,
+                nbytes,
+                None if jpeg else frame.shape,
+                reduce,
+                self._size,
+                self._quality
+            )
+        except Exception as e:
+            self._free_slot(slot)
+            self._set_error(e)
+            raise
+        with self._lock:
+            self.submitted += 1
+        future.add_done_callback(lambda f: self._done(slot, f))
+        return future
+
+    def status(self):
+        '''
+        Returns encoder status.
+        Returns:
+        - status (dict): workers, in flight, submitted, dropped and
+          failed frames, last error.
+        '''
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'in_flight': self.capacity - len(self._free),
+                'submitted': self.submitted,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'last_error': self.last_error
+            }
+
+    def shutdown(self):
+        ''' Stop the workers and remove the slots. '''
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        del self._slots
+        self._shm.close()
+        self._shm.unlink()
+
+    def _done(self, slot, future):
+        ''' Free the slot of a finished encode. '''
+        if not future.cancelled() and future.exception() is not None:
+            self._set_error(future.exception())
+        self._free_slot(slot)
+
+    def _set_error(self, error):
+        ''' Count a failed frame. '''
+        with self._lock:
+            self.failed += 1
+            self.last_error = str(error)
+
+    def _free_slot(self, slot):
+        ''' Give a slot back. '''
+        with self._lock:
+            self._free.append(slot)
@@ -0,0 +1,58 @@
+'''
+This module reads the frames of a camera owned by the camera broker.
+It serves as a support module for camera/cameramanager.
+'''
+from handheld.camera.camera import VideoCam, CT_REDUCED_DECODE_FLAGS
+from handheld.camera.broadcaster import StreamBroadcaster
+from handheld.camera.sharedframes import SharedFrameRing
+
+
+class SharedVideoCam(VideoCam):
+    '''
+    VideoCam reading the shared memory ring of the camera broker instead
+    of a device, so any number of web worker processes can serve the same
+    camera. Streaming works on zero-copy views of the ring; captures
+    return private copies, safe to keep.
+    '''
+    def __init__(self, config: dict, name: str):
+        '''
+        Args:
+        - config (dict): app config.
+        - name (str): shared memory name of the camera ring, see
+          sharedframes.get_shared_name().
+        Raises:
+        - FileNotFoundError: the broker is not running.
+        '''
+        self.config = config
+        self.camera_config = config['camerausb']
+        self._capture_device = name
+        self._buffer = SharedFrameRing.attach(name)
+        self._preview_reduce = self.config['stream'].get(
+            'passthrough_reduce', 1
+        )
+        if self._preview_reduce not in CT_REDUCED_DECODE_FLAGS:
+            raise ValueError(
+                'passthrough_reduce must be one of '
+                f'{sorted(CT_REDUCED_DECODE_FLAGS)}'
+            )
+        # Streams run until release, the ring follows broker restarts
+        self.capture_ok = True
+        self._pacer = None
+        self._broadcaster = StreamBroadcaster(self)
+        self._init_preview_encoder(self._buffer.max_nbytes)
+
+    @property
+    def passthrough(self):
+        '''
+        True if the broker shares camera JPEG buffers, it may change when
+        the broker restarts.
+        '''
+        return self._buffer.passthrough
+
+    def release(self):
+        '''
+        Stop streams and detach from the broker ring.
+        '''
+        self.capture_ok = False
+        self._stop_preview_encoder()
+        self._buffer.release()
@@ -0,0 +1,426 @@
+'''
+This module holds the frame ring shared between processes through
+multiprocessing.shared_memory.
+It serves as a support module for camera/camerabroker and camera/sharedcam.
+'''
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+CT_SHARED_FRAMES_MAGIC = 0x48484652  # 'HHFR'
+CT_HEADER_FIELDS = 16
+CT_SLOT_FIELDS = 8
+CT_FIELD_BYTES = 8
+CT_DATA_ALIGN = 4096
+CT_MAX_NDIM = 3
+# Readers poll the ring, there is no cross-process condition
+CT_POLL_INTERVAL = 0.002
+# Seconds without a new frame (or since the writer closed the ring)
+# before readers look for the ring of a restarted writer, then between
+# attempts
+CT_REATTACH_INTERVAL = 1.0
+# Header fields
+CT_H_MAGIC = 0
+CT_H_TOKEN = 1
+CT_H_SIZE = 2
+CT_H_CAPACITY = 3
+CT_H_SEQ = 4
+CT_H_CLOSED = 5
+CT_H_PASSTHROUGH = 6
+CT_H_DROPPED = 7
+CT_H_WRITER_PID = 8
+# Slot fields, followed by the frame shape
+CT_S_SEQ = 0
+CT_S_TIMESTAMP_NS = 1
+CT_S_NBYTES = 2
+CT_S_NDIM = 3
+CT_S_SHAPE = 4
+
+
+def get_shared_name(prefix, cam_id):
+    '''
+    Returns the shared memory name of a camera ring.
+    Args:
+    - prefix (str): broker name.
+    - cam_id (str): camera id.
+    '''
+    return f'{prefix}_{cam_id}'
+
+
+class SharedFrameRing:
+    '''
+    Fixed-size ring of uint8 frames in shared memory, with the interface
+    of FrameRingBuffer. One writer process (the camera broker) fills the
+    slots in place, reader processes attach read-only and get zero-copy
+    views.
+    Every slot works as a seqlock: its sequence number is cleared before
+    the slot is written and set once the frame is complete, so a reader
+    detects a torn or reused slot by checking it again (is_valid()).
+    Readers whose ring is closed or stops advancing reopen the name, and
+    switch to the ring of a restarted writer when its token differs, so
+    they also recover from a writer that was killed.
+    Layout: int64 header, int64 metadata per slot, then page aligned
+    frame data of a fixed capacity per slot.
+    '''
+    def __init__(self, shm, owner):
+        '''
+        Use create() or attach().
+        Args:
+        - shm (shared_memory.SharedMemory)
+        - owner (bool): True in the writer process.
+        '''
+        self.name = shm.name
+        self._owner = owner
+        self._retired = []
+        self._released = False
+        self._map(shm)
+        self._seen_seq = None
+        self._next_reattach = 0
+
+    @classmethod
+    def create(cls, name, size, shape=None, max_nbytes=None,
+               passthrough=False):
+        '''
+        Create the ring, replacing a stale one with the same name.
+        Args:
+        - name (str): shared memory name.
+        - size (int): number of slots.
+        - shape (tuple, optional): frame shape, sets the slot capacity.
+        - max_nbytes (int, optional): slot capacity for frames of variable
+          size (i.e. MJPEG buffers), required if shape is not given.
+        - passthrough (bool): frames are camera JPEG buffers.
+        Returns:
+        - ring (SharedFrameRing)
+        Raises:
+        - FileExistsError: the ring belongs to a running writer.
+        '''
+        if size < 2:
+            raise ValueError('SharedFrameRing needs at least 2 slots.')
+        if shape:
+            capacity = int(np.prod(shape))
+        elif max_nbytes:
+            capacity = int(max_nbytes)
+        else:
+            raise ValueError('SharedFrameRing needs shape or max_nbytes.')
+
+        data_offset = cls._data_offset(size)
+        nbytes = data_offset + size * capacity
+        cls._remove_stale(name)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+
+        header = np.ndarray(
+            (CT_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf
+        )
+        header[:] = 0
+        header[CT_H_SIZE] = size
+        header[CT_H_CAPACITY] = capacity
+        header[CT_H_PASSTHROUGH] = int(passthrough)
+        header[CT_H_WRITER_PID] = os.getpid()
+        # Tells readers a restarted writer created a new ring
+        header[CT_H_TOKEN] = time.time_ns() ^ os.getpid()
+        header[CT_H_MAGIC] = CT_SHARED_FRAMES_MAGIC
+        ring = cls(shm, owner=True)
+        ring._slot_meta[:] = 0
+        ring._shape = tuple(shape) if shape else None
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        '''
+        Attach to the ring of a writer process.
+        Args:
+        - name (str): shared memory name.
+        Returns:
+        - ring (SharedFrameRing)
+        Raises:
+        - FileNotFoundError: no writer is running.
+        '''
+        return cls(cls._open(name), owner=False)
+
+    @classmethod
+    def _remove_stale(cls, name):
+        '''
+        Remove a ring left behind by a writer that did not exit cleanly.
+        Raises:
+        - FileExistsError: its writer is still running.
+        '''
+        try:
+            shm = cls._open(name)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # Not a ring, the name is taken
+            raise FileExistsError(f'{name} is not a shared frame ring.')
+        pid = int(np.ndarray(
+            (CT_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf
+        )[CT_H_WRITER_PID])
+        shm.close()
+        if _is_running(pid):
+            raise FileExistsError(
+                f'{name} is in use by writer process {pid}.'
+            )
+        stale = shared_memory.SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+
+    @staticmethod
+    def _open(name):
+        ''' Open an existing ring, returns its SharedMemory. '''
+        # Readers must not unlink the writer's memory when they exit
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        header = np.ndarray(
+            (CT_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf
+        )
+        if header[CT_H_MAGIC] != CT_SHARED_FRAMES_MAGIC:
+            del header
+            shm.close()
+            raise ValueError(f'{name} is not a shared frame ring.')
+        return shm
+
+    @staticmethod
+    def _data_offset(size):
+        ''' Returns the offset of the first slot data. '''
+        meta = (CT_HEADER_FIELDS + size * CT_SLOT_FIELDS) * CT_FIELD_BYTES
+        return -(-meta // CT_DATA_ALIGN) * CT_DATA_ALIGN
+
+    def _map(self, shm):
+        ''' Create the header, metadata and data views of shm. '''
+        self._shm = shm
+        self._header = np.ndarray(
+            (CT_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf
+        )
+        self.size = int(self._header[CT_H_SIZE])
+        self._capacity = int(self._header[CT_H_CAPACITY])
+        self._token = int(self._header[CT_H_TOKEN])
+        self.passthrough = bool(self._header[CT_H_PASSTHROUGH])
+        self._slot_meta = np.ndarray(
+            (self.size, CT_SLOT_FIELDS),
+            dtype=np.int64,
+            buffer=shm.buf,
+            offset=CT_HEADER_FIELDS * CT_FIELD_BYTES
+        )
+        self._data = np.ndarray(
+            (self.size, self._capacity),
+            dtype=np.uint8,
+            buffer=shm.buf,
+            offset=self._data_offset(self.size)
+        )
+        self._shape = None
+
+    @property
+    def seq(self):
+        ''' Last committed sequence number (0 if no frame yet). '''
+        seq = int(self._header[CT_H_SEQ])
+        if self._reattach(seq):
+            seq = int(self._header[CT_H_SEQ])
+        return seq
+
+    @property
+    def max_nbytes(self):
+        ''' Slot capacity, largest frame the ring holds. '''
+        return self._capacity
+
+    @property
+    def dropped(self):
+        ''' Frames dropped by the writer, larger than the slot capacity. '''
+        return int(self._header[CT_H_DROPPED])
+
+    @property
+    def closed(self):
+        ''' True once the writer stopped. '''
+        return bool(self._header[CT_H_CLOSED])
+
+    def acquire(self):
+        '''
+        Reserve the next slot for writing. Only the writer may call it.
+        Returns:
+        - slot (numpy.ndarray or None): slot view to fill in place, None
+          for frames of variable size.
+        '''
+        idx = (int(self._header[CT_H_SEQ]) + 1) % self.size
+        # Invalidate slot so readers holding its old seq detect the reuse
+        self._slot_meta[idx, CT_S_SEQ] = 0
+        if self._shape is None:
+            return None
+        return self._data[idx, :self._capacity].reshape(self._shape)
+
+    def commit(self, frame, timestamp):
+        '''
+        Publish the slot reserved by acquire().
+        Args:
+        - frame (numpy.ndarray): written frame, copied into the slot if it
+          is not the acquired view. Frames larger than the slot capacity
+          are dropped and counted (dropped).
+        - timestamp (float): capture time, seconds from Epoch.
+        '''
+        seq = int(self._header[CT_H_SEQ]) + 1
+        idx = seq % self.size
+        if frame.nbytes > self._capacity or frame.ndim > CT_MAX_NDIM:
+            self._header[CT_H_DROPPED] += 1
+            return
+        data = self._data[idx, :frame.nbytes]
+        if not np.may_share_memory(data, frame):
+            data[:] = frame.reshape(-1)
+        meta = self._slot_meta[idx]
+        meta[CT_S_TIMESTAMP_NS] = int(timestamp * 1e9)
+        meta[CT_S_NBYTES] = frame.nbytes
+        meta[CT_S_NDIM] = frame.ndim
+        meta[CT_S_SHAPE:CT_S_SHAPE + frame.ndim] = frame.shape
+        # Publish the slot, then the ring sequence number
+        meta[CT_S_SEQ] = seq
+        self._header[CT_H_SEQ] = seq
+
+    def is_valid(self, seq):
+        '''
+        Check that the slot holding seq has not been reused yet.
+        Args:
+        - seq (int): frame sequence number.
+        '''
+        return seq > 0 and self._slot_meta[seq % self.size, CT_S_SEQ] == seq
+
+    def latest(self, copy=True):
+        '''
+        Returns the latest frame.
+        Args:
+        - copy (bool): if False, returns a read-only view on the slot,
+          only valid while is_valid(seq) holds.
+        Returns:
+        - (seq, timestamp, frame) tuple or None if no frame is available.
+        '''
+        while True:
+            seq = self.seq
+            if seq == 0:
+                return None
+            idx = seq % self.size
+            meta = self._slot_meta[idx].copy()
+            # Metadata is consistent only if the slot was not touched
+            # while reading it
+            if meta[CT_S_SEQ] != seq or not self.is_valid(seq):
+                if self.seq == seq:
+                    # Writer stopped halfway through the slot
+                    return None
+                continue
+            ndim = int(meta[CT_S_NDIM])
+            shape = tuple(int(n) for n in meta[CT_S_SHAPE:CT_S_SHAPE + ndim])
+            nbytes = int(meta[CT_S_NBYTES])
+            frame = self._data[idx, :nbytes].reshape(shape)
+            timestamp = meta[CT_S_TIMESTAMP_NS] / 1e9
+            if not copy:
+                frame.flags.writeable = False
+                return seq, timestamp, frame
+            frame = frame.copy()
+            # Retry if the writer wrapped around while copying
+            if self.is_valid(seq):
+                return seq, timestamp, frame
+
+    def wait_newer(self, seq, timeout=None, copy=True):
+        '''
+        Wait until a frame newer than seq is available.
+        Args:
+        - seq (int): last sequence number seen by the caller.
+        - timeout (float, optional): max waiting time in seconds.
+        - copy (bool): see latest().
+        Returns:
+        - (seq, timestamp, frame) tuple or None on timeout or close.
+        '''
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        token = self._token
+        while True:
+            current = self.seq
+            if self._token != token or current < seq:
+                # Restarted writer, sequence numbers start over
+                token, seq = self._token, 0
+            if current > seq:
+                return self.latest(copy=copy)
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(CT_POLL_INTERVAL)
+
+    def close(self):
+        ''' Tell readers no more frames will come. '''
+        if self._owner:
+            self._header[CT_H_CLOSED] = 1
+
+    def release(self):
+        ''' Unmap the ring, the writer also removes it. '''
+        self.close()
+        self._released = True
+        # Drop the views on the mapping, threads still reading see an
+        # empty closed ring
+        self._header = np.zeros((CT_HEADER_FIELDS,), dtype=np.int64)
+        self._header[CT_H_CLOSED] = 1
+        self._slot_meta = np.zeros(
+            (self.size, CT_SLOT_FIELDS), dtype=np.int64
+        )
+        self._data = np.zeros((self.size, 0), dtype=np.uint8)
+        for shm in self._retired + [self._shm]:
+            try:
+                shm.close()
+            except BufferError:
+                # A frame view is still in use, unmapped when collected
+                pass
+        if self._owner:
+            self._shm.unlink()
+
+    def _reattach(self, seq):
+        '''
+        Readers: switch to the new ring of a restarted writer, looked up
+        once the ring is closed or seq stopped advancing. The old mapping
+        is kept, frame views on it may still be in use.
+        Args:
+        - seq (int): current sequence number.
+        Returns:
+        - True if the ring was switched.
+        '''
+        if self._owner or self._released:
+            return False
+        now = time.monotonic()
+        if seq != self._seen_seq and not self._header[CT_H_CLOSED]:
+            # Writer alive
+            self._seen_seq = seq
+            self._next_reattach = now + CT_REATTACH_INTERVAL
+            return False
+        if now < self._next_reattach:
+            return False
+        self._next_reattach = now + CT_REATTACH_INTERVAL
+        try:
+            shm = self._open(self.name)
+        except (FileNotFoundError, ValueError):
+            return False
+        token = np.ndarray(
+            (CT_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf
+        )[CT_H_TOKEN]
+        if token == self._token:
+            shm.close()
+            return False
+        self._retired.append(self._shm)
+        self._map(shm)
+        self._seen_seq = None
+        return True
+
+
+def _is_running(pid):
+    '''
+    Returns True if process pid is running.
+    Args:
+    - pid (int): process id, 0 if unknown.
+    '''
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running under another user
+        return True
+    return True
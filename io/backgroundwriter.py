@@ -0,0 +1,149 @@
+'''
+This module runs file writes on background threads.
+It serves as a support module for io/localoutput.
+'''
+import queue
+import threading
+
+CT_DEFAULT_WRITER_WORKERS = 1
+CT_DEFAULT_WRITER_QUEUE_SIZE = 16
+CT_DEFAULT_WRITER_PUT_TIMEOUT = 5.0
+# Seconds between stop checks of an idle worker
+CT_WORKER_POLL_INTERVAL = 0.5
+
+
+class BackgroundWriter:
+    '''
+    Bounded queue of write tasks consumed by worker threads.
+    When the queue is full (slow disk) producers block up to put_timeout
+    and then write synchronously, so no image is ever dropped.
+    '''
+    def __init__(
+            self,
+            workers=CT_DEFAULT_WRITER_WORKERS,
+            queue_size=CT_DEFAULT_WRITER_QUEUE_SIZE,
+            put_timeout=CT_DEFAULT_WRITER_PUT_TIMEOUT
+    ):
+        '''
+        Args:
+        - workers (int): number of writer threads.
+        - queue_size (int): max pending tasks before backpressure.
+        - put_timeout (float): max seconds a producer waits for room.
+        '''
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._put_timeout = put_timeout
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._written = 0
+        self._failed = 0
+        self._last_error = None
+        self._closed = False
+        # Set by close(), workers exit once the queue is empty
+        self._stop = threading.Event()
+        self._workers = [
+            threading.Thread(
+                target=self._work,
+                name=f'BackgroundWriter-{i}',
+                daemon=True
+            )
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, task, *args):
+        '''
+        Queue a write task.
+        Args:
+        - task (callable): function doing the write.
+        - args: task arguments.
+        '''
+        # Checked and counted under the lock, so close() either waits
+        # for this task or rejects it
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('BackgroundWriter is closed.')
+            self._pending += 1
+        try:
+            self._queue.put((task, args), timeout=self._put_timeout)
+        except queue.Full:
+            # Backpressure: disk is not keeping up, write in caller thread
+            self._run(task, args)
+
+    def flush(self, timeout=None):
+        '''
+        Wait until every queued task has been written.
+        Args:
+        - timeout (float, optional): max waiting time in seconds.
+        Returns:
+        - bool: True if nothing is pending.
+        '''
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout=None):
+        '''
+        Flush pending tasks and stop workers.
+        Args:
+        - timeout (float, optional): max flush time in seconds.
+        '''
+        with self._cond:
+            if self._closed:
+                return
+            # No new task from here, queued ones are flushed below
+            self._closed = True
+        self.flush(timeout)
+        self._stop.set()
+        for _ in self._workers:
+            try:
+                # Wakes up idle workers, busy ones see the stop event
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def status(self):
+        '''
+        Returns writer status.
+        Returns:
+        - status (dict): pending, written and failed writes, last error.
+        '''
+        with self._cond:
+            return {
+                'pending': self._pending,
+                'written': self._written,
+                'failed': self._failed,
+                'last_error': self._last_error
+            }
+
+    def _work(self):
+        ''' Worker loop. '''
+        while True:
+            try:
+                item = self._queue.get(timeout=CT_WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                if self._stop.is_set():
+                    break
+                continue
+            if item is None:
+                break
+            task, args = item
+            self._run(task, args)
+
+    def _run(self, task, args):
+        ''' Run a task and update counters. '''
+        try:
+            task(*args)
+        except Exception as e:
+            # Reported by status()
+            with self._cond:
+                self._failed += 1
+                self._last_error = str(e)
+        else:
+            with self._cond:
+                self._written += 1
+        finally:
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify_all()
@@ -1,32 +1,183 @@
-import cv2
-import os
-
-
-class LocalOutput:
-    '''
-    Handles local storage tasks.
-    '''
-    def __init__(self, config):
-        self.config = config
-        self.save_path = config['io']['local_save_path']
-
-    def generate_local_path(self, file_name):
-        '''
-        Builds the full local path for saving the file.
-        Args:
-        - file_name (str): use file_name to generate localpath.
-        Returns:
-        - local_path (str): generated local_path to save file.
-        '''
-        local_path = os.path.join(self.save_path, file_name)
-
-        return local_path
-
-    def imwrite(self, image, output_path):
-        '''
-        Saves given image locally with a timestamped filename.
-        Args:
-        - image (np.array): image to be saved locally.
-        - output_path (str): local path to save given image.
-        '''
-        cv2.imwrite(output_path, image)
+import cv2
+import os
+import atexit
+import numpy as np
+
+from handheld.io.backgroundwriter import (
+    BackgroundWriter,
+    CT_DEFAULT_WRITER_WORKERS,
+    CT_DEFAULT_WRITER_QUEUE_SIZE,
+    CT_DEFAULT_WRITER_PUT_TIMEOUT
+)
+
+CT_DEFAULT_STORAGE_PROFILE = 'png'
+CT_DEFAULT_PNG_COMPRESSION = 3
+CT_DEFAULT_JPEG_QUALITY = 95
+# Storage profiles:
+# - jpeg: already encoded capture bytes written as is (no re-encode)
+# - png: lossless PNG with configurable compression level
+# - webp_lossless: lossless WebP (quality > 100 selects lossless)
+CT_STORAGE_PROFILES = {
+    'jpeg': '.jpg',
+    'png': '.png',
+    'webp_lossless': '.webp'
+}
+
+
+class LocalOutput:
+    '''
+    Handles local storage tasks.
+    '''
+    def __init__(self, config):
+        self.config = config
+        self.save_path = config['io']['local_save_path']
+        # Storage codec
+        self.storage_profile = config['io'].get(
+            'storage_profile', CT_DEFAULT_STORAGE_PROFILE
+        )
+        if self.storage_profile not in CT_STORAGE_PROFILES:
+            raise ValueError(
+                f'Unknown storage profile: {self.storage_profile}'
+            )
+        self._encode_params = self.get_encode_params(
+            self.storage_profile,
+            png_compression=config['io'].get(
+                'png_compression', CT_DEFAULT_PNG_COMPRESSION
+            ),
+            jpeg_quality=config['io'].get(
+                'jpeg_quality', CT_DEFAULT_JPEG_QUALITY
+            )
+        )
+        # Background writer, keeps disk writes out of request threads
+        self._writer = BackgroundWriter(
+            workers=config['io'].get(
+                'writer_workers', CT_DEFAULT_WRITER_WORKERS
+            ),
+            queue_size=config['io'].get(
+                'writer_queue_size', CT_DEFAULT_WRITER_QUEUE_SIZE
+            ),
+            put_timeout=config['io'].get(
+                'writer_put_timeout', CT_DEFAULT_WRITER_PUT_TIMEOUT
+            )
+        )
+        # Durable flush of pending writes on shutdown
+        atexit.register(self.close)
+
+    def generate_local_path(self, file_name):
+        '''
+        Builds the full local path for saving the file.
+        Args:
+        - file_name (str): use file_name to generate localpath.
+        Returns:
+        - local_path (str): generated local_path to save file.
+        '''
+        local_path = os.path.join(self.save_path, file_name)
+
+        return local_path
+
+    def get_extension(self):
+        '''
+        Returns the file extension of the configured storage profile.
+        '''
+        return CT_STORAGE_PROFILES[self.storage_profile]
+
+    @staticmethod
+    def get_encode_params(
+            storage_profile,
+            png_compression=CT_DEFAULT_PNG_COMPRESSION,
+            jpeg_quality=CT_DEFAULT_JPEG_QUALITY
+    ):
+        '''
+        Returns cv2.imencode parameters for a storage profile.
+        Args:
+        - storage_profile (str): one of CT_STORAGE_PROFILES.
+        - png_compression (int): PNG compression level, 0 to 9.
+        - jpeg_quality (int): JPEG quality when the profile has to encode.
+        Returns:
+        - params (list)
+        '''
+        params = []
+        if storage_profile == 'png':
+            params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        elif storage_profile == 'webp_lossless':
+            params = [cv2.IMWRITE_WEBP_QUALITY, 101]
+        elif storage_profile == 'jpeg':
+            params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        return params
+
+    def imwrite(self, image, output_path, jpeg_bytes=None):
+        '''
+        Saves given image locally with a timestamped filename.
+        Args:
+        - image (np.array): image to be saved locally. May be None if
+          jpeg_bytes is given.
+        - output_path (str): local path to save given image.
+        - jpeg_bytes (bytes, optional): already encoded JPEG of the same
+          image, written as is with the 'jpeg' storage profile.
+        '''
+        if self.storage_profile == 'jpeg' and jpeg_bytes is not None:
+            self._write_bytes(jpeg_bytes, output_path)
+            return
+
+        if image is None and jpeg_bytes is not None:
+            image = cv2.imdecode(
+                np.frombuffer(jpeg_bytes, dtype=np.uint8),
+                cv2.IMREAD_COLOR
+            )
+        _, ext = os.path.splitext(output_path)
+        params = (
+            self._encode_params
+            if ext == self.get_extension() else []
+        )
+        enc_success, buffer = cv2.imencode(ext, image, params)
+        if not enc_success:
+            raise ValueError(f'Could not encode image: {output_path}')
+        self._write_bytes(buffer.tobytes(), output_path)
+
+    def imwrite_async(self, image, output_path, jpeg_bytes=None):
+        '''
+        Queues given image to be saved by the background writer.
+        Returns right away unless the writer queue is full.
+        Args:
+        - image (np.array): image to be saved locally. It must not be
+          modified afterwards.
+        - output_path (str): local path to save given image.
+        - jpeg_bytes (bytes, optional): see imwrite().
+        '''
+        self._writer.submit(self.imwrite, image, output_path, jpeg_bytes)
+
+    def status(self):
+        '''
+        Returns background writer status.
+        Returns:
+        - status (dict): pending, written and failed writes.
+        '''
+        return self._writer.status()
+
+    def flush(self, timeout=None):
+        '''
+        Wait for pending writes.
+        Args:
+        - timeout (float, optional): max waiting time in seconds.
+        '''
+        return self._writer.flush(timeout)
+
+    def close(self):
+        '''
+        Flush pending writes and stop background writer.
+        '''
+        self._writer.close()
+
+    def _write_bytes(self, data, output_path):
+        '''
+        Durably write data: temporary file, fsync and atomic rename.
+        Args:
+        - data (bytes): file content.
+        - output_path (str): destination path.
+        '''
+        tmp_path = f'{output_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, output_path)
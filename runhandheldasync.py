@@ -0,0 +1,41 @@
+'''
+HandheldAsgi module
+Asyncio serving mode of the Flask application with a camera integration.
+'''
+from handheld.webbackend.flask_app import FlaskAppWrapper
+from handheld.webbackend.asgiapp import HandheldAsgi, CT_DEFAULT_WSGI_THREADS
+
+if __name__ == '__main__':
+    '''
+    Creates the FlaskAppWrapper and serves it with uvicorn through
+    HandheldAsgi: video feeds are pushed by coroutines instead of one
+    thread per viewer, state endpoints run on the Flask app unchanged.
+    uvicorn is an optional dependency, only needed for this mode.
+
+    # Usage:
+    pipenv install uvicorn
+    pipenv run python -m handheld.runhandheldasync
+    '''
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit(
+            'Asyncio serving mode needs uvicorn: pipenv install uvicorn'
+        )
+
+    CT_CONFIG_FILE = 'handheld/config/config.yaml'
+
+    # Create Flask Camera application and serve it on asyncio
+    wrapper = FlaskAppWrapper('FlaskCameraApp', CT_CONFIG_FILE)
+    app = HandheldAsgi(
+        wrapper,
+        wsgi_threads=wrapper.config.get('asgi', {}).get(
+            'wsgi_threads', CT_DEFAULT_WSGI_THREADS
+        )
+    )
+    uvicorn.run(
+        app,
+        host=wrapper.config['flask']['host'],
+        port=wrapper.config['flask']['port'],
+        lifespan='on'
+    )
@@ -0,0 +1,288 @@
+'''
+    batchimport.py
+
+    Import a directory of customer standards PDFs as project criteria
+    files, '<project>_<standard>.csv' in csv.path, where
+    QualityCriteria discovers them.
+
+    Files are processed concurrently sharing one page parsing process
+    pool, each CSV is written atomically and a per-file report (time, pages,
+    rows) is printed. The whole job is bounded by --timeout: files still
+    running then are cancelled and their CSV is not written.
+
+    Mapping file (YAML), PDF file name -> project:
+        standards_wing.pdf: jec25
+        standards_door.pdf: jec26
+
+    A project loads a single criteria file, so each project may be mapped
+    to one PDF only. PDFs of a project mapped several times, or that
+    already has a criteria file of another standard, are reported as
+    errors and not imported.
+
+    # Usage:
+    pipenv run python -m handheld.utils.batchimport standards/ \
+        --mapping standards/mapping.yaml \
+        --config handheld/config/config.yaml
+'''
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait
+)
+
+from ais.infrastructure.readconfig import read_yaml_file
+from handheld.utils.qualityparser import (
+    parse_pdf,
+    write_csv,
+    CT_CACHE_DIR
+)
+
+CT_DEFAULT_JOBS = 4
+CT_DEFAULT_TIMEOUT = 600
+
+
+def get_output_path(csv_dir, project, pdf_name):
+    '''
+    Returns project criteria CSV path of a standards PDF.
+    Args:
+    - csv_dir (str): criteria directory (csv.path).
+    - project (str): project name, may not contain '_'.
+    - pdf_name (str): standards PDF file name.
+    '''
+    if not project or '_' in project:
+        raise ValueError(f'Invalid project name: {project}')
+    stem = os.path.splitext(pdf_name)[0]
+    return os.path.join(csv_dir, f'{project.lower()}_{stem}.csv')
+
+
+def get_project_conflicts(tasks, csv_dir):
+    '''
+    Returns the errors of tasks whose project would get several criteria
+    files, only the first one would be loaded.
+    Args:
+    - tasks (list): (pdf path, csv path, project) tuples.
+    - csv_dir (str): criteria directory (csv.path).
+    Returns:
+    - errors (dict): csv path -> error message.
+    '''
+    by_project = {}
+    for pdf_path, csv_path, project in tasks:
+        by_project.setdefault(project.lower(), []).append(
+            (pdf_path, csv_path)
+        )
+    try:
+        existing = os.listdir(csv_dir)
+    except FileNotFoundError:
+        existing = []
+
+    errors = {}
+    for project, project_tasks in by_project.items():
+        if len(project_tasks) > 1:
+            pdf_names = ', '.join(
+                os.path.basename(pdf_path) for pdf_path, _ in project_tasks
+            )
+            for _, csv_path in project_tasks:
+                errors[csv_path] = (
+                    f'project {project} mapped to several PDFs: {pdf_names}'
+                )
+            continue
+        csv_name = os.path.basename(project_tasks[0][1])
+        others = [
+            name for name in existing
+            if name.lower().endswith('.csv') and name != csv_name and
+            name.split('_', 1)[0].lower() == project
+        ]
+        if others:
+            errors[project_tasks[0][1]] = (
+                f'project {project} already has {", ".join(sorted(others))}'
+            )
+    return errors
+
+
+def import_standard(pdf_path, csv_path, executor, cache_dir, cancel=None):
+    '''
+    Import one standards PDF.
+    Args:
+    - pdf_path (str): standards PDF.
+    - csv_path (str): output criteria file.
+    - executor (concurrent.futures.Executor): page parsing pool.
+    - cache_dir (str): page cache directory.
+    - cancel (threading.Event, optional): stops the import once set,
+      csv_path is then left untouched.
+    Returns:
+    - result (dict): pdf, csv, rows, pages, cached pages, seconds, error.
+    '''
+    start = time.perf_counter()
+    stats = {}
+    result = {'pdf': pdf_path, 'csv': csv_path, 'rows': 0, 'error': None}
+    try:
+        rows = parse_pdf(
+            pdf_path,
+            executor=executor,
+            cache_dir=cache_dir,
+            stats=stats,
+            cancel=cancel
+        )
+        result['rows'] = write_csv(rows, csv_path, cancel=cancel)
+    except Exception as e:
+        result['error'] = str(e)
+    result['pages'] = stats.get('pages', 0)
+    result['cached_pages'] = stats.get('cached_pages', 0)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def batch_import(
+        pdf_dir,
+        mapping,
+        csv_dir,
+        jobs=CT_DEFAULT_JOBS,
+        workers=None,
+        cache_dir=CT_CACHE_DIR,
+        timeout=CT_DEFAULT_TIMEOUT
+):
+    '''
+    Import every mapped standards PDF of a directory concurrently.
+    Args:
+    - pdf_dir (str): directory with standards PDFs.
+    - mapping (dict): PDF file name -> project name.
+    - csv_dir (str): criteria directory (csv.path).
+    - jobs (int): files processed at the same time.
+    - workers (int, optional): page parsing processes, CPU count if None.
+    - cache_dir (str, optional): page cache directory.
+    - timeout (float): max seconds for the whole batch.
+    Returns:
+    - results (list): one result dict per PDF, see import_standard().
+    '''
+    tasks = []
+    for pdf_name in sorted(os.listdir(pdf_dir)):
+        if not pdf_name.lower().endswith('.pdf'):
+            continue
+        project = mapping.get(pdf_name)
+        if project is None:
+            print(f'{pdf_name}: no project mapping, skipped.')
+            continue
+        tasks.append((
+            os.path.join(pdf_dir, pdf_name),
+            get_output_path(csv_dir, str(project), pdf_name),
+            str(project)
+        ))
+
+    results = []
+    conflicts = get_project_conflicts(tasks, csv_dir)
+    for pdf_path, csv_path, _ in tasks:
+        if csv_path in conflicts:
+            results.append({
+                'pdf': pdf_path,
+                'csv': csv_path,
+                'error': conflicts[csv_path],
+                'rows': 0,
+                'pages': 0,
+                'cached_pages': 0,
+                'seconds': 0.0
+            })
+    tasks = [task for task in tasks if task[1] not in conflicts]
+    cancel = threading.Event()
+    process_pool = ProcessPoolExecutor(max_workers=workers)
+    thread_pool = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        futures = {
+            thread_pool.submit(
+                import_standard,
+                pdf_path,
+                csv_path,
+                process_pool,
+                cache_dir,
+                cancel
+            ): (pdf_path, csv_path)
+            for pdf_path, csv_path, _ in tasks
+        }
+        done, not_done = wait(futures, timeout=timeout)
+    finally:
+        # Stop files still running, then wait for them so nothing is
+        # written after the batch returns. Running page chunks finish,
+        # queued ones are cancelled.
+        cancel.set()
+        thread_pool.shutdown(wait=True, cancel_futures=True)
+        process_pool.shutdown(wait=True, cancel_futures=True)
+
+    for future in done:
+        results.append(future.result())
+    for future in not_done:
+        if future.done() and not future.cancelled():
+            result = future.result()
+            if result['error'] is None:
+                # Renamed just before the cancel was seen
+                results.append(result)
+                continue
+        pdf_path, csv_path = futures[future]
+        results.append({
+            'pdf': pdf_path,
+            'csv': csv_path,
+            'error': f'timeout after {timeout} s',
+            'rows': 0,
+            'pages': 0,
+            'cached_pages': 0,
+            'seconds': timeout
+        })
+
+    return sorted(results, key=lambda result: result['pdf'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Import standards PDFs as project criteria files.'
+    )
+    parser.add_argument('pdf_dir', help='Directory with standards PDFs.')
+    parser.add_argument(
+        '--mapping',
+        required=True,
+        help='YAML file, PDF file name -> project name.'
+    )
+    parser.add_argument('--config', default='handheld/config/config.yaml')
+    parser.add_argument('-j', '--jobs', type=int, default=CT_DEFAULT_JOBS)
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('--cache-dir', default=CT_CACHE_DIR)
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=CT_DEFAULT_TIMEOUT,
+        help='Max seconds for the whole batch.'
+    )
+    args = parser.parse_args()
+
+    csv_dir = read_yaml_file(args.config)['csv']['path']
+    mapping = read_yaml_file(args.mapping)
+
+    start = time.perf_counter()
+    results = batch_import(
+        args.pdf_dir,
+        mapping,
+        csv_dir,
+        jobs=args.jobs,
+        workers=args.workers,
+        cache_dir=args.cache_dir,
+        timeout=args.timeout
+    )
+
+    print(f'{"pdf":<32}{"rows":>8}{"pages":>8}{"cached":>8}{"s":>8}  status')
+    for result in results:
+        status = result['error'] or os.path.basename(result['csv'])
+        print(
+            f'{os.path.basename(result["pdf"]):<32}'
+            f'{result["rows"]:>8}{result["pages"]:>8}'
+            f'{result["cached_pages"]:>8}{result["seconds"]:>8.1f}  {status}'
+        )
+    failed = sum(1 for result in results if result['error'])
+    print(
+        f'{len(results)} files, {failed} failed, '
+        f'{time.perf_counter() - start:.1f} s'
+    )
+
+
+if __name__ == '__main__':
+    main()
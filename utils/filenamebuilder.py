@@ -21,13 +21,18 @@ def generate_defect_name(raw_defect_type, separator='-'):
     return separator.join(words)
 
 
-def generate_image_file_name(timestamp, defect_type):
+def generate_image_file_name(
+        timestamp,
+        defect_type,
+        extension=CT_LOCAL_OUTPUT_FILE_NAME_EXTENSION
+):
     '''
     Generates an image file name based on current timestamp
     and defect type.
     Args:
     - timestamp (str): current image's timestamp.
     - defect_type (str): clean defect name.
+    - extension (str): file extension, depends on storage profile.
     Returns:
     - file_name (str): filename for the image to be saved.
     '''
@@ -35,6 +40,6 @@ def generate_image_file_name(timestamp, defect_type):
         f'{CT_LOCAL_OUTPUT_FILE_NAME_BASE}'
         f'_{defect_type}'
         f'_{timestamp}'
-        f'{CT_LOCAL_OUTPUT_FILE_NAME_EXTENSION}'
+        f'{extension}'
     )
     return file_name
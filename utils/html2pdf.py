@@ -5,27 +5,43 @@
 
     NOTE: chrome REQUIRED. The html report should be in 'jec25/UI/reports/'
     path to ensure all modules, images and styles are imported correctly.
+
+    Each call starts a new browser, see utils/renderpool for a pool of warm
+    renderers.
 '''
 import subprocess
 
+CT_CHROME_PATH = 'google-chrome'
+CT_DEFAULT_RENDER_TIMEOUT = 60
+
 
-def html2pdf(htmlpath, pdfpath):
+def get_chrome_command(htmlpath, pdfpath, chrome_path=CT_CHROME_PATH):
     '''
-    Generate pdf from HTML file.
+    Returns headless chrome command printing an HTML file to PDF.
     Args:
     - htmlpath, pdfpath (str)
+    - chrome_path (str, optional): chrome executable.
     '''
-
-    command = [
-        'google-chrome',
+    return [
+        chrome_path,
         '--headless',
         '--disable-gpu',
-        f'--print-to-pdf={pdfpath}.pdf',
+        f'--print-to-pdf={pdfpath}',
         '--no-margins',
         htmlpath
     ]
 
+
+def html2pdf(htmlpath, pdfpath, timeout=CT_DEFAULT_RENDER_TIMEOUT):
+    '''
+    Generate pdf from HTML file.
+    Args:
+    - htmlpath, pdfpath (str)
+    - timeout (float, optional): max seconds, chrome is killed after it.
+    '''
+    command = get_chrome_command(htmlpath, f'{pdfpath}.pdf')
+
     try:
-        subprocess.run(command, check=True)
+        subprocess.run(command, check=True, timeout=timeout)
     except Exception as e:
         print(f'Chrome Subprocess error: {e}')
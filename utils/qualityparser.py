@@ -2,7 +2,6 @@
     qualityparser.py
 
     Extract costumer quality criteria info from pdf's tables and save in csv.
-    ~Adhoc module.
 
     Expected PDF layout:
 
@@ -29,89 +28,389 @@
     --------------------------------------------------
     Chip    |  A                |  Painted |  Not acceptable
 
+    Pages are parsed across a process pool, tables are extracted once per
+    page and rows are streamed to the output in page order. Parsed pages
+    are cached by page content hash, so re-importing a revised standard
+    only parses changed pages.
+
+    # Usage:
+    pipenv run python -m handheld.utils.qualityparser standards.pdf \
+        -o costumer_quality_criteria.csv
 '''
-import fitz  # requires pymupdf installation
-import re
+import argparse
 import csv
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import (
+    CancelledError,
+    ProcessPoolExecutor,
+    TimeoutError as FutureTimeoutError
+)
+
+import fitz  # requires pymupdf installation
+
+CT_SKIP_PAGES = 1
+CT_CSV_NAME = 'costumer_quality_criteria.csv'
+CT_CSV_COLUMNS = ['Defect', 'Surface Quality', 'Finish', 'Criteria']
+CT_CACHE_DIR = '.qualityparser_cache'
+CT_PAGES_PER_TASK = 4
+# Seconds between cancel checks while waiting for parsed pages
+CT_CANCEL_POLL_INTERVAL = 0.5
+# Bump when parsing rules change, invalidates cached pages
+CT_PARSER_VERSION = '1'
+
+# Find defect name on page
+# Pattern:
+# '4\.\d+' →  4. follow by one or more digits.
+# '\s+' →  One or more blank spaces.
+# '[A-Z]' →  Any letter from A to Z.
+# '[^\n]' →  Zero or more characters that are not new line.
+CT_TITLE_PATTERN = re.compile(r'(4\.\d+\s+[A-Z][^\n]*)')
+# Remove characters from defect name
+# Pattern:
+# '^\d+\.\d+' →  From start of the line, digit(s) + . + digit(s)
+# '\s*' →  Zero or more blank spaces.
+CT_TITLE_NUMBER_PATTERN = re.compile(r'^\d+\.\d+\s*')
+
+
+def parse_table(table):
+    '''
+    Clean extracted table rows.
+    Args:
+    - table (list): rows extracted from the PDF table.
+    Returns:
+    - table (list): rows without empty cells and with single line cells.
+    '''
+    # Remove rows that have empty or 'None' cells
+    table = [
+        row
+        for row in table
+        if all(cell not in ('', None) for cell in row)
+    ]
+    # Replace '\n' for ' ' in cells
+    table = [
+        [
+            cell.replace('\n', ' ').strip('"') if isinstance(cell, str)
+            else cell
+            for cell in row
+        ]
+        for row in table
+    ]
+    return table
+
+
+def table_rows(title, table):
+    '''
+    Build CSV rows of a defect from its criteria table.
+    Args:
+    - title (str): defect name.
+    - table (list): cleaned table rows, first row is the header.
+    Returns:
+    - rows (list): [defect, surface quality, finish, criteria] rows.
+    '''
+    rows = []
+    if not table:
+        return rows
+
+    # Get info from table
+    headers = table[0]
+    num_columns = len(headers)
+
+    for row in table[1:]:
+
+        surface_quality = row[0]
+        if surface_quality == 'All':
+            surface_quality_list = ['A', 'B', 'C']
+        else:
+            surface_quality_list = [surface_quality]
+
+        if num_columns == 2:
+            painted_criteria = visual_criteria = row[1]
+
+        if num_columns == 3:
+            painted_criteria = row[1]
+            visual_criteria = row[2]
+
+        for surface_quality in surface_quality_list:
+            rows.append(
+                [title, surface_quality, 'Painted', painted_criteria]
+            )
+            rows.append(
+                [title, surface_quality, 'Visual', visual_criteria]
+            )
+    return rows
+
+
+def parse_page(page):
+    '''
+    Extract criteria rows of one page. Tables are computed once per page,
+    only if the page has a defect title.
+    Args:
+    - page (fitz.Page)
+    Returns:
+    - rows (list): [defect, surface quality, finish, criteria] rows.
+    '''
+    # Get all text from page
+    page_text = page.get_text()
+    titles = [
+        CT_TITLE_NUMBER_PATTERN.sub('', match.group(0)).strip()
+        for match in CT_TITLE_PATTERN.finditer(page_text)
+    ]
+    if not titles:
+        return []
+
+    # TABLES
+    page_tables = page.find_tables()  # Find all tables on page
+    if len(page_tables.tables) < 2:
+        print(f'Page {page.number}: criteria table not found, skipped.')
+        return []
+    table = parse_table(page_tables.tables[1].extract())  # 2nd table
+
+    rows = []
+    for title in titles:
+        rows.extend(table_rows(title, table))
+    return rows
+
+
+def page_key(page):
+    '''
+    Content hash of a page, cache key of its parsed rows.
+    Args:
+    - page (fitz.Page)
+    '''
+    digest = hashlib.sha256(CT_PARSER_VERSION.encode())
+    digest.update(repr(tuple(page.rect)).encode())
+    digest.update(page.read_contents())
+    return digest.hexdigest()
+
+
+def _parse_pages(pdf_path, page_numbers):
+    '''
+    Process pool task: parse some pages of a PDF.
+    Args:
+    - pdf_path (str)
+    - page_numbers (list): 0-based page numbers.
+    Returns:
+    - results (list): rows of each page, in page_numbers order.
+    '''
+    with fitz.open(pdf_path) as doc:
+        return [parse_page(doc[number]) for number in page_numbers]
+
+
+class PageCache:
+    '''
+    On-disk cache of parsed page rows, keyed by page content hash.
+    '''
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        ''' Returns cached rows of a page, None if missing. '''
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, rows):
+        ''' Store rows of a page. '''
+        if not self.cache_dir:
+            return
+        # Unique per writer, identical pages of concurrent imports share
+        # the key
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.cache_dir,
+            prefix=f'{key}.',
+            suffix='.tmp'
+        )
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump(rows, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+
+def parse_pdf(
+        pdf_path,
+        executor=None,
+        cache_dir=CT_CACHE_DIR,
+        skip_pages=CT_SKIP_PAGES,
+        stats=None,
+        cancel=None
+):
+    '''
+    Generate criteria rows of a standards PDF, in page order.
+    Cached pages are served from cache_dir, the others are parsed by the
+    executor in chunks of pages.
+    Args:
+    - pdf_path (str): standards PDF.
+    - executor (concurrent.futures.Executor, optional): pool running page
+      parsing, a process pool is created if not given.
+    - cache_dir (str, optional): page cache directory, None disables it.
+    - skip_pages (int): leading pages without criteria.
+    - stats (dict, optional): filled with 'pages', 'cached_pages' and
+      'rows' counters.
+    - cancel (threading.Event, optional): stops parsing once set.
+    Raises:
+    - CancelledError: cancel was set, pending chunks are cancelled.
+    '''
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor()
+    cache = PageCache(cache_dir)
+    if stats is None:
+        stats = {}
+    stats.update({'pages': 0, 'cached_pages': 0, 'rows': 0})
+
+    futures = {}
+    try:
+        with fitz.open(pdf_path) as doc:
+            keys = {
+                number: page_key(doc[number])
+                for number in range(skip_pages, doc.page_count)
+            }
+
+        cached = {}
+        missing = []
+        for number, key in keys.items():
+            rows = cache.get(key)
+            if rows is None:
+                missing.append(number)
+            else:
+                cached[number] = rows
+
+        # Chunks of missing pages, submitted all at once
+        for start in range(0, len(missing), CT_PAGES_PER_TASK):
+            chunk = missing[start:start + CT_PAGES_PER_TASK]
+            future = executor.submit(_parse_pages, pdf_path, chunk)
+            for position, number in enumerate(chunk):
+                futures[number] = (future, position)
+
+        for number, key in keys.items():
+            _check_cancel(cancel, pdf_path)
+            stats['pages'] += 1
+            if number in cached:
+                stats['cached_pages'] += 1
+                rows = cached.pop(number)
+            else:
+                future, position = futures.pop(number)
+                rows = _get_result(future, cancel, pdf_path)[position]
+                cache.put(key, rows)
+            stats['rows'] += len(rows)
+            yield from rows
+    finally:
+        # Chunks left behind by a cancel or an error
+        for future, _ in futures.values():
+            future.cancel()
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+
+def _check_cancel(cancel, path):
+    ''' Raise CancelledError if cancel is set. '''
+    if cancel is not None and cancel.is_set():
+        raise CancelledError(f'{path}: import cancelled')
+
+
+def _get_result(future, cancel, pdf_path):
+    '''
+    Returns the result of a parsing chunk, waiting for it in steps so a
+    cancel is seen while the chunk runs.
+    '''
+    if cancel is None:
+        return future.result()
+    while True:
+        _check_cancel(cancel, pdf_path)
+        try:
+            return future.result(timeout=CT_CANCEL_POLL_INTERVAL)
+        except FutureTimeoutError:
+            continue
+
+
+def write_csv(rows, csv_path, cancel=None):
+    '''
+    Stream rows to a CSV file, written atomically.
+    Args:
+    - rows (iterable): [defect, surface quality, finish, criteria] rows.
+    - csv_path (str): output file.
+    - cancel (threading.Event, optional): the file is not written if it
+      is set before the rename.
+    Returns:
+    - n_rows (int): rows written.
+    Raises:
+    - CancelledError: cancel was set, csv_path is left untouched.
+    '''
+    n_rows = 0
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(csv_path) or '.',
+        prefix=f'{os.path.basename(csv_path)}.',
+        suffix='.tmp'
+    )
+    try:
+        # mkstemp files are private, criteria files are shared
+        os.chmod(tmp_path, 0o644)
+        with open(fd, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(CT_CSV_COLUMNS)
+            for row in rows:
+                writer.writerow(row)
+                n_rows += 1
+        _check_cancel(cancel, csv_path)
+        os.replace(tmp_path, csv_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Extract quality criteria tables from a standards PDF.'
+    )
+    parser.add_argument('pdf', help='Standards PDF file.')
+    parser.add_argument('-o', '--output', default=CT_CSV_NAME)
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=None,
+        help='Parsing processes, CPU count if not given.'
+    )
+    parser.add_argument('--cache-dir', default=CT_CACHE_DIR)
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--skip-pages', type=int, default=CT_SKIP_PAGES)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        rows = parse_pdf(
+            args.pdf,
+            executor=executor,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            skip_pages=args.skip_pages,
+            stats=stats
+        )
+        n_rows = write_csv(rows, args.output)
+    elapsed = time.perf_counter() - start
+    print(
+        f'{args.pdf} -> {args.output}: {n_rows} rows, '
+        f'{stats["pages"]} pages ({stats["cached_pages"]} cached), '
+        f'{elapsed:.1f} s'
+    )
 
 
-file_path = 'standards.pdf'
-skip_pages = 1
-csv_name = 'costumer_quality_criteria.csv'
-csv_columns = ['Defect', 'Surface Quality', 'Finish', 'Criteria']
-
-rows = []
-with fitz.open(file_path) as doc:
-    for i, page in enumerate(doc[skip_pages:], start=skip_pages):
-
-        # Get all text from page
-        page_text = page.get_text()
-
-        # Find defect name on page
-        # Pattern:
-        # '4\.\d+' →  4. follow by one or more digits.
-        # '\s+' →  One or more blank spaces.
-        # '[A-Z]' →  Any letter from A to Z.
-        # '[^\n]' →  Zero or more characters that are not new line.
-        title_matches = re.finditer(r'(4\.\d+\s+[A-Z][^\n]*)', page_text)
-
-        for idx, match in enumerate(title_matches):
-            title = match.group(0)
-            # Remove characters from defect name
-            # Pattern:
-            # '^\d+\.\d+' →  From start of the line, digit(s) + . + digit(s)
-            # '\s*' →  Zero or more blank spaces.
-            # strip() →  Remove blank spaces at the beginning and end.
-            title = re.sub(r'^\d+\.\d+\s*', '', title).strip()
-
-            # TABLES
-            page_tables = page.find_tables()  # Find all tables on page
-            table = page_tables.tables[1].extract()  # Get second table
-            # Remove rows that have empty or 'None' cells
-            table = [
-                row
-                for row in table
-                if all(cell not in ('', None) for cell in row)
-            ]
-            # Replace '\n' for ' ' in cells
-            table = [
-                [
-                    cell.replace('\n', ' ').strip('"') if isinstance(cell, str)
-                    else cell
-                    for cell in row
-                ]
-                for row in table
-            ]
-
-            # Get info from table
-            headers = table[0]
-            num_columns = len(headers)
-
-            for row in table[1:]:
-
-                surface_quality = row[0]
-                if surface_quality == 'All':
-                    surface_quality_list = ['A', 'B', 'C']
-                else:
-                    surface_quality_list = [surface_quality]
-
-                if num_columns == 2:
-                    painted_criteria = visual_criteria = row[1]
-
-                if num_columns == 3:
-                    painted_criteria = row[1]
-                    visual_criteria = row[2]
-
-                for surface_quality in surface_quality_list:
-                    rows.append(
-                        [title, surface_quality, 'Painted', painted_criteria]
-                    )
-                    rows.append(
-                        [title, surface_quality, 'Visual', visual_criteria]
-                    )
-
-# Write table info to csv
-with open(csv_name, 'w', newline='', encoding='utf-8') as f:
-    writer = csv.writer(f)
-    writer.writerow(csv_columns)
-    writer.writerows(rows)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,528 @@
+'''
+    renderpool.py module
+
+    Render HTML reports to PDF on a pool of warm renderer workers.
+
+    Each worker owns a backend, a long-lived renderer that is started once
+    and reused across jobs:
+    - ChromeCdpBackend: headless chrome driven through the DevTools
+      protocol over '--remote-debugging-pipe' (fds 3 and 4), one tab per
+      job printed with Page.printToPDF.
+    - SubprocessBackend: one chrome process per job, as utils/html2pdf.
+    - FakeBackend: writes a stub PDF, for tests and machines without chrome.
+
+    Jobs run concurrently up to the number of workers, each bounded by a
+    timeout. Workers whose renderer crashed, timed out or served max_jobs
+    are closed and replaced by a fresh one on the next job. Errors are
+    counted in status().
+'''
+import abc
+import base64
+import json
+import os
+import queue
+import select
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urljoin
+from urllib.request import pathname2url
+
+from handheld.utils.html2pdf import (
+    get_chrome_command,
+    CT_CHROME_PATH,
+    CT_DEFAULT_RENDER_TIMEOUT
+)
+
+CT_DEFAULT_RENDER_BACKEND = 'chrome_cdp'
+CT_DEFAULT_RENDER_WORKERS = 2
+CT_DEFAULT_RENDER_MAX_JOBS = 200
+CT_STARTUP_TIMEOUT = 20
+CT_CHROME_ARGS = [
+    '--headless',
+    '--disable-gpu',
+    '--no-first-run',
+    '--no-default-browser-check',
+    '--disable-extensions',
+    '--remote-debugging-pipe'
+]
+# Run in the child: move fds given as argv[1:3] to 3 and 4, exec argv[3:]
+CT_FD_LAUNCHER = '''
+import fcntl, os, sys
+fds = [int(fd) for fd in sys.argv[1:3]]
+# Above fd 4 first, so the moves never overwrite each other
+high_fds = [fcntl.fcntl(fd, fcntl.F_DUPFD, 10) for fd in fds]
+for fd in fds:
+    os.close(fd)
+for target, fd in zip((3, 4), high_fds):
+    os.dup2(fd, target)
+    os.close(fd)
+os.execvp(sys.argv[3], sys.argv[3:])
+'''
+CT_PDF_OPTIONS = {
+    'printBackground': True,
+    'preferCSSPageSize': True,
+    'displayHeaderFooter': False,
+    'marginTop': 0,
+    'marginBottom': 0,
+    'marginLeft': 0,
+    'marginRight': 0
+}
+CT_FAKE_PDF = b'%PDF-1.4\n%fake render\n%%EOF\n'
+CT_PROFILE_PREFIX = 'renderpool-chrome-'
+
+
+class RenderBackend(abc.ABC):
+    '''
+    Renderer worker interface.
+    '''
+    def start(self):
+        ''' Start renderer, called once before the first job. '''
+
+    @abc.abstractmethod
+    def render(self, html_path, pdf_path, timeout):
+        '''
+        Render an HTML file to PDF.
+        Args:
+        - html_path, pdf_path (str)
+        - timeout (float): max seconds, raises TimeoutError after it.
+        '''
+
+    def alive(self):
+        ''' Returns False if the renderer died and must be replaced. '''
+        return True
+
+    def close(self):
+        ''' Stop renderer. '''
+
+
+class FakeBackend(RenderBackend):
+    '''
+    Writes a stub PDF without rendering.
+    '''
+    def __init__(self, delay=0.0, fail=False):
+        '''
+        Args:
+        - delay (float): seconds each render takes.
+        - fail (bool): raise on every render.
+        '''
+        self.delay = delay
+        self.fail = fail
+
+    def render(self, html_path, pdf_path, timeout):
+        if self.delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f'Fake render timed out: {html_path}')
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f'Fake render failed: {html_path}')
+        with open(pdf_path, 'wb') as f:
+            f.write(CT_FAKE_PDF)
+
+
+class SubprocessBackend(RenderBackend):
+    '''
+    Starts a headless chrome per job, no warm state.
+    '''
+    def __init__(self, chrome_path=CT_CHROME_PATH):
+        self.chrome_path = chrome_path
+
+    def render(self, html_path, pdf_path, timeout):
+        command = get_chrome_command(html_path, pdf_path, self.chrome_path)
+        try:
+            subprocess.run(
+                command,
+                check=True,
+                timeout=timeout,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        except subprocess.TimeoutExpired:
+            raise TimeoutError(f'Chrome timed out: {html_path}')
+
+
+class ChromeCdpBackend(RenderBackend):
+    '''
+    Persistent headless chrome controlled over its DevTools pipe.
+    Chrome reads commands from fd 3 and writes replies to fd 4, as
+    null-terminated JSON messages. Every renderer has its own temporary
+    profile directory, removed on close, so workers never share or
+    inherit browser state.
+    '''
+    def __init__(self, chrome_path=CT_CHROME_PATH):
+        self.chrome_path = chrome_path
+        self._profile_dir = None
+        self._process = None
+        self._writer = None
+        self._reader = None
+        self._buffer = b''
+        self._events = []
+        self._next_id = 0
+
+    def start(self):
+        self._profile_dir = tempfile.mkdtemp(prefix=CT_PROFILE_PREFIX)
+        cmd_read, self._writer = os.pipe()
+        self._reader, reply_write = os.pipe()
+        try:
+            # Launcher maps the pipe ends to fds 3 and 4 and execs chrome
+            self._process = subprocess.Popen(
+                [
+                    sys.executable,
+                    '-c',
+                    CT_FD_LAUNCHER,
+                    str(cmd_read),
+                    str(reply_write),
+                    self.chrome_path,
+                    *CT_CHROME_ARGS,
+                    f'--user-data-dir={self._profile_dir}'
+                ],
+                pass_fds=(cmd_read, reply_write),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        finally:
+            os.close(cmd_read)
+            os.close(reply_write)
+        self._call(
+            'Browser.getVersion',
+            deadline=time.monotonic() + CT_STARTUP_TIMEOUT
+        )
+
+    def render(self, html_path, pdf_path, timeout):
+        deadline = time.monotonic() + timeout
+        self._events = []
+        target = self._call(
+            'Target.createTarget',
+            {'url': 'about:blank'},
+            deadline=deadline
+        )['targetId']
+        try:
+            session = self._call(
+                'Target.attachToTarget',
+                {'targetId': target, 'flatten': True},
+                deadline=deadline
+            )['sessionId']
+            self._call('Page.enable', session=session, deadline=deadline)
+            url = urljoin('file:', pathname2url(os.path.abspath(html_path)))
+            self._call(
+                'Page.navigate',
+                {'url': url},
+                session=session,
+                deadline=deadline
+            )
+            self._wait_event('Page.loadEventFired', session, deadline)
+            result = self._call(
+                'Page.printToPDF',
+                CT_PDF_OPTIONS,
+                session=session,
+                deadline=deadline
+            )
+        finally:
+            if self.alive():
+                self._send('Target.closeTarget', {'targetId': target})
+
+        with open(pdf_path, 'wb') as f:
+            f.write(base64.b64decode(result['data']))
+
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def close(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+        for fd in (self._writer, self._reader):
+            if fd is not None:
+                os.close(fd)
+        self._writer = self._reader = None
+        if self._profile_dir is not None:
+            shutil.rmtree(self._profile_dir, ignore_errors=True)
+            self._profile_dir = None
+
+    def _send(self, method, params=None, session=None):
+        ''' Send a command, returns its message id. '''
+        self._next_id += 1
+        message = {'id': self._next_id, 'method': method}
+        if params:
+            message['params'] = params
+        if session:
+            message['sessionId'] = session
+        data = json.dumps(message).encode('utf-8') + b'\0'
+        while data:
+            data = data[os.write(self._writer, data):]
+        return self._next_id
+
+    def _call(self, method, params=None, session=None, deadline=None):
+        ''' Send a command and wait for its result. '''
+        message_id = self._send(method, params, session)
+        while True:
+            message = self._receive(deadline)
+            if message.get('id') == message_id:
+                if 'error' in message:
+                    raise RuntimeError(f'{method}: {message["error"]}')
+                return message.get('result', {})
+            if 'method' in message:
+                self._events.append(message)
+
+    def _wait_event(self, method, session, deadline):
+        ''' Wait for an event of a session. '''
+        while True:
+            for event in self._events:
+                if event['method'] == method and \
+                        event.get('sessionId') == session:
+                    self._events.remove(event)
+                    return event
+            message = self._receive(deadline)
+            if 'method' in message:
+                self._events.append(message)
+
+    def _receive(self, deadline):
+        ''' Read next message from chrome. '''
+        while b'\0' not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('Chrome did not reply in time.')
+            ready, _, _ = select.select([self._reader], [], [], remaining)
+            if not ready:
+                continue
+            data = os.read(self._reader, 1 << 20)
+            if not data:
+                raise RuntimeError('Chrome closed the DevTools pipe.')
+            self._buffer += data
+        message, self._buffer = self._buffer.split(b'\0', 1)
+        return json.loads(message)
+
+
+CT_RENDER_BACKENDS = {
+    'chrome_cdp': ChromeCdpBackend,
+    'subprocess': SubprocessBackend,
+    'fake': FakeBackend
+}
+
+
+class RenderPool:
+    '''
+    Pool of renderer workers behind a job queue.
+    Jobs beyond the number of workers wait in the executor queue. Idle
+    renderers are reused most recently used first, so warm ones serve
+    the jobs.
+    '''
+    def __init__(
+            self,
+            backend_factory,
+            workers=CT_DEFAULT_RENDER_WORKERS,
+            timeout=CT_DEFAULT_RENDER_TIMEOUT,
+            max_jobs=CT_DEFAULT_RENDER_MAX_JOBS
+    ):
+        '''
+        Args:
+        - backend_factory (callable): returns a new RenderBackend.
+        - workers (int): max concurrent renders.
+        - timeout (float): default per-job timeout in seconds.
+        - max_jobs (int): jobs served before a renderer is recycled.
+        '''
+        self._backend_factory = backend_factory
+        self.workers = workers
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='RenderPool'
+        )
+        # One slot per worker: [backend or None, jobs served]
+        self._idle = queue.LifoQueue()
+        for _ in range(workers):
+            self._idle.put([None, 0])
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._rendered = 0
+        self._failed = 0
+        self._recycled = 0
+        self._start_errors = 0
+        self._close_errors = 0
+        self._last_error = None
+
+    def warmup(self):
+        '''
+        Start every renderer in the background, so first jobs do not pay
+        the startup.
+        '''
+        # Take the idle slots first, a warmup failing fast gives its slot
+        # back before the loop ends
+        slots = []
+        while True:
+            try:
+                slots.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for slot in slots:
+            self._executor.submit(self._warm, slot)
+
+    def submit(self, html_path, pdf_path, timeout=None):
+        '''
+        Queue a render job.
+        Args:
+        - html_path, pdf_path (str)
+        - timeout (float, optional): max render seconds, pool default if
+          not given. Time waiting in the queue is not counted.
+        Returns:
+        - future (concurrent.futures.Future): resolves to pdf_path.
+        '''
+        timeout = timeout or self.timeout
+        with self._lock:
+            self._queued += 1
+        return self._executor.submit(
+            self._run,
+            self._render,
+            html_path,
+            pdf_path,
+            timeout
+        )
+
+    def render(self, html_path, pdf_path, timeout=None):
+        ''' Render synchronously, see submit(). '''
+        return self.submit(html_path, pdf_path, timeout).result()
+
+    def status(self):
+        '''
+        Returns pool status.
+        Returns:
+        - status (dict): queued, running, rendered, failed and recycled
+          jobs, renderer start and close errors, last error.
+        '''
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': self._queued,
+                'running': self._running,
+                'rendered': self._rendered,
+                'failed': self._failed,
+                'recycled': self._recycled,
+                'start_errors': self._start_errors,
+                'close_errors': self._close_errors,
+                'last_error': self._last_error
+            }
+
+    def close(self):
+        ''' Wait for running jobs and stop every renderer. '''
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        while not self._idle.empty():
+            backend, _ = self._idle.get_nowait()
+            if backend is not None:
+                backend.close()
+
+    def _run(self, job, *args):
+        ''' Run a job holding an idle renderer slot. '''
+        slot = self._idle.get()
+        try:
+            return job(slot, *args)
+        finally:
+            self._idle.put(slot)
+
+    def _warm(self, slot):
+        ''' Warmup job, start the renderer of a slot. '''
+        try:
+            self._start_slot(slot)
+        except Exception:
+            # Counted by _start_slot, the next job retries
+            pass
+        finally:
+            self._idle.put(slot)
+
+    def _start_slot(self, slot):
+        ''' Ensure the slot has a live renderer. '''
+        backend, _ = slot
+        if backend is not None and backend.alive():
+            return backend
+        if backend is not None:
+            self._recycle(slot)
+        backend = self._backend_factory()
+        try:
+            backend.start()
+        except Exception as e:
+            with self._lock:
+                self._start_errors += 1
+                self._last_error = f'Renderer start: {e}'
+            backend.close()
+            raise
+        slot[:] = [backend, 0]
+        return backend
+
+    def _recycle(self, slot):
+        ''' Close the renderer of a slot. '''
+        backend, _ = slot
+        slot[:] = [None, 0]
+        try:
+            backend.close()
+        except Exception as e:
+            with self._lock:
+                self._close_errors += 1
+                self._last_error = f'Renderer close: {e}'
+        with self._lock:
+            self._recycled += 1
+
+    def _render(self, slot, html_path, pdf_path, timeout):
+        ''' Render job. '''
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            backend = self._start_slot(slot)
+            slot[1] += 1
+            backend.render(html_path, pdf_path, timeout)
+        except Exception as e:
+            if slot[0] is not None:
+                # Crashed or timed out, state unknown
+                self._recycle(slot)
+            with self._lock:
+                self._failed += 1
+                self._last_error = str(e)
+            raise
+        else:
+            with self._lock:
+                self._rendered += 1
+            if slot[1] >= self.max_jobs:
+                self._recycle(slot)
+            return pdf_path
+        finally:
+            with self._lock:
+                self._running -= 1
+
+
+def create_render_pool(config):
+    '''
+    Create a render pool from the 'report' section of the app config.
+    Args:
+    - config (dict): app config.
+    Returns:
+    - pool (RenderPool)
+    '''
+    report_config = config.get('report', {})
+    backend = report_config.get('render_backend', CT_DEFAULT_RENDER_BACKEND)
+    backend_class = CT_RENDER_BACKENDS.get(backend)
+    if backend_class is None:
+        raise ValueError(f'Unknown render backend: {backend}')
+    if backend_class is FakeBackend:
+        backend_factory = FakeBackend
+    else:
+        backend_factory = partial(
+            backend_class,
+            report_config.get('chrome_path', CT_CHROME_PATH)
+        )
+    return RenderPool(
+        backend_factory,
+        workers=report_config.get('render_workers', CT_DEFAULT_RENDER_WORKERS),
+        timeout=report_config.get('render_timeout', CT_DEFAULT_RENDER_TIMEOUT),
+        max_jobs=report_config.get(
+            'render_max_jobs',
+            CT_DEFAULT_RENDER_MAX_JOBS
+        )
+    )
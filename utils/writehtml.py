@@ -6,8 +6,24 @@
     NOTE: it is essential to save report.html in the path
     'jec25/UI/report/report.html' to ensure all modules, images, and styles are
     imported correctly.
+
+    Templates are parsed once and kept compiled: the template <div> plus a
+    map from each 'fill-*' slot to the child index paths of its elements.
+    Pages are cloned from the compiled template and filled through the map,
+    so filling a page costs O(slots) instead of a tree search per key.
+
+    Pages are serialized to a temporary spool file as they are added and
+    streamed into the report on save, so memory does not grow with the
+    number of pages. Output is compact by default, new_html(pretty=True)
+    indents the document.
 '''
-from bs4 import BeautifulSoup
+import copy
+import os
+import re
+import tempfile
+import threading
+
+from bs4 import BeautifulSoup, Comment, Tag
 
 CT_DEFAULT_HTML = '''
 <!DOCTYPE html>
@@ -25,9 +41,19 @@ CT_DEFAULT_HTML = '''
 </body>
 </html>
 '''
+CT_FILL_PREFIX = 'fill-'
+# Placeholder comment of spooled pages in the document shell
+CT_PAGES_MARKER = 'writehtml-pages-'
+CT_PAGES_MARKER_PATTERN = re.compile(rf'<!--{CT_PAGES_MARKER}(\d+)-->')
+CT_COPY_CHUNK = 1024 * 1024
 
 
 class WriteHtml():
+    # Compiled templates shared by every report:
+    # (path, template_class) -> (stat, template div, slots)
+    _templates = {}
+    _templates_lock = threading.Lock()
+
     def __init__(self,):
         """
         A class for generating HTML reports.
@@ -53,14 +79,17 @@ class WriteHtml():
         WH.save_html('jec25/UI/reports/report.html')
         ```
         """
-        pass
+        # Pages from get_template() not added yet:
+        # id(page) -> (page, slots)
+        self._page_slots = {}
 
-    def new_html(self, title, index_path=None):
+    def new_html(self, title, index_path=None, pretty=False):
         '''
         Create new HTML file.
         Args:
         - title (str): document title.
         - index_path (str, optional): path to base html file.
+        - pretty (bool): indent the document, compact if False.
         '''
         if index_path:
             html_file = self._open_html(index_path)
@@ -69,33 +98,66 @@ class WriteHtml():
 
         self._html = self._parse_html(html_file)
         self._set_title(self._html, title)
+        self.close()
+        self._pretty = pretty
+        # Serialized pages: (container class, offset, size)
+        self._spool = tempfile.TemporaryFile()
+        self._pages = []
+
+    def set_base_url(self, url):
+        '''
+        Set the URL relative links of the document (styles, template
+        images) are resolved against, for reports saved outside the
+        frontend directory.
+        Args:
+        - url (str): base URL, ending with '/'.
+        '''
+        base = self.find(self._html, 'base')
+        if base is None:
+            base = self._html.new_tag('base')
+            self.find(self._html, 'head').insert(0, base)
+        base['href'] = url
 
     def get_template(self, index_path, template_class='a4-page'):
         '''
-        Open HTML file, parse its content and return <div> element matching
-        the given class in 'template_class'.
+        Return a copy of the <div> element matching the given class in
+        'template_class' of an HTML template file. The template is parsed
+        once and reparsed only if the file changes.
         Args:
         - index_path (str): path to HTML template file.
         - template_class (str): class name of the <div> to extract.
         Returns:
-        - parsed div.
+        - parsed div, filled through its slot map by set_fill_data()
+          until it is added.
         '''
-        html_file = self._open_html(index_path)
-        parsed_html = self._parse_html(html_file)
-
-        div = self.find(parsed_html, template_class, type_='class')
-        parsed_div = self._parse_html(str(div)).div  # copy original div
+        template, slots = self._get_compiled_template(
+            index_path,
+            template_class
+        )
+        parsed_div = copy.copy(template)  # deep copy of compiled div
+        # The page is kept with its map so its id is not reused
+        self._page_slots[id(parsed_div)] = (parsed_div, slots)
         return parsed_div
 
     def add_page(self, page, class_='a4-document'):
         '''
-        Add new page (HTML content) to the body of the HTML file
+        Add new page (HTML content) to the body of the HTML file.
+        The page is serialized to the spool file, later changes to it are
+        not saved.
         Args:
         - page (bs4 tag): parsed HTML element.
+        - class_ (str): class name of the container element.
         '''
-        div_container = self._html.find(class_=class_)
-        # Inserts at top, since print CSS reverses order
-        div_container.insert(0, page)
+        if not any(class_ == page_class for page_class, *_ in self._pages):
+            if self._html.find(class_=class_) is None:
+                raise ValueError(f'Page container not found: {class_}')
+
+        self._page_slots.pop(id(page), None)
+        html = page.prettify() if self._pretty else page.decode()
+        html = html.encode('utf-8')
+        offset = self._spool.seek(0, os.SEEK_END)
+        self._spool.write(html)
+        self._pages.append((class_, offset, len(html)))
 
     def find(self, parsed_html, str_key, type_=None):
         '''
@@ -142,19 +204,19 @@ class WriteHtml():
     def set_fill_data(self, parsed_html, text_dict={}, img_dict={}):
         '''
         Fill HTML elements that math the 'fill-*' class.
+        Pages from get_template() are filled through their slot map, other
+        elements are searched.
         Args:
         - parsed_html (bs4 tag): parsed HTML element.
         - text_dict (dict): key-value (class-str_value) pairs.
         - img_dict (dict): key-value (class-img_path) pairs.
         '''
         for key, value in text_dict.items():
-            elements = self.find_all(parsed_html, f'fill-{key}', type_='class')
-            for element in elements:
+            for element in self._find_slot(parsed_html, key):
                 element.string = value
 
         for key, value in img_dict.items():
-            elements = self.find_all(parsed_html, f'fill-{key}', type_='class')
-            for element in elements:
+            for element in self._find_slot(parsed_html, key):
                 element['src'] = value
 
     def set_string(self, parsed_html, str_key, str_value, type_=None):
@@ -193,10 +255,89 @@ class WriteHtml():
         ''' Save HTML file to path. '''
         self._write_html(path)
 
+    def close(self):
+        ''' Release spooled pages. '''
+        self._page_slots.clear()
+        spool = getattr(self, '_spool', None)
+        if spool is not None:
+            spool.close()
+            self._spool = None
+
     def _set_title(self, parsed_html, title):
         ''' Set HTML document title. '''
         self.set_string(parsed_html, 'title', title)
 
+    def _find_slot(self, parsed_html, key):
+        '''
+        Returns elements of a 'fill-*' slot, resolved by child index paths
+        if the page came from get_template(), else by a tree search.
+        '''
+        slot = f'{CT_FILL_PREFIX}{key}'
+        page, slots = self._page_slots.get(id(parsed_html), (None, None))
+        if page is not parsed_html:
+            return self.find_all(parsed_html, slot, type_='class')
+
+        elements = []
+        for path in slots.get(slot, ()):
+            element = parsed_html
+            try:
+                for index in path:
+                    element = element.contents[index]
+            except (AttributeError, IndexError):
+                element = None
+            # Page was modified since it was cloned, map no longer valid
+            if not isinstance(element, Tag) or \
+                    slot not in element.get('class', ()):
+                return self.find_all(parsed_html, slot, type_='class')
+            elements.append(element)
+        return elements
+
+    def _get_compiled_template(self, index_path, template_class):
+        '''
+        Returns compiled template div and its slot map, parsing the file
+        only when it is not cached or changed on disk.
+        '''
+        stat = os.stat(index_path)
+        stat = (stat.st_mtime_ns, stat.st_size)
+        key = (os.path.abspath(index_path), template_class)
+        with self._templates_lock:
+            cached = self._templates.get(key)
+        if cached is not None and cached[0] == stat:
+            return cached[1], cached[2]
+
+        parsed_html = self._parse_html(self._open_html(index_path))
+        div = self.find(parsed_html, template_class, type_='class')
+        if div is None:
+            raise ValueError(
+                f'Template class {template_class} not found: {index_path}'
+            )
+        template = div.extract()
+        slots = self._compile_slots(template)
+        with self._templates_lock:
+            self._templates[key] = (stat, template, slots)
+        return template, slots
+
+    def _compile_slots(self, template):
+        '''
+        Map every 'fill-*' class of a template to the child index paths of
+        its elements.
+        Returns:
+        - slots (dict): slot class -> list of index tuples.
+        '''
+        slots = {}
+        stack = [(template, ())]
+        while stack:
+            tag, path = stack.pop()
+            for class_ in tag.get('class', ()):
+                if class_.startswith(CT_FILL_PREFIX):
+                    slots.setdefault(class_, []).append(path)
+            stack.extend(
+                (child, path + (index,))
+                for index, child in enumerate(tag.contents)
+                if isinstance(child, Tag)
+            )
+        return slots
+
     def _parse_html(self, html_file):
         ''' Parse HTML file '''
         return BeautifulSoup(html_file, 'html.parser')
@@ -208,6 +349,49 @@ class WriteHtml():
         return html
 
     def _write_html(self, path):
-        ''' Write HTML file '''
-        with open(path, 'w', encoding='utf-8') as f:
-            f.write(self._html.prettify())
+        '''
+        Write HTML file, atomically. The document shell is serialized with
+        a marker comment in each page container, spooled pages are copied
+        in place of the markers.
+        '''
+        containers = list(dict.fromkeys(class_ for class_, *_ in self._pages))
+        markers = []
+        for position, class_ in enumerate(containers):
+            marker = Comment(f'{CT_PAGES_MARKER}{position}')
+            self._html.find(class_=class_).insert(0, marker)
+            markers.append(marker)
+        try:
+            if self._pretty:
+                shell = self._html.prettify()
+            else:
+                shell = self._html.decode()
+        finally:
+            for marker in markers:
+                marker.extract()
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                parts = CT_PAGES_MARKER_PATTERN.split(shell)
+                f.write(parts[0].encode('utf-8'))
+                for position, text in zip(parts[1::2], parts[2::2]):
+                    self._copy_pages(f, containers[int(position)])
+                    f.write(text.encode('utf-8'))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _copy_pages(self, f, class_):
+        '''
+        Copy spooled pages of a container to f, last added first, since
+        pages were inserted at top and print CSS reverses order.
+        '''
+        for page_class, offset, size in reversed(self._pages):
+            if page_class != class_:
+                continue
+            self._spool.seek(offset)
+            while size > 0:
+                chunk = self._spool.read(min(size, CT_COPY_CHUNK))
+                f.write(chunk)
+                size -= len(chunk)
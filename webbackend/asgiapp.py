@@ -0,0 +1,353 @@
+'''
+This module serves the web tier on asyncio: video feeds are pushed by
+coroutines, every other endpoint runs on the Flask app through a WSGI
+bridge.
+It serves as a support module for runhandheldasync.
+'''
+import asyncio
+import io
+import json
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from handheld.webbackend.flask_app import CT_STREAMER_MIMETYPE
+
+CT_DEFAULT_WSGI_THREADS = 16
+# Seconds a viewer waits for a chunk before checking its connection
+CT_VIEWER_WAIT_TIMEOUT = 1.0
+CT_VIDEO_FEED_PATTERN = re.compile(r'^/video_feed(?:/(?P<cam>[^/]+))?$')
+CT_VIEWERS_STATUS_PATH = '/status/viewers'
+
+
+class AsyncFeed:
+    '''
+    Preview chunks of one camera for asyncio viewers.
+    A single pump thread reads the camera broadcaster and publishes the
+    latest chunk on the event loop. Viewers always take the latest chunk
+    when they are ready for one, so a slow viewer skips chunks instead of
+    queueing them. A viewer costs a coroutine, not a thread.
+    '''
+    def __init__(self, video_cam, loop):
+        '''
+        Args:
+        - video_cam (VideoCam): frame source, provides encoded_streamer().
+        - loop (asyncio.AbstractEventLoop): loop of the viewers.
+        '''
+        self._vc = video_cam
+        self._loop = loop
+        self._chunk = None
+        self._seq = 0
+        # Resolved when the next chunk is published
+        self._next = loop.create_future()
+        self._thread = None
+        self.viewers = 0
+
+    async def stream(self, is_disconnected):
+        '''
+        Generate the latest chunk for one viewer, skipping to the latest
+        one after each yield.
+        Args:
+        - is_disconnected (callable): returns True once the viewer left.
+        '''
+        self.viewers += 1
+        self._start_pump()
+        try:
+            seq = 0
+            while not is_disconnected():
+                if self._seq <= seq:
+                    try:
+                        await asyncio.wait_for(
+                            asyncio.shield(self._next),
+                            CT_VIEWER_WAIT_TIMEOUT
+                        )
+                    except asyncio.TimeoutError:
+                        continue
+                seq, chunk = self._seq, self._chunk
+                yield chunk
+        finally:
+            self.viewers -= 1
+
+    def _start_pump(self):
+        ''' Start the pump thread if needed. Event loop only. '''
+        if self._thread is None and self.viewers > 0:
+            self._thread = threading.Thread(
+                target=self._pump,
+                name='AsyncFeedPump',
+                daemon=True
+            )
+            self._thread.start()
+
+    def _pump(self):
+        '''
+        Pump thread: hand broadcaster chunks to the event loop until the
+        last viewer leaves.
+        '''
+        streamer = self._vc.encoded_streamer()
+        try:
+            for chunk in streamer:
+                if self.viewers == 0:
+                    break
+                self._loop.call_soon_threadsafe(self._publish, chunk)
+        except RuntimeError:
+            # Event loop closed
+            return
+        finally:
+            streamer.close()
+        try:
+            self._loop.call_soon_threadsafe(self._pump_stopped)
+        except RuntimeError:
+            pass
+
+    def _publish(self, chunk):
+        ''' Publish a chunk and wake up waiting viewers. Event loop only. '''
+        self._chunk = chunk
+        self._seq += 1
+        waiters, self._next = self._next, self._loop.create_future()
+        waiters.set_result(None)
+
+    def _pump_stopped(self):
+        '''
+        Restart the pump if a viewer came while it was stopping. Event
+        loop only.
+        '''
+        self._thread = None
+        self._start_pump()
+
+
+class HandheldAsgi:
+    '''
+    ASGI application of the handheld web tier.
+    GET /video_feed[/<cam>] is served by AsyncFeed with drop-to-latest
+    backpressure per viewer. Every other request is handed to the Flask
+    app on a small thread pool, so state endpoints, sessions and reports
+    behave as with the Flask server.
+    '''
+    def __init__(self, wrapper, wsgi_threads=CT_DEFAULT_WSGI_THREADS):
+        '''
+        Args:
+        - wrapper (FlaskAppWrapper): app with the shared resources.
+        - wsgi_threads (int): threads running Flask requests.
+        '''
+        self.wrapper = wrapper
+        self._executor = ThreadPoolExecutor(
+            max_workers=wsgi_threads,
+            thread_name_prefix='WsgiBridge'
+        )
+        # camera id -> AsyncFeed
+        self._feeds = {}
+
+    async def __call__(self, scope, receive, send):
+        '''
+        ASGI entry point.
+        '''
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        match = CT_VIDEO_FEED_PATTERN.match(scope['path'])
+        if match and scope['method'] == 'GET':
+            await self._video_feed(match.group('cam'), receive, send)
+        elif scope['path'] == CT_VIEWERS_STATUS_PATH:
+            await self._send_json(send, 200, {
+                cam_id: feed.viewers for cam_id, feed in self._feeds.items()
+            })
+        else:
+            await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        ''' Release the app resources when the server stops. '''
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=False)
+                await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    self.wrapper.close
+                )
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _video_feed(self, cam, receive, send):
+        '''
+        Stream a camera preview in multipart/x-mixed-replace format.
+        Args:
+        - cam (str): camera id, default camera if None.
+        '''
+        cameras = self.wrapper.resources.cameras
+        try:
+            video_cam = cameras.get(cam)
+        except KeyError:
+            await self._send_json(send, 404, {
+                'error': f'Unknown camera: {cam}'
+            })
+            return
+        cam_id = cam or cameras.default_id
+        feed = self._feeds.get(cam_id)
+        if feed is None:
+            feed = AsyncFeed(video_cam, asyncio.get_running_loop())
+            self._feeds[cam_id] = feed
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', CT_STREAMER_MIMETYPE.encode()),
+                (b'cache-control', b'no-store')
+            ]
+        })
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        stream = feed.stream(disconnected.done)
+        try:
+            async for chunk in stream:
+                # Waits while the client socket drains, chunks published
+                # meanwhile are skipped
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True
+                })
+        except OSError:
+            # Client gone while sending
+            pass
+        finally:
+            await stream.aclose()
+            disconnected.cancel()
+
+    async def _wait_disconnect(self, receive):
+        ''' Returns when the client disconnects. '''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    async def _send_json(self, send, status, data):
+        ''' Send a JSON response. '''
+        body = json.dumps(data).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode())
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _wsgi(self, scope, receive, send):
+        '''
+        Run a request on the Flask app in the thread pool. The response
+        body is sent chunk by chunk as the app produces it.
+        '''
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+
+        loop = asyncio.get_running_loop()
+        environ = self._get_environ(scope, bytes(body))
+        await loop.run_in_executor(
+            self._executor,
+            self._run_wsgi,
+            environ,
+            lambda message: asyncio.run_coroutine_threadsafe(
+                send(message),
+                loop
+            ).result()
+        )
+
+    def _run_wsgi(self, environ, send):
+        '''
+        Bridge thread: call the WSGI app and send its response.
+        Args:
+        - environ (dict): WSGI environ.
+        - send (callable): blocking ASGI send.
+        '''
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+            return write
+
+        def write(data):
+            if not response.get('started'):
+                response['started'] = True
+                send({
+                    'type': 'http.response.start',
+                    'status': response['status'],
+                    'headers': response['headers']
+                })
+            if data:
+                send({
+                    'type': 'http.response.body',
+                    'body': bytes(data),
+                    'more_body': True
+                })
+
+        iterable = self.wrapper.app(environ, start_response)
+        try:
+            for data in iterable:
+                write(data)
+            write(b'')
+            send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    def _get_environ(self, scope, body):
+        '''
+        Returns the WSGI environ of an ASGI HTTP request.
+        Args:
+        - scope (dict): ASGI connection scope.
+        - body (bytes): request body.
+        '''
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            # WSGI strings are latin-1 decoded bytes
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+                continue
+            if name == 'CONTENT_LENGTH':
+                continue
+            key = f'HTTP_{name}'
+            if key in environ:
+                separator = '; ' if name == 'COOKIE' else ','
+                value = f'{environ[key]}{separator}{value}'
+            environ[key] = value
+        return environ
@@ -1,11 +1,32 @@
 import time
-from flask import Flask, render_template, Response, jsonify, request
+from flask import (
+    Flask,
+    render_template,
+    Response,
+    jsonify,
+    request,
+    send_file,
+    g
+)
 
 from ais.infrastructure.readconfig import read_yaml_file
 from handheld.automation.handheldopsman import HandheldOpsManager
+from handheld.automation.handheldresources import HandheldResources
+from handheld.webbackend.sessions import (
+    SessionManager,
+    CT_SESSION_COOKIE,
+    CT_SESSION_HEADER,
+    CT_DEFAULT_SESSION_IDLE_TIMEOUT,
+    CT_DEFAULT_SESSION_BUDGET_MB,
+    CT_DEFAULT_MAX_SESSIONS
+)
 
 CT_STREAMER_MIMETYPE = 'multipart/x-mixed-replace; boundary=frame'
 CT_CAPTURE_MIMETYPE = 'image/jpeg'
+CT_JSON_MIMETYPE = 'application/json'
+CT_PDF_MIMETYPE = 'application/pdf'
+# Content-addressed images never change
+CT_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
 
 image_cache = {}
 
@@ -18,14 +39,11 @@ class FlaskAppWrapper:
     '''
     def __init__(self, name, config_file):
         '''
-        Initialize the Flask application and the HandheldOpsManager instance.
+        Initialize the Flask application and the session layer.
         Args:
         - name (str): The name of the Flask application.
         Sets up the Flask app with necessary configurations and endpoints.
         '''
-        # init
-        self._cached_images = {}
-
         # Load config
         self.config = read_yaml_file(config_file)
 
@@ -40,14 +58,61 @@ class FlaskAppWrapper:
             static_folder=static_dir
         )
 
-        # HandheldOpsManager instance
-        self.handheld_ops_manager = HandheldOpsManager(self.config)
+        # One HandheldOpsManager per station session, all sharing camera,
+        # criteria caches and storage
+        self.resources = HandheldResources(self.config)
+        sessions_config = self.config.get('sessions', {})
+        self.sessions = SessionManager(
+            lambda: HandheldOpsManager(self.config, resources=self.resources),
+            idle_timeout=sessions_config.get(
+                'idle_timeout', CT_DEFAULT_SESSION_IDLE_TIMEOUT
+            ),
+            budget_mb=sessions_config.get(
+                'budget_mb', CT_DEFAULT_SESSION_BUDGET_MB
+            ),
+            max_sessions=sessions_config.get(
+                'max_sessions', CT_DEFAULT_MAX_SESSIONS
+            )
+        )
+        self.app.after_request(self._set_session_cookie)
+        self.app.teardown_request(self._end_session_request)
         self.selected_defect = ''
 
         # Define endpoints for various states and operations
         self.add_endpoint('/', 'index', self.index)
         self.add_endpoint('/get_image', 'get_image', self.get_image)
         self.add_endpoint('/video_feed', 'video_feed', self.video_feed)
+        self.add_endpoint(
+            '/get_image/<cam>',
+            'get_camera_image',
+            self.get_image
+        )
+        self.add_endpoint(
+            '/video_feed/<cam>',
+            'camera_video_feed',
+            self.video_feed
+        )
+        self.add_endpoint(
+            '/status/stream',
+            'stream_status',
+            self.stream_status
+        )
+        self.add_endpoint(
+            '/status/stream/<cam>',
+            'camera_stream_status',
+            self.stream_status
+        )
+        self.add_endpoint(
+            '/status/cameras',
+            'cameras_status',
+            self.cameras_status
+        )
+        self.add_endpoint('/status/io', 'io_status', self.io_status)
+        self.add_endpoint(
+            '/status/sessions',
+            'sessions_status',
+            self.sessions_status
+        )
         self.add_endpoint(
             '/states/inspector_state',
             'inspector_state',
@@ -98,11 +163,81 @@ class FlaskAppWrapper:
             'get_image_cache',
             self.get_image_cache
         )
+        self.add_endpoint(
+            '/images/<digest>',
+            'stored_image',
+            self.stored_image
+        )
         self.add_endpoint(
             '/actions/delete_page',
             'delete_page',
             self.delete_page, methods=['POST']
         )
+        self.add_endpoint(
+            '/criteria_matrix',
+            'criteria_matrix',
+            self.criteria_matrix
+        )
+        self.add_endpoint(
+            '/actions/selection_options',
+            'selection_options',
+            self.selection_options, methods=['POST']
+        )
+        self.add_endpoint(
+            '/reports/<job_id>/status',
+            'report_status',
+            self.report_status
+        )
+        self.add_endpoint(
+            '/reports/<job_id>/download',
+            'report_download',
+            self.report_download
+        )
+
+    @property
+    def handheld_ops_manager(self):
+        '''
+        Ops manager of the station making the current request, identified
+        by the X-Handheld-Session header or the session cookie. Endpoints
+        serving shared resources (video feeds, status, stored images,
+        report jobs) use self.resources instead, so they never create a
+        session.
+        '''
+        return self._get_session()[1]
+
+    def _get_session(self):
+        '''
+        Returns (session id, ops manager) of the current request, the
+        session is created if the station has none.
+        '''
+        if 'handheld_session' not in g:
+            session_id = (
+                request.headers.get(CT_SESSION_HEADER) or
+                request.cookies.get(CT_SESSION_COOKIE)
+            )
+            g.handheld_session = self.sessions.get(session_id)
+        return g.handheld_session
+
+    def _end_session_request(self, exc=None):
+        ''' Tell the session manager the request of a session ended. '''
+        if 'handheld_session' in g:
+            self.sessions.done(g.handheld_session[0])
+
+    def _set_session_cookie(self, response):
+        '''
+        Send the session id back to the station if it did not have it.
+        '''
+        if 'handheld_session' in g:
+            session_id = g.handheld_session[0]
+            if request.cookies.get(CT_SESSION_COOKIE) != session_id:
+                response.set_cookie(
+                    CT_SESSION_COOKIE,
+                    session_id,
+                    httponly=True,
+                    samesite='Lax'
+                )
+            response.headers[CT_SESSION_HEADER] = session_id
+        return response
 
     def add_endpoint(self, route, endpoint_name, handler, methods=['GET']):
         '''
@@ -116,26 +251,98 @@ class FlaskAppWrapper:
         '''
         self.app.add_url_rule(route, endpoint_name, handler, methods=methods)
 
-    def video_feed(self):
+    def video_feed(self, cam=None):
         '''
         Endpoint for video streaming.
+        Args:
+        - cam (str, optional): camera id, default camera if not given.
         Returns:
         - Response: Video stream in multipart/x-mixed-replace format.
         '''
-        streamer = self.handheld_ops_manager.video_encode_stream()
+        try:
+            streamer = self.resources.cameras.get(cam).encoded_streamer()
+        except KeyError:
+            return self._unknown_camera(cam)
         response = Response(streamer, mimetype=CT_STREAMER_MIMETYPE)
         return response
 
-    def get_image(self):
+    def stream_status(self, cam=None):
+        '''
+        Endpoint to report video streaming pacing.
+        Args:
+        - cam (str, optional): camera id, default camera if not given.
+        Returns:
+        - JSON: achieved versus target fps, dropped frames and time spent
+          per stage.
+        '''
+        try:
+            stats = self.resources.cameras.get(cam).stream_stats()
+        except KeyError:
+            return self._unknown_camera(cam)
+
+        response = None
+        if stats is None:
+            response = jsonify({'error': 'No stream started yet'}), 404
+        else:
+            response = jsonify(stats)
+
+        return response
+
+    def cameras_status(self):
+        '''
+        Endpoint to report the cameras.
+        Returns:
+        - JSON: default camera, per camera frame sequence number and
+          stream stats, cameras that failed to open.
+        '''
+        return jsonify(self.resources.cameras.status())
+
+    def _unknown_camera(self, cam):
+        ''' Returns the unknown camera error response. '''
+        return jsonify({'error': f'Unknown camera: {cam}'}), 404
+
+    def io_status(self):
+        '''
+        Endpoint to report local storage status.
+        Returns:
+        - JSON: pending, written and failed image writes.
+        '''
+        return jsonify(self.resources.local_output.status())
+
+    def sessions_status(self):
+        '''
+        Endpoint to report station sessions.
+        Returns:
+        - JSON: sessions idle time and memory usage, shared image store.
+        '''
+        return jsonify({
+            **self.sessions.status(),
+            'images': self.resources.images.status()
+        })
+
+    def get_image(self, cam=None):
         '''
         Endpoint to return the latest captured image.
+        Images requested for a report slot (?slot=image-context) are kept
+        for the server side report.
+        Args:
+        - cam (str, optional): camera id, default camera if not given.
         '''
-        image_bytes = self.handheld_ops_manager.video_capture_image()
+        try:
+            image_bytes = self.handheld_ops_manager.video_capture_image(cam)
+        except KeyError:
+            return self._unknown_camera(cam)
+        slot = request.args.get('slot')
 
         response = None
         if image_bytes is None:
             response = jsonify({'error': 'No frames captured yet'}), 404
         else:
+            if slot:
+                self.handheld_ops_manager.record_report_image(
+                    slot,
+                    image_bytes
+                )
             response = Response(image_bytes, mimetype=CT_CAPTURE_MIMETYPE)
             response.headers['Cache-Control'] = (
                 'no-store, no-cache, must-revalidate, max-age=0'
@@ -145,21 +352,48 @@ class FlaskAppWrapper:
 
     def get_image_cache(self, cache_key):
         '''
-        Endpoint to return cached images.
+        Endpoint to return cached images by report slot.
         '''
-        image_bytes = self._cached_images.get(cache_key)
+        return self.stored_image(
+            self.handheld_ops_manager.cached_image(cache_key)
+        )
+
+    def stored_image(self, digest):
+        '''
+        Endpoint to return stored images by content digest.
+        Images are immutable, served with a strong ETag and cached by the
+        browser, so each one is transferred once.
+        '''
+        image = self.resources.images.get(digest)
 
         response = None
-        if image_bytes is None:
-            response = jsonify({'error': 'No frames captured yet'}), 404
+        etag = f'"{digest}"'
+        if image is None:
+            response = jsonify({'error': 'Image not found'}), 404
+        elif etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=304)
         else:
-            response = Response(image_bytes, mimetype=CT_CAPTURE_MIMETYPE)
-            response.headers['Cache-Control'] = (
-                'no-store, no-cache, must-revalidate, max-age=0'
-            )
+            image_bytes, mimetype = image
+            response = Response(image_bytes, mimetype=mimetype)
+
+        if image is not None:
+            response.headers['ETag'] = etag
+            response.headers['Cache-Control'] = CT_IMMUTABLE_CACHE_CONTROL
 
         return response
 
+    def _image_urls(self, images):
+        '''
+        Returns report slot -> image URL, images referenced by digest.
+        Args:
+        - images (dict): report slot -> image digest.
+        '''
+        return {
+            slot: f'/images/{digest}'
+            for slot, digest in images.items()
+            if digest
+        }
+
     def _cache_busted_url(self, url):
         '''
         Cache busting. Add timestamp to url to force the browser to load the
@@ -169,7 +403,55 @@ class FlaskAppWrapper:
         Returns:
         - url + timestamp (str)
         '''
-        return f'{url}?t={time.time()}'
+        separator = '&' if '?' in url else '?'
+        return f'{url}{separator}t={time.time()}'
+
+    def _report_job_urls(self, job_id):
+        '''
+        Returns report job status and download URLs.
+        '''
+        return {
+            'id': job_id,
+            'status_url': f'/reports/{job_id}/status',
+            'download_url': f'/reports/{job_id}/download'
+        }
+
+    def report_status(self, job_id):
+        '''
+        Endpoint to poll a report job.
+        Returns:
+        - JSON: job state ('queued', 'building', 'rendering', 'done' or
+          'failed'), timings and error.
+        '''
+        status = self.resources.reports.status(job_id)
+
+        response = None
+        if status is None:
+            response = jsonify({'error': 'Unknown report job'}), 404
+        else:
+            response = jsonify({**status, **self._report_job_urls(job_id)})
+
+        return response
+
+    def report_download(self, job_id):
+        '''
+        Endpoint to download the PDF of a finished report job.
+        '''
+        report = self.resources.reports.get_pdf(job_id)
+
+        response = None
+        if report is None:
+            response = jsonify({'error': 'Report not available'}), 404
+        else:
+            pdf_path, file_name = report
+            response = send_file(
+                pdf_path,
+                mimetype=CT_PDF_MIMETYPE,
+                as_attachment=True,
+                download_name=file_name
+            )
+
+        return response
 
     def inspector_state(self):
         '''
@@ -268,6 +550,7 @@ class FlaskAppWrapper:
         defects = self.handheld_ops_manager.qc.get_defects()
         quality = self.handheld_ops_manager.qc.get_quality()
         finish = self.handheld_ops_manager.qc.get_finish()
+        matrix = self.handheld_ops_manager.criteria_matrix()
 
         # Prepare data for the report
         report_data = {
@@ -300,6 +583,13 @@ class FlaskAppWrapper:
                 'n_inspection': n_inspection
             }
         }
+        # Criteria are resolved locally by the frontend, if a project
+        # matrix is available
+        if matrix is not None:
+            response['data']['criteria-matrix'] = {
+                'version': matrix[0],
+                'url': f'/criteria_matrix?v={matrix[0]}'
+            }
         return jsonify(response)
 
     def label_state(self):
@@ -327,7 +617,9 @@ class FlaskAppWrapper:
                 'screen': '/video_feed',
                 'report': {
                     'images': {
-                        'image-partid': self._cache_busted_url('get_image')
+                        'image-partid': self._cache_busted_url(
+                            'get_image?slot=image-partid'
+                        )
                     },
                     'text': {
                         'page-number': n_inspection
@@ -358,7 +650,8 @@ class FlaskAppWrapper:
         ) = self.handheld_ops_manager.selection_state(
             defect_type,
             surface_quality,
-            finish
+            finish,
+            defect_name
         )
 
         report_data = {
@@ -391,14 +684,73 @@ class FlaskAppWrapper:
         }
         return jsonify(response)
 
+    def criteria_matrix(self):
+        '''
+        Endpoint to return the criteria matrix of the current project.
+        Versioned with an ETag and gzip compressed when accepted, so it is
+        only transferred once per project version.
+        '''
+        matrix = self.handheld_ops_manager.criteria_matrix()
+
+        if matrix is None:
+            return jsonify({'error': 'No project selected'}), 404
+
+        version, json_bytes, gzip_bytes = matrix
+        etag = f'"{version}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=304)
+        elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response = Response(gzip_bytes, mimetype=CT_JSON_MIMETYPE)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(json_bytes, mimetype=CT_JSON_MIMETYPE)
+        response.headers['ETag'] = etag
+        response.headers['Vary'] = 'Accept-Encoding'
+        # Version is part of the URL given in standby_state
+        response.headers['Cache-Control'] = 'private, max-age=31536000'
+
+        return response
+
+    def selection_options(self):
+        '''
+        Endpoint to get dependent options of the defect selection form.
+        Only valid combinations are offered for the partial selection.
+        Returns:
+        - JSON: Response including filtered select options.
+        '''
+        data = request.get_json().get('data')
+
+        options = self.handheld_ops_manager.selection_options(
+            data.get('defect-type'),
+            data.get('surface-quality')
+        )
+
+        response = {
+            'data': {
+                'select': options
+            }
+        }
+        return jsonify(response)
+
     def criteria_state(self):
         '''
         Handles the criteria state for defect evaluation.
         Processes user selection and builds appropriate HTTP response.
+        When criteria were resolved locally by the frontend, the final
+        defect selection comes with this request.
         Returns:
         - JSON: Response including next state and additional data.
         '''
         action = request.get_json().get('action')
+        selection = request.get_json().get('data') or {}
+
+        if selection.get('defect-type'):
+            self.handheld_ops_manager.selection_state(
+                selection['defect-type'],
+                selection.get('surface-quality'),
+                selection.get('finish'),
+                selection.get('defect-name')
+            )
 
         next_state, action, n_inspection = (
             self.handheld_ops_manager.criteria_state(action)
@@ -452,7 +804,9 @@ class FlaskAppWrapper:
                 'guideline_side': guideline_side,
                 'report': {
                     'images': {
-                        'image-context': self._cache_busted_url('get_image')
+                        'image-context': self._cache_busted_url(
+                            'get_image?slot=image-context'
+                        )
                     },
                     'text': {
                         'page-number': n_inspection
@@ -488,7 +842,9 @@ class FlaskAppWrapper:
                 'screen': self._cache_busted_url('get_image'),
                 'report': {
                     'images': {
-                        'image-detail': self._cache_busted_url('get_image')
+                        'image-detail': self._cache_busted_url(
+                            'get_image?slot=image-detail'
+                        )
                     },
                     'text': {
                         'page-number': n_inspection
@@ -512,9 +868,6 @@ class FlaskAppWrapper:
             self.handheld_ops_manager.confirmation_state(front_action)
         )
 
-        # Cache captured images for later retrieval via /get_image_cache
-        self._cached_images = cached_images
-
         response = {
             'nextState': next_state,
             'actions': {
@@ -529,7 +882,7 @@ class FlaskAppWrapper:
                 'screen': '/video_feed',
                 'report': {
                     'text': {**cached_data, 'page-number': n_inspection},
-                    'images': {k: f'/get_image_cache/{k}' for k in cached_images}  # noqa
+                    'images': self._image_urls(cached_images)
                 },
                 'n_inspection': n_inspection
             }
@@ -556,8 +909,6 @@ class FlaskAppWrapper:
             cached_images
         ) = self.handheld_ops_manager.end_state(front_action, raw_defect_type)
 
-        self._cached_images = cached_images
-
         # Build the response based on the state machine's output
         response = {
             'nextState': next_state,
@@ -574,20 +925,27 @@ class FlaskAppWrapper:
                 'screen': '/video_feed',
                 'report': {
                     'text': {**cached_data, 'page-number': n_inspection},
-                    'images': {k: f'/get_image_cache/{k}' for k in cached_images}  # noqa
+                    'images': self._image_urls(cached_images)
                 },
                 'n_inspection': n_inspection
             }
         }
+        # PDF is rendered in the background, the frontend polls the job
+        if action == 'print':
+            response['data']['report-job'] = self._report_job_urls(
+                self.handheld_ops_manager.report_job
+            )
 
         return jsonify(response)
 
     def index(self):
         '''
-        Renders the main page (index.html).
+        Renders the main page (index.html). The station session is
+        created here, so the page load issues the session cookie.
         Returns:
         - Rendered template: Renders the 'index.html' template.
         '''
+        self._get_session()
         return render_template('index.html')
 
     def run(self):
@@ -595,10 +953,23 @@ class FlaskAppWrapper:
         Starts the Flask server on host '0.0.0.0' and port 5001.
         The app runs in threaded mode to handle multiple requests
         simultaneously.'
+        Sessions are released and pending image writes flushed when the
+        server stops.
+        '''
+        try:
+            self.app.run(
+                host=self.config['flask']['host'],
+                port=self.config['flask']['port'],
+                threaded=self.config['flask']['threaded'],
+                debug=self.config['flask']['debug']
+            )
+        finally:
+            self.close()
+
+    def close(self):
         '''
-        self.app.run(
-            host=self.config['flask']['host'],
-            port=self.config['flask']['port'],
-            threaded=self.config['flask']['threaded'],
-            debug=self.config['flask']['debug']
-        )
+        Release every session, flush pending image writes and reports and
+        release the cameras.
+        '''
+        self.sessions.close()
+        self.resources.release()
@@ -0,0 +1,204 @@
+'''
+This module maps handheld stations to their own inspection state.
+It serves as a support module for webbackend/flask_app.
+'''
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+CT_SESSION_COOKIE = 'handheld_session'
+CT_SESSION_HEADER = 'X-Handheld-Session'
+CT_DEFAULT_SESSION_IDLE_TIMEOUT = 3600
+CT_DEFAULT_SESSION_BUDGET_MB = 512
+CT_DEFAULT_MAX_SESSIONS = 16
+# Seconds between eviction checks, new sessions are always checked
+CT_EVICT_INTERVAL = 5.0
+# Session entry fields
+CT_OPS_MANAGER = 0
+CT_LAST_USED = 1
+CT_IN_FLIGHT = 2
+CT_DROPPED = 3
+
+
+class SessionManager:
+    '''
+    Session id -> HandheldOpsManager, created on first request of a
+    station. Only server issued ids are accepted, an unknown id gets a new
+    session and id, so a client can not choose its session id.
+    Sessions idle for longer than idle_timeout are evicted, and least
+    recently used ones when over max_sessions or the memory budget.
+    Sessions with requests in flight are never evicted, nor least recently
+    used ones holding report pages not printed yet.
+    Every get() must be paired with a done() once the request ends.
+    '''
+    def __init__(
+            self,
+            factory,
+            idle_timeout=CT_DEFAULT_SESSION_IDLE_TIMEOUT,
+            budget_mb=CT_DEFAULT_SESSION_BUDGET_MB,
+            max_sessions=CT_DEFAULT_MAX_SESSIONS
+    ):
+        '''
+        Args:
+        - factory (callable): returns a new HandheldOpsManager.
+        - idle_timeout (float): seconds before an unused session is
+          evicted.
+        - budget_mb (float): memory budget of all sessions, see
+          HandheldOpsManager.memory_usage().
+        - max_sessions (int): max concurrent sessions.
+        '''
+        self._factory = factory
+        self.idle_timeout = idle_timeout
+        self.budget = budget_mb * 1024 * 1024
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # session id -> [ops manager, last used, requests in flight,
+        # dropped], LRU order
+        self._sessions = OrderedDict()
+        # Dropped sessions with requests in flight, released by done()
+        self._dropped = {}
+        self._next_evict = 0
+        self.evicted = 0
+
+    def get(self, session_id=None):
+        '''
+        Returns the ops manager of a session for a request, creating the
+        session if needed. Call done() when the request ends.
+        Args:
+        - session_id (str, optional): id sent by the client. A new session
+          is created if missing or unknown.
+        Returns:
+        - (session_id, ops manager) tuple.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None:
+                session[CT_LAST_USED] = now
+                session[CT_IN_FLIGHT] += 1
+                self._sessions.move_to_end(session_id)
+                evict = now >= self._next_evict
+        if session is not None:
+            if evict:
+                self._evict()
+            return session_id, session[CT_OPS_MANAGER]
+
+        # Created outside the lock, first request of a station
+        session_id = secrets.token_urlsafe(16)
+        session = [self._factory(), now, 1, False]
+        with self._lock:
+            self._sessions[session_id] = session
+
+        self._evict()
+        return session_id, session[CT_OPS_MANAGER]
+
+    def done(self, session_id):
+        '''
+        End a request of a session, see get(). A session dropped while
+        the request ran is released.
+        Args:
+        - session_id (str)
+        '''
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._dropped.get(session_id)
+            if session is None:
+                return
+            session[CT_IN_FLIGHT] -= 1
+            release = session[CT_DROPPED] and session[CT_IN_FLIGHT] == 0
+            if release:
+                del self._dropped[session_id]
+        if release:
+            session[CT_OPS_MANAGER].release()
+
+    def drop(self, session_id):
+        '''
+        End a session and release its state, once its requests in flight
+        are done.
+        Args:
+        - session_id (str)
+        '''
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None and session[CT_IN_FLIGHT] > 0:
+                session[CT_DROPPED] = True
+                self._dropped[session_id] = session
+                session = None
+        if session is not None:
+            session[CT_OPS_MANAGER].release()
+
+    def status(self):
+        '''
+        Returns sessions status.
+        Returns:
+        - status (dict): sessions with idle seconds, requests in flight
+          and memory usage, memory budget and evicted sessions.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            sessions = [
+                (session_id, list(session))
+                for session_id, session in self._sessions.items()
+            ]
+        return {
+            'sessions': [
+                {
+                    # Ids are credentials, only a prefix is reported
+                    'id': session_id[:6],
+                    'idle': now - session[CT_LAST_USED],
+                    'in_flight': session[CT_IN_FLIGHT],
+                    'nbytes': session[CT_OPS_MANAGER].memory_usage()
+                }
+                for session_id, session in sessions
+            ],
+            'budget': self.budget,
+            'max_sessions': self.max_sessions,
+            'evicted': self.evicted
+        }
+
+    def close(self):
+        ''' Release every session. '''
+        with self._lock:
+            sessions = list(self._sessions.values())
+            sessions += list(self._dropped.values())
+            self._sessions.clear()
+            self._dropped.clear()
+        for session in sessions:
+            session[CT_OPS_MANAGER].release()
+
+    def _evict(self):
+        '''
+        Evict idle sessions, then least recently used ones over the
+        session limit or memory budget. Sessions with requests in flight
+        are kept, and so are sessions with report pages for the least
+        recently used eviction.
+        '''
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            self._next_evict = now + CT_EVICT_INTERVAL
+            for session_id, session in list(self._sessions.items()):
+                if session[CT_IN_FLIGHT] == 0 and \
+                        now - session[CT_LAST_USED] > self.idle_timeout:
+                    evicted.append(self._sessions.pop(session_id))
+
+            usage = {
+                session_id: session[CT_OPS_MANAGER].memory_usage()
+                for session_id, session in self._sessions.items()
+            }
+            nbytes = sum(usage.values())
+            for session_id, session in list(self._sessions.items()):
+                if len(self._sessions) <= self.max_sessions and \
+                        nbytes <= self.budget:
+                    break
+                if session[CT_IN_FLIGHT] > 0 or \
+                        session[CT_OPS_MANAGER].has_report_pages():
+                    continue
+                evicted.append(self._sessions.pop(session_id))
+                nbytes -= usage[session_id]
+            self.evicted += len(evicted)
+
+        for session in evicted:
+            session[CT_OPS_MANAGER].release()
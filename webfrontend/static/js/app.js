@@ -51,11 +51,39 @@ const btnNew = document.getElementById('btn-new');
 btnNew.addEventListener('click', function () { handleCaptureClick.call(this, 'new'); });
 
 const btnPrint = document.getElementById('btn-print');
-btnPrint.addEventListener('click', function () {
-    window.print();  // Show print dialog
-    handleCaptureClick.call(this, 'print');
+btnPrint.addEventListener('click', async function () {
+    await handleCaptureClick.call(this, 'print');
+    // PDF is rendered by the server, inspection can go on meanwhile
+    const job = statemanager.state.data?.['report-job'];
+    if (job) {
+        await downloadReport(job);
+    }
 });
 
+async function downloadReport(job) {
+    // Retry polls the same job again, no new report is requested
+    while (true) {
+        const status = await statemanager.pollReportJob(job);
+        if (status?.state === 'done') {
+            downloadFile(status.download_url);
+            return;
+        }
+        const reason = status?.error ?? 'report status not available';
+        if (!window.confirm(`Report ${job.id} failed: ${reason}\nRetry?`)) {
+            return;
+        }
+    }
+}
+
+function downloadFile(url) {
+    const link = document.createElement('a');
+    link.href = url;
+    link.download = '';
+    document.body.appendChild(link);
+    link.click();
+    link.remove();
+}
+
 
 document.querySelectorAll(".btn-deffect").forEach((button) => {
     button.addEventListener("click", function (event) {
@@ -102,6 +130,23 @@ formSubmit.addEventListener('submit', function(e) {
     });
 });
 
+// DEFECT SELECTION dependent options, only valid combinations are offered
+const defectTypeSelect = document.getElementById('defect-type');
+const surfaceQualitySelect = document.getElementById('surface-quality');
+defectTypeSelect.addEventListener('change', updateSelectionOptions);
+surfaceQualitySelect.addEventListener('change', updateSelectionOptions);
+
+async function updateSelectionOptions() {
+    const selection = {
+        'defect-type': defectTypeSelect.value,
+        'surface-quality': surfaceQualitySelect.value
+    };
+    // Computed locally from the criteria matrix, no round trip
+    const options = statemanager.selectionOptions(selection)
+        ?? await statemanager.fetchSelectionOptions(selection);
+    if (options) uiManager.updateSelectOptions(options, true);
+}
+
 // DEFECT SELECTION form submit
 const defectFormSubmit = document.getElementById('defect-selection-form');
 defectFormSubmit.addEventListener('submit', function(e) {
@@ -115,14 +160,19 @@ defectFormSubmit.addEventListener('submit', function(e) {
 
     const fullDefect = `${defectType} - ${surfaceQuality} - ${finish}`;
 
-    handleCaptureClick.call(this, '', {
+    const selection = {
         // Criteria state data
         'defect-type': defectType,
         'surface-quality': surfaceQuality,
         'finish': finish,
         // Report data
         'defect-name': fullDefect.toUpperCase()
-    });
+    };
+
+    // Criteria resolved locally, selection is reported with next request
+    if (statemanager.resolveSelection(selection)) return;
+
+    handleCaptureClick.call(this, '', selection);
 });
 
 
@@ -6,10 +6,18 @@ class StateManager {
             data: null
         };
         this.subscribers = [];
+        // Project criteria matrix, criteria are resolved locally
+        this.criteriaMatrix = null;
+        // Final selection resolved locally, reported with next request
+        this.pendingSelection = null;
     }
 
     async transitionState(payload, endpoint='') {
         endpoint = endpoint || `/states/${this.state.currentState}`;
+        if (this.pendingSelection) {
+            payload = {...payload, data: {...this.pendingSelection, ...payload.data}};
+            this.pendingSelection = null;
+        }
         try {
             const response = await fetch(endpoint, {
                 method: 'POST',
@@ -28,6 +36,8 @@ class StateManager {
 
             this.notifySubscribers();
 
+            this.loadCriteriaMatrix(result.data?.['criteria-matrix']);
+
             return true;
         } catch (error) {
             console.error('State transition failed:', error)
@@ -35,6 +45,176 @@ class StateManager {
         }
     }
 
+    async loadCriteriaMatrix(matrixInfo) {
+        // Fetch matrix once per project version (ETag cached by the browser)
+        if (!matrixInfo || this.criteriaMatrix?.version === matrixInfo.version) return;
+        try {
+            const response = await fetch(matrixInfo.url);
+            const matrix = await response.json();
+
+            const lookup = new Map();
+            // Dependent options, same facets as the backend
+            const facets = {
+                qualityByDefect: new Map(),
+                finishByPair: new Map(),
+                finishByDefect: new Map(),
+                finishByQuality: new Map()
+            };
+            const addFacet = (facet, key, value) => {
+                if (!facet.has(key)) facet.set(key, new Set());
+                facet.get(key).add(value);
+            };
+            const rows = matrix.rows;
+            for (let i = 0; i < rows.length; i += 4) {
+                const defect = matrix.defects[rows[i]];
+                const quality = matrix.qualities[rows[i + 1]];
+                const finish = matrix.finishes[rows[i + 2]];
+                const key = this._selectionKey(defect, quality, finish);
+                lookup.set(key, matrix.criteria[rows[i + 3]]);
+                addFacet(facets.qualityByDefect, defect, quality);
+                addFacet(facets.finishByPair, `${defect}\u0000${quality}`, finish);
+                addFacet(facets.finishByDefect, defect, finish);
+                addFacet(facets.finishByQuality, quality, finish);
+            }
+            this.criteriaMatrix = {
+                version: matrix.version,
+                lookup: lookup,
+                facets: facets,
+                qualities: matrix.qualities,
+                finishes: matrix.finishes
+            };
+        } catch (error) {
+            console.error('Criteria matrix request failed:', error)
+            this.criteriaMatrix = null;
+        }
+    }
+
+    resolveSelection(selection) {
+        // Resolve selection_state locally, without a server round trip.
+        // Returns false if the matrix is not available.
+        if (!this.criteriaMatrix || this.state.currentState !== 'selection_state') {
+            return false;
+        }
+        const key = this._selectionKey(
+            selection['defect-type'],
+            selection['surface-quality'],
+            selection['finish']
+        );
+        const criteria = this.criteriaMatrix.lookup.get(key) ?? null;
+        const nInspection = this.state.data?.n_inspection;
+
+        this.pendingSelection = {
+            'defect-type': selection['defect-type'],
+            'surface-quality': selection['surface-quality'],
+            'finish': selection['finish'],
+            'defect-name': selection['defect-name']
+        };
+        // Same state the backend selection_state would return
+        this.state = {
+            currentState: 'criteria_state',
+            actions: {
+                report: {
+                    add_page: false,
+                    remove_page: false,
+                    update_page: true,
+                    page_number: nInspection
+                }
+            },
+            data: {
+                screen: '/video_feed',
+                report: {
+                    text: {
+                        'criteria': criteria,
+                        'defect-name': selection['defect-name'],
+                        'page-number': nInspection
+                    }
+                },
+                'ui-content': {
+                    'defect-type': selection['defect-type'],
+                    'surface-quality': selection['surface-quality'],
+                    'finish': selection['finish'],
+                    'criteria': criteria
+                },
+                n_inspection: nInspection
+            }
+        };
+        console.log(this.state.currentState);
+
+        this.notifySubscribers();
+
+        return true;
+    }
+
+    _selectionKey(defect, quality, finish) {
+        return [defect, quality, finish]
+            .map(value => (value || '').trim().toLowerCase())
+            .join('\u0000');
+    }
+
+    selectionOptions(selection) {
+        // Dependent options for a partial defect selection, computed from
+        // the criteria matrix. Returns null if the matrix is not loaded.
+        if (!this.criteriaMatrix) return null;
+        const { facets, qualities, finishes } = this.criteriaMatrix;
+        const defect = (selection['defect-type'] || '').trim().toLowerCase();
+        const quality = (selection['surface-quality'] || '').trim().toLowerCase();
+        const options = values => [...values]
+            .map(value => value.toUpperCase())
+            .sort();
+
+        let qualityValues = qualities;
+        if (defect) qualityValues = facets.qualityByDefect.get(defect) || [];
+
+        let finishValues = finishes;
+        if (defect && quality) {
+            finishValues = facets.finishByPair.get(`${defect}\u0000${quality}`) || [];
+        } else if (defect) {
+            finishValues = facets.finishByDefect.get(defect) || [];
+        } else if (quality) {
+            finishValues = facets.finishByQuality.get(quality) || [];
+        }
+
+        return {
+            'surface-quality': options(qualityValues),
+            'finish': options(finishValues)
+        };
+    }
+
+    async fetchSelectionOptions(selection) {
+        // Dependent options for a partial defect selection, server side.
+        // Only used while no criteria matrix is loaded.
+        try {
+            const response = await fetch('/actions/selection_options', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json'},
+                body: JSON.stringify({ data: selection })
+            });
+
+            const result = await response.json();
+            return result.data?.select || null;
+        } catch (error) {
+            console.error('Selection options request failed:', error)
+            return null;
+        }
+    }
+
+    async pollReportJob(job, interval=1000) {
+        // Wait for a server side report job, returns its final status
+        while (true) {
+            try {
+                const response = await fetch(job.status_url);
+                const status = await response.json();
+                if (!response.ok || ['done', 'failed'].includes(status.state)) {
+                    return status;
+                }
+            } catch (error) {
+                console.error('Report status request failed:', error)
+                return null;
+            }
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    }
+
     subscribe(callback) {
         this.subscribers.push(callback);
         return () => this.unsubscribe(callback);
@@ -99,11 +99,15 @@ export class UIManager {
     }
 
     _updateSelectsFromState(state) {
-        const selectData = state.data?.select || {};
+        this.updateSelectOptions(state.data?.select || {});
+    }
+
+    updateSelectOptions(selectData, keepSelection=false) {
         this.selectElements.forEach(select => {
             const key = select.dataset.stateSelect;
             const values = selectData[key];
             if (Array.isArray(values)) {
+                const previousValue = select.value;
                 // Create dynamic placeholder
                 const label = key.replace(/-/g, ' ').toUpperCase();
                 const placeholder = document.createElement('option');
@@ -121,6 +125,10 @@ export class UIManager {
                     option.textContent = item;
                     select.appendChild(option);
                 });
+                // Keep previous choice if it is still valid
+                if (keepSelection && values.some(item => item.toLowerCase() === previousValue)) {
+                    select.value = previousValue;
+                }
             }
         });
     }